@@ -0,0 +1,69 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def forwards_func(apps, schema_editor):
+    """Mark all the binary packages as dirty to compute their rollups at the next refresh."""
+    Package = apps.get_model('bin_packages', 'Package')
+    DirtyPackage = apps.get_model('bin_packages', 'DirtyPackage')
+
+    pks = list(Package.objects.values_list('pk', flat=True))
+    DirtyPackage.objects.bulk_create([DirtyPackage(package_id=pk) for pk in pks], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bin_packages', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyPackage',
+            fields=[
+                ('package', models.OneToOneField(
+                    help_text='Binary package.', on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                    related_name='+', serialize=False, to='bin_packages.package', verbose_name='binary package')),
+            ],
+            options={
+                'verbose_name': 'dirty package',
+                'verbose_name_plural': 'dirty packages',
+            },
+        ),
+        migrations.CreateModel(
+            name='PackageRollup',
+            fields=[
+                ('package', models.OneToOneField(
+                    help_text='Binary package.', on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                    related_name='rollup', serialize=False, to='bin_packages.package',
+                    verbose_name='binary package')),
+                ('versions_count', models.PositiveIntegerField(
+                    default=0, help_text='Number of versions of the binary package.')),
+                ('os_list', models.TextField(
+                    blank=True, default='',
+                    help_text='Comma-separated list of the operating systems of the versions of the binary package.',
+                    verbose_name='operating systems')),
+                ('hosts_count', models.PositiveIntegerField(
+                    default=0, help_text='Number of hosts that have it installed.')),
+                ('hosts_upgrades_count', models.PositiveIntegerField(
+                    default=0, help_text='Number of hosts that have it installed and pending an upgrade.')),
+                ('hosts_security_count', models.PositiveIntegerField(
+                    default=0, help_text='Number of hosts that have it installed and pending a security upgrade.')),
+                ('images_count', models.PositiveIntegerField(
+                    default=0, help_text='Number of images that have it installed.')),
+                ('images_upgrades_count', models.PositiveIntegerField(
+                    default=0, help_text='Number of images that have it installed and pending an upgrade.')),
+                ('images_security_count', models.PositiveIntegerField(
+                    default=0, help_text='Number of images that have it installed and pending a security upgrade.')),
+                ('modified', models.DateTimeField(
+                    auto_now=True, help_text='Datetime of the last modification of this object.')),
+            ],
+            options={
+                'verbose_name': 'package rollup',
+                'verbose_name_plural': 'package rollups',
+            },
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
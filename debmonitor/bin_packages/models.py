@@ -1,8 +1,8 @@
 from django.core.exceptions import ValidationError
 from django.db import models
 
-from debmonitor import SelectManager
-from src_packages.models import OS, SrcPackageVersion
+from debmonitor import DirtyManager, NameManager, resolution, SelectManager
+from src_packages.models import OS, SrcPackage, SrcPackageVersion
 
 
 class Package(models.Model):
@@ -10,6 +10,8 @@ class Package(models.Model):
 
     name = models.CharField(max_length=255, unique=True, help_text='Binary package name.')
 
+    objects = NameManager()
+
     class Meta:
         """Additional metadata."""
 
@@ -40,7 +42,93 @@ class PackageVersionManager(SelectManager):
         arguments['src_package_version'], _ = SrcPackageVersion.objects.get_or_create(
             name=kwargs['source'], version=kwargs['version'], os=kwargs['os'], src_package=src_package)
 
-        return super().get_or_create(**arguments)
+        obj, created = super().get_or_create(**arguments)
+        if created:
+            DirtyPackage.objects.mark([obj.package_id])
+
+        return obj, created
+
+    def get_or_create_many(self, os, items):
+        """Bulk version of get_or_create() to resolve many binary package versions of the same OS with few queries.
+
+        All the missing Package, SrcPackage, SrcPackageVersion and PackageVersion objects are created with bulk
+        inserts, hence the number of queries doesn't depend on the number of items. The already resolved versions are
+        looked up first in the 'package_versions' resolution cache. As the bulk inserts skip save(), the fields of the
+        objects to create are validated before inserting any of them, see validate_many().
+
+        Arguments:
+            os (src_packages.models.OS): the operating system of all the binary package versions.
+            items (iterable): an iterable of (name, source, version) tuples.
+
+        Raises:
+            django.core.exceptions.ValidationError: if any of the binary package versions to create is not valid.
+
+        Returns:
+            dict: a dictionary with (name, version) tuples as keys and PackageVersion objects as values.
+        """
+        sources = {(name, version): source for name, source, version in items}
+        if not sources:
+            return {}
+
+        cache = resolution.get_cache('package_versions')
+        resolved = {key[1:]: obj for key, obj in cache.get_many((os.id, *key) for key in sources.keys()).items()}
+        uncached = sources.keys() - resolved.keys()
+        if not uncached:
+            return resolved
+
+        found = self._filter_many(os, uncached)
+        missing = uncached - found.keys()
+        if missing:
+            self.validate_many((name, sources[(name, version)], version) for name, version in missing)
+            packages = Package.objects.get_or_create_many(name for name, _ in missing)
+            src_package_versions = SrcPackageVersion.objects.get_or_create_many(
+                os, ((sources[key], key[1]) for key in missing))
+
+            objects = [self.model(package=packages[name], version=version, os=os,
+                                  src_package_version=src_package_versions[(sources[(name, version)], version)])
+                       for name, version in missing]
+            for obj in objects:
+                obj.clean()  # The related objects are already selected, no query is performed
+
+            # Objects created in the meanwhile by a concurrent request are silently skipped and fetched below
+            self.bulk_create(objects, ignore_conflicts=True)
+            found.update(self._filter_many(os, missing))
+            DirtyPackage.objects.mark(packages[name].pk for name, _ in missing)
+
+        cache.set_many({(os.id, *key): obj for key, obj in found.items()})
+        resolved.update(found)
+
+        return resolved
+
+    def validate_many(self, items):
+        """Validate the fields of the given binary package versions and of their packages, like full_clean() does.
+
+        The foreign keys and the uniqueness are not validated, to not perform any query.
+
+        Arguments:
+            items (iterable): an iterable of (name, source, version) tuples.
+
+        Raises:
+            django.core.exceptions.ValidationError: if any of the fields is not valid.
+        """
+        fields = (Package._meta.get_field('name'), SrcPackage._meta.get_field('name'),
+                  self.model._meta.get_field('version'))
+        for item in items:
+            for field, value in zip(fields, item):
+                try:
+                    field.clean(value, None)
+                except ValidationError as e:
+                    raise ValidationError("Invalid {model} {field} '{value:.64}': {error}".format(
+                        model=field.model._meta.verbose_name, field=field.name, value=value,
+                        error=' '.join(e.messages)))
+
+    def _filter_many(self, os, items):
+        """Return a dictionary with the existing binary package versions for the given (name, version) tuples."""
+        objects = self.get_queryset().filter(
+            os=os, package__name__in={name for name, _ in items}, version__in={version for _, version in items})
+
+        # The query selects a superset of the requested items, filter them out
+        return {(obj.package.name, obj.version): obj for obj in objects if (obj.package.name, obj.version) in items}
 
 
 class PackageVersion(models.Model):
@@ -82,3 +170,55 @@ class PackageVersion(models.Model):
         """Override parent save() to force validation."""
         self.full_clean()
         super().save(*args, **kwargs)
+
+
+class PackageRollup(models.Model):
+    """Precomputed aggregates of a binary package for the list page."""
+
+    package = models.OneToOneField(Package, on_delete=models.CASCADE, primary_key=True, related_name='rollup',
+                                   verbose_name='binary package', help_text='Binary package.')
+    versions_count = models.PositiveIntegerField(default=0, help_text='Number of versions of the binary package.')
+    os_list = models.TextField(
+        blank=True, default='', verbose_name='operating systems',
+        help_text='Comma-separated list of the operating systems of the versions of the binary package.')
+    hosts_count = models.PositiveIntegerField(default=0, help_text='Number of hosts that have it installed.')
+    hosts_upgrades_count = models.PositiveIntegerField(
+        default=0, help_text='Number of hosts that have it installed and pending an upgrade.')
+    hosts_security_count = models.PositiveIntegerField(
+        default=0, help_text='Number of hosts that have it installed and pending a security upgrade.')
+    images_count = models.PositiveIntegerField(default=0, help_text='Number of images that have it installed.')
+    images_upgrades_count = models.PositiveIntegerField(
+        default=0, help_text='Number of images that have it installed and pending an upgrade.')
+    images_security_count = models.PositiveIntegerField(
+        default=0, help_text='Number of images that have it installed and pending a security upgrade.')
+
+    modified = models.DateTimeField(auto_now=True, help_text='Datetime of the last modification of this object.')
+
+    class Meta:
+        """Additional metadata."""
+
+        verbose_name = 'package rollup'
+        verbose_name_plural = 'package rollups'
+
+    def __str__(self):
+        """Model representation."""
+        return str(self.package_id)
+
+
+class DirtyPackage(models.Model):
+    """Binary packages whose rollup needs to be refreshed."""
+
+    package = models.OneToOneField(Package, on_delete=models.CASCADE, primary_key=True, related_name='+',
+                                   verbose_name='binary package', help_text='Binary package.')
+
+    objects = DirtyManager()
+
+    class Meta:
+        """Additional metadata."""
+
+        verbose_name = 'dirty package'
+        verbose_name_plural = 'dirty packages'
+
+    def __str__(self):
+        """Model representation."""
+        return str(self.package_id)
@@ -2,24 +2,46 @@ import json
 
 from collections import defaultdict, OrderedDict
 
-from django.db.models import Count
+from django.db.models import Count, F, IntegerField
+from django.db.models.functions import Coalesce
 from django.http import Http404
 from django.shortcuts import render
+from django.urls import reverse
+from django.utils.html import escape
 from django.views.decorators.http import require_safe
 
 from bin_packages.models import Package, PackageVersion
-from debmonitor import DistinctGroupConcat
+from debmonitor import datatables
+from debmonitor.decorators import conditional_get, inventory_validators
 from hosts.models import HostPackage, SECURITY_UPGRADE
 from images.models import ImagePackage
 
 
-def _count_items_per_package(model, count_field, filters=None):
-    """Return a dictionary with package as key and the count of field items as value for all packages."""
-    if filters is None:
-        filters = {}
-
-    return {row[count_field]: row['count'] for row in model.objects.select_related(None).filter(**filters).values(
-        count_field).annotate(count=Count(count_field)).order_by()}
+INDEX_TABLE_HEADERS = [
+    {'title': 'Package', 'tooltip': 'Name of the binary package', 'badges': [
+     {'style': 'primary', 'tooltip': 'Number of hosts/images that have this package installed'},
+     {'style': 'warning',
+      'tooltip': 'Number of hosts/images that have this package installed and are pending an upgrade'},
+     {'style': 'danger',
+      'tooltip': 'Number of hosts/images that have this package installed and are pending a security upgrade'}]},
+    {'title': '# Versions',
+     'tooltip': 'Number of distinct installed versions of this package between all the hosts/images'},
+    {'title': 'OSes',
+     'tooltip': 'List of distinct operating systems the hosts/images that have this package installed are running'},
+    {'title': '# Hosts'},
+    {'title': '# Upgrades'},
+    {'title': '# Security Upgrades'},
+]
+INDEX_COLUMNS = [
+    datatables.Column(lambda package: datatables.render_name_with_badges(
+        package.name, reverse('bin_packages:detail', args=[package.name]), INDEX_TABLE_HEADERS[0]['badges'],
+        [package.inst_count, package.upgrades_count, package.security_count]), order_by=('name',), search='name'),
+    datatables.Column(lambda package: package.versions_count, order_by=('versions_count',)),
+    datatables.Column(lambda package: escape(package.os_list or ''), order_by=('os_list',)),
+    datatables.Column(lambda package: package.inst_count, order_by=('inst_count',)),
+    datatables.Column(lambda package: package.upgrades_count, order_by=('upgrades_count',)),
+    datatables.Column(lambda package: package.security_count, order_by=('security_count',)),
+]
 
 
 def _count_items_per_version(model, package_id, count_field, filters=None):
@@ -33,45 +55,27 @@ def _count_items_per_version(model, package_id, count_field, filters=None):
             count_field)).order_by()}
 
 
+def _rollup(*fields):
+    """Return an annotation with the sum of the given fields of the package rollup, zero if not yet computed."""
+    expression = F('rollup__{field}'.format(field=fields[0]))
+    for field in fields[1:]:
+        expression += F('rollup__{field}'.format(field=field))
+
+    return Coalesce(expression, 0, output_field=IntegerField())
+
+
 @require_safe
+@conditional_get(inventory_validators)
 def index(request):
-    """Binary packages list page."""
-    packages = Package.objects.annotate(
-        versions_count=Count('versions', distinct=True),
-        os_list=DistinctGroupConcat('versions__os__name'))
-
-    # Get all the additional annotations separately for query optimization purposes
-    package_annotations = {'hosts': {}, 'images': {}}
-    package_annotations['hosts']['inst_count'] = _count_items_per_package(HostPackage, 'package')
-    package_annotations['hosts']['upgrades_count'] = _count_items_per_package(HostPackage, 'upgradable_package')
-    package_annotations['hosts']['security_count'] = _count_items_per_package(
-        HostPackage, 'upgradable_package', filters={'upgrade_type': SECURITY_UPGRADE})
-    package_annotations['images']['inst_count'] = _count_items_per_package(ImagePackage, 'package')
-    package_annotations['images']['upgrades_count'] = _count_items_per_package(ImagePackage, 'upgradable_imagepackage')
-    package_annotations['images']['security_count'] = _count_items_per_package(
-        ImagePackage, 'upgradable_imagepackage', filters={'upgrade_type': SECURITY_UPGRADE})
-
-    # Insert all the annotated data back into the package objects for easy access in the templates
-    for package in packages:
-        for annotation in ('inst_count', 'upgrades_count', 'security_count'):
-            setattr(package, annotation, package_annotations['hosts'][annotation].get(package.id, 0)
-                    + package_annotations['images'][annotation].get(package.id, 0))
-
-    table_headers = [
-        {'title': 'Package', 'tooltip': 'Name of the binary package', 'badges': [
-         {'style': 'primary', 'tooltip': 'Number of hosts/images that have this package installed'},
-         {'style': 'warning',
-          'tooltip': 'Number of hosts/images that have this package installed and are pending an upgrade'},
-         {'style': 'danger',
-          'tooltip': 'Number of hosts/images that have this package installed and are pending a security upgrade'}]},
-        {'title': '# Versions',
-         'tooltip': 'Number of distinct installed versions of this package between all the hosts/images'},
-        {'title': 'OSes',
-         'tooltip': 'List of distinct operating systems the hosts/images that have this package installed are running'},
-        {'title': '# Hosts'},
-        {'title': '# Upgrades'},
-        {'title': '# Security Upgrades'},
-    ]
+    """Binary packages list page, with its rows returned to the DataTables server-side processing requests."""
+    if datatables.is_request(request):
+        return datatables.response(request, Package.objects.all(), INDEX_COLUMNS, annotations={
+            'versions_count': _rollup('versions_count'),
+            'os_list': F('rollup__os_list'),
+            'inst_count': _rollup('hosts_count', 'images_count'),
+            'upgrades_count': _rollup('hosts_upgrades_count', 'images_upgrades_count'),
+            'security_count': _rollup('hosts_security_count', 'images_security_count'),
+        })
 
     args = {
         # The IDs are DataTable column IDs.
@@ -81,16 +85,17 @@ def index(request):
             {'targets': [1, 2, 3, 4, 5], 'searchable': False},
             {'targets': [3, 4, 5], 'sortable': False}]),
         'datatables_page_length': 50,
-        'packages': packages,
+        'datatables_server_side': True,
         'section': 'bin_packages',
         'subtitle': '',
-        'table_headers': table_headers,
+        'table_headers': INDEX_TABLE_HEADERS,
         'title': 'Binary Packages',
     }
-    return render(request, 'bin_packages/index.html', args)
+    return render(request, 'base_table.html', args)
 
 
 @require_safe
+@conditional_get(inventory_validators)
 def detail(request, name):
     """Binary package detail page."""
     package_versions = PackageVersion.objects.filter(package__name=name)
@@ -1,6 +1,16 @@
+import hashlib
+import json
+
+from django.db import transaction
 from django.db.models import Aggregate, Manager
 
 
+# The keys of an update payload that describe its packages manifest.
+MANIFEST_KEYS = ('installed', 'uninstalled', 'upgradable')
+# The fields of the hosts and images with the stored counters of their packages.
+COUNTS_FIELDS = ('packages_count', 'upgrades_count', 'security_count')
+
+
 class SelectManager(Manager):
     """Custom manager to transparently select related items."""
 
@@ -16,6 +26,51 @@ class SelectManager(Manager):
         return queryset.select_related(*self._select_related)
 
 
+class NameManager(Manager):
+    """Custom manager for models that are uniquely identified by their name field."""
+
+    def get_or_create_many(self, names):
+        """Bulk version of get_or_create() that resolves all the given names with a fixed number of queries.
+
+        Arguments:
+            names (iterable): the names of the objects to get or create.
+
+        Returns:
+            dict: a dictionary with the names as keys and the model objects as values.
+        """
+        names = set(names)
+        if not names:
+            return {}
+
+        objects = {obj.name: obj for obj in self.get_queryset().filter(name__in=names)}
+        missing = names - objects.keys()
+        if missing:
+            # Objects created in the meanwhile by a concurrent request are silently skipped and fetched below
+            self.bulk_create([self.model(name=name) for name in missing], ignore_conflicts=True)
+            objects.update({obj.name: obj for obj in self.get_queryset().filter(name__in=missing)})
+
+        return objects
+
+
+class DirtyManager(Manager):
+    """Custom manager for the models that track the set of objects whose rollup needs to be refreshed."""
+
+    def mark(self, pks):
+        """Add the given primary keys to the dirty set once the current transaction, if any, is committed.
+
+        Marking them only after the commit guarantees that a refresh that claims them afterwards sees the changes.
+
+        Arguments:
+            pks (iterable): the primary keys of the objects whose rollup needs to be refreshed.
+        """
+        pks = set(pks)
+        if not pks:
+            return
+
+        transaction.on_commit(
+            lambda: self.bulk_create([self.model(pk=pk) for pk in sorted(pks)], ignore_conflicts=True))
+
+
 class DistinctGroupConcat(Aggregate):
     """Implement a simple DISTINCT GROUP_CONCAT aggregation for MySQL and SQLite."""
 
@@ -24,3 +79,51 @@ class DistinctGroupConcat(Aggregate):
     def as_sqlite(self, compiler, connection):
         """Override the SQLite version that has a different syntax and requires a workaround."""
         return self.as_sql(compiler, connection, template="replace(group_concat(distinct %(expressions)s), ',', ', ')")
+
+
+def manifest_digest(os_name, payload):
+    """Return the SHA256 hex digest of the canonical representation of the packages manifest of an update payload.
+
+    The digest doesn't depend on the order of the items in the payload nor on the order of their keys.
+
+    Arguments:
+        os_name (str): the name of the operating system of the payload.
+        payload (dict): the update payload.
+
+    Returns:
+        str: the hex digest.
+    """
+    manifest = {'os': os_name}
+    for key in MANIFEST_KEYS:
+        items = [json.dumps(item, sort_keys=True, separators=(',', ':')) for item in payload.get(key, [])]
+        manifest[key] = sorted(items)
+
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def refresh_counts(objects, counts):
+    """Update the stored packages counters of the given objects that don't match the given ones.
+
+    Arguments:
+        objects (list): the model objects to refresh, with the COUNTS_FIELDS fields loaded.
+        counts (dict): the tuples of the counters in the COUNTS_FIELDS order indexed by the objects primary keys, the
+            missing objects have all counters set to zero.
+
+    Returns:
+        int: the number of objects whose counters were changed.
+    """
+    changed = []
+    for obj in objects:
+        values = tuple(counts.get(obj.pk, (0,) * len(COUNTS_FIELDS)))
+        if tuple(getattr(obj, field) for field in COUNTS_FIELDS) == values:
+            continue
+
+        for field, value in zip(COUNTS_FIELDS, values):
+            setattr(obj, field, value)
+
+        changed.append(obj)
+
+    if changed:
+        type(changed[0]).objects.bulk_update(changed, COUNTS_FIELDS)
+
+    return len(changed)
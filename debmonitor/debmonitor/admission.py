@@ -0,0 +1,106 @@
+"""Admission control of the update submissions, shared across the processes via the Django cache."""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+KEY_PREFIX = 'debmonitor:admission'
+INFLIGHT_KEY = '{prefix}:inflight'.format(prefix=KEY_PREFIX)
+# Expiration of the in-flight counter since the last acquired slot, to recover from the slots never released by killed
+# processes once idle.
+INFLIGHT_TIMEOUT = 600
+_rejected = {'rate': 0, 'concurrency': 0}
+_rejected_lock = threading.Lock()
+
+
+def get_config():
+    """Return the admission control configuration with the defaults applied, zero values disable the limits."""
+    config = {'RATE': 0, 'BURST': 10, 'MAX_CONCURRENT': 0, 'RETRY_AFTER': 5}
+    config.update(settings.DEBMONITOR_ADMISSION_CONTROL)
+    return config
+
+
+def take_token(identity):
+    """Take a token from the bucket of the given client.
+
+    Each client has a bucket of BURST tokens refilled at RATE tokens per second. The bucket is read and written back
+    without locking, hence concurrent requests of the same client might be both admitted with the last token.
+
+    Arguments:
+        identity (str): the identity of the client, like the CN of its certificate.
+
+    Returns:
+        int: zero if the token was taken, otherwise the number of seconds after which a token will be available.
+    """
+    config = get_config()
+    if not config['RATE']:
+        return 0
+
+    key = '{prefix}:bucket:{digest}'.format(
+        prefix=KEY_PREFIX, digest=hashlib.sha1(identity.encode('utf-8')).hexdigest())
+    now = time.time()
+    tokens, last = cache.get(key, (config['BURST'], now))
+    tokens = min(config['BURST'], tokens + (now - last) * config['RATE'])
+    # Keep the bucket until it would be full again, as a missing bucket is a full one
+    timeout = math.ceil(config['BURST'] / config['RATE']) + 1
+
+    if tokens < 1:
+        cache.set(key, (tokens, now), timeout=timeout)
+        _reject('rate')
+        return math.ceil((1 - tokens) / config['RATE'])
+
+    cache.set(key, (tokens - 1, now), timeout=timeout)
+    return 0
+
+
+def acquire_slot():
+    """Acquire one of the MAX_CONCURRENT global ingestion slots, return True if acquired."""
+    max_concurrent = get_config()['MAX_CONCURRENT']
+    if not max_concurrent:
+        return True
+
+    cache.add(INFLIGHT_KEY, 0, timeout=INFLIGHT_TIMEOUT)
+    try:
+        inflight = cache.incr(INFLIGHT_KEY)
+        cache.touch(INFLIGHT_KEY, timeout=INFLIGHT_TIMEOUT)  # Don't expire while there are submissions in flight
+    except ValueError:  # Expired in the meanwhile
+        cache.add(INFLIGHT_KEY, 1, timeout=INFLIGHT_TIMEOUT)
+        inflight = 1
+
+    if inflight > max_concurrent:
+        release_slot()
+        _reject('concurrency')
+        return False
+
+    return True
+
+
+def release_slot():
+    """Release a global ingestion slot previously acquired with acquire_slot(), never below zero."""
+    if not get_config()['MAX_CONCURRENT']:
+        return
+
+    try:
+        inflight = cache.decr(INFLIGHT_KEY)
+        if inflight < 0:  # Expired and recreated while in flight, the slot was already released by the expiration
+            cache.incr(INFLIGHT_KEY, -inflight)
+    except ValueError:  # Expired in the meanwhile, nothing to release
+        pass
+
+
+def stats():
+    """Return a dictionary with the number of rejected submissions by limit and the current in-flight ones."""
+    with _rejected_lock:
+        rejected = dict(_rejected)
+
+    return {'rejected': rejected, 'inflight': max(cache.get(INFLIGHT_KEY, 0), 0)}
+
+
+def _reject(limit):
+    """Count a submission rejected by the given limit."""
+    with _rejected_lock:
+        _rejected[limit] += 1
@@ -0,0 +1,149 @@
+"""Server-side processing of the DataTables tables of the list pages.
+
+The list pages render only the table headers and DataTables requests the rows of each page from the same URL with its
+draw, start, length, order and search query parameters, see https://datatables.net/manual/server-side.
+"""
+from collections import namedtuple
+
+from django import http
+from django.conf import settings
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.template.loader import render_to_string
+
+
+DRAW_PARAMETER = 'draw'
+DEFAULT_PAGE_LENGTH = 50
+# Query parameters of the columns of the order parameter.
+ORDER_COLUMN = 'order[{i}][column]'
+ORDER_DIR = 'order[{i}][dir]'
+SEARCH_VALUE = 'search[value]'
+
+# Column of a server-side table.
+# render: callable that given an object returns the HTML of its cell, already escaped.
+# order_by: tuple of field or annotation names to order by when sorting by this column, empty if not orderable.
+# search: the field name to search with a case-insensitive containment when filtering, None if not searchable.
+Column = namedtuple('Column', ['render', 'order_by', 'search'], defaults=((), None))
+
+
+def is_request(request):
+    """Return True if the request is a DataTables server-side processing request."""
+    return DRAW_PARAMETER in request.GET
+
+
+def response(request, queryset, columns, annotations=None):
+    """Return the JSON response to a DataTables server-side processing request.
+
+    Only the annotations required to order the objects are computed on the whole filtered queryset, while all of them
+    are computed only for the objects of the requested page.
+
+    Arguments:
+        request (django.http.HttpRequest): the request.
+        queryset (django.db.models.query.QuerySet): the queryset with all the objects of the table.
+        columns (list): the list of Column objects of the table.
+        annotations (dict, optional): the annotations to add to the objects, indexed by name.
+
+    Returns:
+        django.http.JsonResponse: the response.
+    """
+    if annotations is None:
+        annotations = {}
+
+    params = request.GET
+    start = max(_get_int(params, 'start', 0), 0)
+    length = _get_int(params, 'length', DEFAULT_PAGE_LENGTH)
+    if length < 0:  # All the objects were requested, not allowed to bound the size of the response
+        length = DEFAULT_PAGE_LENGTH
+
+    length = min(length, settings.DEBMONITOR_TABLES_MAX_PAGE_LENGTH)
+
+    total = queryset.count()
+    filtered_queryset = _filter(queryset, params.get(SEARCH_VALUE, ''), columns)
+    filtered = total if filtered_queryset is queryset else filtered_queryset.count()
+
+    ordered = _order(filtered_queryset, params, columns, annotations)
+    pks = list(ordered.values_list('pk', flat=True)[start:start + length])
+    objects = {obj.pk: obj for obj in queryset.filter(pk__in=pks).annotate(**annotations).order_by()}
+
+    return http.JsonResponse({
+        'draw': _get_int(params, DRAW_PARAMETER, 0),
+        'recordsTotal': total,
+        'recordsFiltered': filtered,
+        'data': [[column.render(objects[pk]) for column in columns] for pk in pks],
+    })
+
+
+def count_subquery(queryset, field):
+    """Return an annotation with the number of objects of the queryset that reference the annotated one via field.
+
+    Arguments:
+        queryset (django.db.models.query.QuerySet): the queryset of the objects to count.
+        field (str): the name of the foreign key field of the counted objects to the annotated one.
+
+    Returns:
+        django.db.models.Expression: the annotation, zero if there are no objects.
+    """
+    counts = queryset.select_related(None).filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+        count=Count('*')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def render_name_with_badges(name, url, badges, counts):
+    """Return the HTML of a cell with a link to the object and the badges with its counters, if not zero.
+
+    Arguments:
+        name (str): the name of the object.
+        url (str): the URL of the detail page of the object.
+        badges (list): the badges of the column header, with their style and tooltip.
+        counts (list): the counters of the badges, in the same order.
+
+    Returns:
+        str: the HTML of the cell.
+    """
+    return render_to_string('name_with_badges.html', {
+        'name': name, 'url': url, 'badges': [dict(badge, count=count) for badge, count in zip(badges, counts)]})
+
+
+def _filter(queryset, value, columns):
+    """Return the queryset filtered by the global search value on the searchable columns."""
+    value = value.strip()
+    fields = [column.search for column in columns if column.search is not None]
+    if not value or not fields:
+        return queryset
+
+    query = Q()
+    for field in fields:
+        query |= Q(**{'{field}__icontains'.format(field=field): value})
+
+    return queryset.filter(query)
+
+
+def _order(queryset, params, columns, annotations):
+    """Return the queryset ordered according to the order parameters, the primary key is used to break the ties."""
+    order_by = []
+    i = 0
+    while ORDER_COLUMN.format(i=i) in params:
+        index = _get_int(params, ORDER_COLUMN.format(i=i), -1)
+        prefix = '-' if params.get(ORDER_DIR.format(i=i), 'asc') == 'desc' else ''
+        i += 1
+        if index < 0 or index >= len(columns):
+            continue
+
+        for field in columns[index].order_by:
+            if field in annotations:
+                queryset = queryset.annotate(**{field: annotations[field]})
+
+            order_by.append(prefix + field)
+
+    if not order_by:
+        return queryset
+
+    return queryset.order_by(*order_by, 'pk')
+
+
+def _get_int(params, name, default):
+    """Return the integer value of the given query parameter or the default if missing or invalid."""
+    try:
+        return int(params.get(name, default))
+    except (TypeError, ValueError):
+        return default
@@ -1,3 +1,31 @@
+import hashlib
+import logging
+import random
+import time
+
+from calendar import timegm
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection, IntegrityError, OperationalError, transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from debmonitor import admission, generation, resolution
+from debmonitor.middleware import get_host_cn, SSL_CLIENT_SUBJECT_DN_HEADER, TEXT_PLAIN
+
+
+# MySQL error codes for lock wait timeout and deadlock.
+MYSQL_RETRYABLE_ERRORS = (1205, 1213)
+# PostgreSQL error codes for serialization failure and deadlock.
+POSTGRESQL_RETRYABLE_ERRORS = ('40001', '40P01')
+# MySQL and PostgreSQL error codes for a duplicate key, the only integrity error caused by a concurrent transaction.
+MYSQL_DUPLICATE_KEY_ERROR = 1062
+POSTGRESQL_DUPLICATE_KEY_ERROR = '23505'
+logger = logging.getLogger(__name__)
+
+
 def verify_clients(arg):
     """Set an attribute to the view function to mark that it requires client validation.
 
@@ -18,3 +46,131 @@ def verify_clients(arg):
             return func
 
         return wrapper
+
+
+def admission_control(func):
+    """Reject with a 429 response the update submissions that exceed the limits of the ADMISSION_CONTROL configuration.
+
+    Each client, identified by the CN of its certificate, or by the object name or remote address when not available,
+    is limited by a token bucket. The number of submissions processed concurrently across all processes is limited too.
+    """
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        identity = (get_host_cn(request.META.get(SSL_CLIENT_SUBJECT_DN_HEADER, '')) or kwargs.get('name', None)
+                    or request.META.get('REMOTE_ADDR', ''))
+        retry_after = admission.take_token(identity)
+        if retry_after:
+            return _too_many_requests("Too many update submissions from '{identity}'".format(identity=identity),
+                                      retry_after)
+
+        if not admission.acquire_slot():
+            return _too_many_requests('Too many concurrent update submissions', admission.get_config()['RETRY_AFTER'])
+
+        try:
+            return func(request, *args, **kwargs)
+        finally:
+            admission.release_slot()
+
+    return wrapper
+
+
+def is_retryable_error(exc):
+    """Return True if the given database exception is transient and the transaction can be retried."""
+    if isinstance(exc, IntegrityError):  # Retryable only if a concurrent transaction has created the same object
+        return (bool(exc.args) and exc.args[0] == MYSQL_DUPLICATE_KEY_ERROR
+                or getattr(exc.__cause__, 'pgcode', None) == POSTGRESQL_DUPLICATE_KEY_ERROR
+                or 'UNIQUE constraint failed' in str(exc))  # SQLite
+
+    if exc.args and exc.args[0] in MYSQL_RETRYABLE_ERRORS:
+        return True
+
+    if getattr(exc.__cause__, 'pgcode', None) in POSTGRESQL_RETRYABLE_ERRORS:
+        return True
+
+    return 'database is locked' in str(exc)  # SQLite
+
+
+def atomic_retry(func):
+    """Run the decorated function in a single transaction, retrying it with backoff on transient database errors.
+
+    The number of attempts is set by the UPDATE_RETRIES configuration. The function is not retried when called from
+    within an already open transaction, as the whole outer transaction might have been rolled back by the database.
+    The in-process resolution caches are cleared before retrying, as a cached object might have been deleted.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        attempts = 1 if connection.in_atomic_block else max(settings.DEBMONITOR_UPDATE_RETRIES, 1)
+        for attempt in range(1, attempts + 1):
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except (IntegrityError, OperationalError) as e:
+                if attempt == attempts or not is_retryable_error(e):
+                    raise
+
+                delay = 0.1 * 2 ** (attempt - 1) * random.uniform(1, 2)  # Exponential backoff with jitter
+                logger.warning('Retrying %s in %.2fs after transient database error (attempt %d/%d): %s',
+                               func.__name__, delay, attempt, attempts, e)
+                resolution.clear()
+                time.sleep(delay)
+
+    return wrapper
+
+
+def conditional_get(validators):
+    """Answer the GET and HEAD requests whose validators still match with a 304 response, before calling the view.
+
+    The validators callable is called with the same arguments of the view and must return a tuple with a cheap
+    freshness token and the datetime of the last modification, if known, or None to not handle the request. The ETag is
+    derived from the token and from the requesting user, as the pages include the user's details.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(request, *args, **kwargs):
+            values = validators(request, *args, **kwargs) if request.method in ('GET', 'HEAD') else None
+            if values is None:
+                return func(request, *args, **kwargs)
+
+            token, last_modified = values
+            user = request.user  # An AuthHost when authenticated by the client certificate
+            etag = quote_etag(hashlib.sha1(repr((token, getattr(user, 'pk', None), getattr(user, 'is_superuser', False),
+                                                 getattr(user, 'hostname', None))).encode()).hexdigest())
+            if last_modified is not None:
+                last_modified = timegm(last_modified.utctimetuple())
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = func(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+
+            patch_cache_control(response, private=True, no_cache=True)  # Always revalidate, no heuristic freshness
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def inventory_validators(request, *args, **kwargs):
+    """Validators for conditional_get() of the views that depend on the whole inventory, based on its generation.
+
+    As the generation is not bumped by the updates applied by other processes when the cache is not shared, the token
+    changes also every MAX_AGE seconds of the CONDITIONAL_GET configuration. Setting it to 0 disables the validators.
+    """
+    max_age = settings.DEBMONITOR_CONDITIONAL_GET.get('MAX_AGE', 60)
+    if not max_age:
+        return None
+
+    return (generation.get(), int(time.time() // max_age)), None
+
+
+def _too_many_requests(message, retry_after):
+    """Return a 429 response with the given message and Retry-After header."""
+    response = HttpResponse(message, status=429, content_type=TEXT_PLAIN)
+    response['Retry-After'] = str(retry_after)
+    return response
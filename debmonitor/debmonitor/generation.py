@@ -0,0 +1,71 @@
+"""Global generation number of the inventory, shared across the processes via the Django cache.
+
+The generation is bumped by every committed change of the tracked hosts, images and Kubernetes images, hence the
+values derived from the whole inventory can be cached until it changes. With a cache not shared by all the processes
+the changes applied by the other processes are not seen, the cached values are then refreshed only when expired.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+KEY = 'debmonitor:generation:inventory'
+
+
+def get():
+    """Return the current generation of the inventory."""
+    value = cache.get(KEY, None)
+    if value is None:
+        cache.add(KEY, _initial(), timeout=None)
+        value = cache.get(KEY, 0)
+
+    return value
+
+
+def bump():
+    """Bump the generation of the inventory once the current transaction, if any, is committed."""
+    transaction.on_commit(_increment)
+
+
+def cached(key, max_age, func):
+    """Return the value of func(), cached for up to max_age seconds while the generation of the inventory is the same.
+
+    The generation and the cached value are read with a single cache request.
+
+    Arguments:
+        key (str): the cache key of the value.
+        max_age (int): the maximum number of seconds to cache the value for, zero to disable the caching.
+        func (callable): the function without arguments that computes the value.
+
+    Returns:
+        mixed: the cached or computed value.
+    """
+    if not max_age:
+        return func()
+
+    values = cache.get_many([KEY, key])
+    current = values.get(KEY, None)
+    snapshot = values.get(key, None)
+    if current is not None and snapshot is not None and snapshot[0] == current:
+        return snapshot[1]
+
+    if current is None:
+        current = get()
+
+    value = func()  # Computed after reading the generation, the changes applied in the meanwhile make it stale
+    cache.set(key, (current, value), timeout=max_age)
+    return value
+
+
+def _increment():
+    """Increment the generation in the cache."""
+    try:
+        cache.incr(KEY)
+    except ValueError:  # Missing or evicted
+        cache.add(KEY, _initial(), timeout=None)
+
+
+def _initial():
+    """Return the initial generation, based on the current time to not reuse the ones of an evicted generation."""
+    return int(time.time() * 1000)
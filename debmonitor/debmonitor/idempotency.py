@@ -0,0 +1,139 @@
+"""Deduplication of the retried update submissions, shared across the processes via the Django cache."""
+import hashlib
+import json
+import time
+
+from collections import namedtuple
+
+from django import http
+from django.conf import settings
+from django.core.cache import cache
+
+from debmonitor.middleware import TEXT_PLAIN
+
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+KEY_PREFIX = 'debmonitor:idempotency'
+IN_PROGRESS = 'in-progress'
+POLL_INTERVAL = 0.2
+REPLAYED_RESPONSE_HEADERS = ('ETag',)
+# The cache key of a submission and the digest of its payload, to detect a key reused with a different payload
+Key = namedtuple('Key', ['cache_key', 'payload_digest'])
+
+
+def get_config():
+    """Return the idempotency configuration with the defaults applied, a zero TTL disables it."""
+    config = {'TTL': 0, 'WAIT': 30, 'DERIVE_KEY': False}
+    config.update(settings.DEBMONITOR_IDEMPOTENCY)
+    return config
+
+
+def get_key(request, kind, name, payload):
+    """Return the key of an update submission.
+
+    Arguments:
+        request (django.http.HttpRequest): the request.
+        kind (str): the kind of the updated object (i.e. hosts, images, kubernetes).
+        name (str): the name of the updated object, or an empty string for the batch updates.
+        payload (dict, list): the parsed payload, or the list of payloads for the batch updates, used to derive the
+            key when the request has no Idempotency-Key header. The key is derived only for the full updates, as the
+            same partial update might be legitimately submitted again (i.e. install, remove and install a package).
+
+    Returns:
+        debmonitor.idempotency.Key: the key, or None if the deduplication is disabled or there is no key for the
+        submission.
+    """
+    config = get_config()
+    if not config['TTL']:
+        return None
+
+    payload_digest = hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':')).encode(
+        'utf-8')).hexdigest()
+    key = request.headers.get(IDEMPOTENCY_KEY_HEADER, '')
+    if not key:
+        if not config['DERIVE_KEY'] or not _is_full_update(payload):
+            return None
+
+        key = payload_digest
+
+    return Key('{prefix}:{kind}:{digest}'.format(prefix=KEY_PREFIX, kind=kind, digest=hashlib.sha256(
+        '{name}\n{key}'.format(name=name, key=key).encode('utf-8')).hexdigest()), payload_digest)
+
+
+def run(key, func, *args, **kwargs):
+    """Return the response of func(), or the cached one of the same submission if already completed.
+
+    A submission with the same key still in progress in another request or process is waited for up to WAIT seconds,
+    returning a 409 Conflict response if not yet completed. The responses with a status code lower than 500 are cached
+    for TTL seconds along with the digest of the payload, the others are not cached to allow the client to retry. A
+    completed submission with the same key but a different payload is rejected with a 422 Unprocessable Entity
+    response, as the key was reused by the client for a different submission.
+
+    Arguments:
+        key (debmonitor.idempotency.Key): the key as returned by get_key(), if None func() is always called.
+        func (callable): the function that processes the submission, returning a django.http.HttpResponse.
+        *args (mixed): the positional arguments to pass to func().
+        **kwargs (mixed): the keyword arguments to pass to func().
+
+    Returns:
+        django.http.HttpResponse: the response.
+    """
+    if key is None:
+        return func(*args, **kwargs)
+
+    config = get_config()
+    deadline = time.monotonic() + config['WAIT']
+    while not cache.add(key.cache_key, IN_PROGRESS, timeout=config['TTL']):
+        cached = cache.get(key.cache_key, None)
+        if cached is not None and cached != IN_PROGRESS:
+            if cached[-1] != key.payload_digest:
+                return http.HttpResponse('The Idempotency-Key was already used for a different payload', status=422,
+                                         content_type=TEXT_PLAIN)
+
+            return _replay(cached)
+
+        if cached is None:  # Failed or expired in the meanwhile, try again to process it
+            continue
+
+        if time.monotonic() >= deadline:
+            response = http.HttpResponse('The same update submission is still being processed', status=409,
+                                         content_type=TEXT_PLAIN)
+            response['Retry-After'] = str(config['WAIT'])
+            return response
+
+        time.sleep(POLL_INTERVAL)
+
+    try:
+        response = func(*args, **kwargs)
+    except BaseException:
+        cache.delete(key.cache_key)
+        raise
+
+    if response.status_code >= 500:
+        cache.delete(key.cache_key)
+    else:
+        headers = {header: response[header] for header in REPLAYED_RESPONSE_HEADERS if header in response}
+        cache.set(key.cache_key, (response.status_code, response.content, response['Content-Type'], headers,
+                                  key.payload_digest), timeout=config['TTL'])
+
+    return response
+
+
+def _is_full_update(payload):
+    """Return True if the given payload, or all the payloads of the given list, are full updates."""
+    if isinstance(payload, list):
+        return bool(payload) and all(_is_full_update(item) for item in payload)
+
+    return isinstance(payload, dict) and payload.get('update_type', '') == 'full'
+
+
+def _replay(cached):
+    """Return a new response from the cached one."""
+    status, content, content_type, headers, _ = cached
+    response = http.HttpResponse(content, status=status, content_type=content_type)
+    for header, value in headers.items():
+        response[header] = value
+
+    response[REPLAYED_HEADER] = 'true'
+    return response
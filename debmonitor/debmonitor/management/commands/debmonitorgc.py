@@ -1,14 +1,19 @@
 from datetime import timedelta
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db.models import Count
 from django.utils import timezone
 
-from bin_packages.models import Package, PackageVersion
-from hosts.models import Host
+from bin_packages.models import DirtyPackage, Package, PackageVersion
+from debmonitor import generation, resolution
+from hosts.models import Host, HostPackage
 from kernels.models import KernelVersion
-from images.models import Image
-from src_packages.models import SrcPackage, SrcPackageVersion
+from images.models import Image, ImagePackage
+from src_packages.models import DirtySrcPackage, SrcPackage, SrcPackageVersion
+
+
+LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
 
 
 class Command(BaseCommand):
@@ -23,8 +28,12 @@ class Command(BaseCommand):
         #       with 0 meaning that no object of that type should be deleted.
 
         # GC old images until they will be deleted when deprecated externally from Debmonitor
-        res = Image.objects.select_related(None).filter(
-            modified__lt=timezone.now() - timedelta(days=90), namespaces=None).delete()
+        images = Image.objects.select_related(None).filter(
+            modified__lt=timezone.now() - timedelta(days=90), namespaces=None)
+        packages = set(ImagePackage.objects.select_related(None).filter(image__in=images).order_by().values_list(
+            'package', flat=True))
+        res = images.delete()
+        DirtyPackage.objects.mark(packages)
         # Getting the specific counter of Images deleted because the Django reported total number of deleted objects
         # includes also the ones deleted by cascade constrains like the ImagePackage objects.
         # The returned structure is:
@@ -37,7 +46,11 @@ class Command(BaseCommand):
         # GC old Hosts that are not reporting anymore to Debmonitor. Usually they are deleted when decommissioned but
         # it might happen that the deletion fails and a stale host is left around.
         # As above report only the number of hosts deleted.
-        res = Host.objects.select_related(None).filter(modified__lt=timezone.now() - timedelta(days=15)).delete()
+        hosts = Host.objects.select_related(None).filter(modified__lt=timezone.now() - timedelta(days=15))
+        packages = set(HostPackage.objects.select_related(None).filter(host__in=hosts).order_by().values_list(
+            'package', flat=True))
+        res = hosts.delete()
+        DirtyPackage.objects.mark(packages)
         self.stdout.write(self.style.SUCCESS(
             'Deleted {count} Host objects not updated in the last 15 days'.format(
                 count=res[1].get('hosts.Host', 0))))
@@ -55,8 +68,11 @@ class Command(BaseCommand):
         primary_keys_groups = [primary_keys[i:i + 1000] for i in range(0, len(primary_keys), 1000)]
         res = 0
         for primary_keys_group in primary_keys_groups:
-            partial_res = PackageVersion.objects.select_related(None).filter(pk__in=primary_keys_group).delete()
-            res += partial_res[0]
+            package_versions = PackageVersion.objects.select_related(None).filter(pk__in=primary_keys_group)
+            packages = set(package_versions.order_by().values_list('package', flat=True))
+            partial_res = package_versions.delete()
+            DirtyPackage.objects.mark(packages)
+            res += partial_res[1].get('bin_packages.PackageVersion', 0)
 
         self.stdout.write(self.style.SUCCESS(
             'Deleted {count} PackageVersion objects not referenced by any HostPackage or ImagePackage'.
@@ -65,19 +81,34 @@ class Command(BaseCommand):
         res = Package.objects.select_related(None).annotate(
             versions_count=Count('versions', distinct=True)).filter(versions_count=0).order_by().delete()
         self.stdout.write(self.style.SUCCESS(
-            'Deleted {count} Package objects not referenced by any PackageVersion'.format(count=res[0])))
-
-        res = SrcPackageVersion.objects.select_related(None).annotate(
-            binaries_count=Count('binaries', distinct=True)).filter(binaries_count=0).order_by().delete()
+            'Deleted {count} Package objects not referenced by any PackageVersion'.format(
+                count=res[1].get('bin_packages.Package', 0))))
+
+        src_package_versions = SrcPackageVersion.objects.select_related(None).annotate(
+            binaries_count=Count('binaries', distinct=True)).filter(binaries_count=0).order_by()
+        src_packages = set(src_package_versions.values_list('src_package', flat=True))
+        res = src_package_versions.delete()
+        DirtySrcPackage.objects.mark(src_packages)
         self.stdout.write(self.style.SUCCESS(
-            'Deleted {count} SrcPackageVersion objects not referenced by any PackageVersion'.format(count=res[0])))
+            'Deleted {count} SrcPackageVersion objects not referenced by any PackageVersion'.format(
+                count=res[1].get('src_packages.SrcPackageVersion', 0))))
 
         res = SrcPackage.objects.select_related(None).annotate(
             versions_count=Count('versions', distinct=True)).filter(versions_count=0).order_by().delete()
         self.stdout.write(self.style.SUCCESS(
-            'Deleted {count} SrcPackage objects not referenced by any SrcPackageVersion'.format(count=res[0])))
+            'Deleted {count} SrcPackage objects not referenced by any SrcPackageVersion'.format(
+                count=res[1].get('src_packages.SrcPackage', 0))))
 
         res = KernelVersion.objects.select_related(None).annotate(
             hosts_count=Count('hosts', distinct=True)).filter(hosts_count=0).order_by().delete()
         self.stdout.write(self.style.SUCCESS(
-            'Deleted {count} KernelVersion objects not referenced by any Host'.format(count=res[0])))
+            'Deleted {count} KernelVersion objects not referenced by any Host'.format(
+                count=res[1].get('kernels.KernelVersion', 0))))
+
+        # The deleted objects might still be cached by the running web and worker processes
+        resolution.invalidate()
+        generation.bump()
+        self.stdout.write(self.style.SUCCESS('Invalidated the resolution caches'))
+        if settings.CACHES['default']['BACKEND'] in LOCAL_CACHE_BACKENDS:
+            self.stdout.write(self.style.WARNING(
+                'The Django cache is not shared, the running processes might still resolve the deleted objects'))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from debmonitor import COUNTS_FIELDS, generation, rollups, search
+from hosts.models import Host
+from images.models import Image
+
+
+class Command(BaseCommand):
+    """Add a custom command to Django's manage.py."""
+
+    help = ('Rebuild the stored counters of the hosts and images, fixing the inconsistent ones, the rollups of the '
+            'binary and source packages and the missing entries of the search index')
+    requires_migrations_checks = True
+
+    def add_arguments(self, parser):
+        """Add the command line arguments."""
+        parser.add_argument('--batch-size', type=int, default=rollups.DEFAULT_BATCH_SIZE,
+                            help='Number of hosts, images or packages to rebuild in each transaction.')
+        parser.add_argument('--dirty', action='store_true',
+                            help=('Refresh only the rollups of the packages modified since the last refresh, to be '
+                                  'run periodically.'))
+
+    def handle(self, *args, **options):
+        """Rebuild the counters and the rollups."""
+        if options['dirty']:
+            packages, src_packages = rollups.refresh_dirty(options['batch_size'])
+            self._write_rollups(packages, src_packages)
+            return
+
+        for model in (Host, Image):
+            fixed = 0
+            pks = list(model.objects.select_related(None).order_by('pk').values_list('pk', flat=True))
+            for i in range(0, len(pks), options['batch_size']):
+                with transaction.atomic():  # Lock the objects to not race with their updates
+                    objects = model.objects.select_related(None).select_for_update().filter(
+                        pk__in=pks[i:i + options['batch_size']]).only('pk', *COUNTS_FIELDS)
+                    fixed += model.refresh_counts(objects)
+
+            if fixed:
+                generation.bump()
+
+            self.stdout.write(self.style.SUCCESS('Fixed the packages counters of {count} {name} objects'.format(
+                count=fixed, name=model.__name__)))
+
+        self._write_rollups(*rollups.rebuild(options['batch_size']))
+        self.stdout.write(self.style.SUCCESS('Indexed {count} objects for the search'.format(
+            count=search.rebuild(options['batch_size']))))
+
+    def _write_rollups(self, packages, src_packages):
+        """Report the number of refreshed rollups."""
+        self.stdout.write(self.style.SUCCESS(
+            'Refreshed the rollups of {packages} Package and {src_packages} SrcPackage objects'.format(
+                packages=packages, src_packages=src_packages)))
@@ -0,0 +1,91 @@
+import json
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from debmonitor import rollups, spool
+from hosts import views as hosts_views
+from images import views as images_views
+
+
+UPDATERS = {
+    'hosts': hosts_views.apply_update,
+    'images': images_views.apply_update,
+}
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Add a custom command to Django's manage.py."""
+
+    help = 'Apply the spooled update submissions'
+    requires_migrations_checks = True
+
+    def add_arguments(self, parser):
+        """Add the command line arguments."""
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Maximum number of spooled submissions to read at each iteration.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of hosts and images to update in parallel.')
+        parser.add_argument('--max-attempts', type=int, default=3,
+                            help='Number of failed attempts after which a spooled submission is discarded.')
+        parser.add_argument('--follow', action='store_true',
+                            help='Keep running and polling the spool instead of exiting once it is empty.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait between polls of an empty spool when running with --follow.')
+
+    def handle(self, *args, **options):
+        """Drain the spool."""
+        if not spool.is_enabled():
+            raise CommandError('The SPOOL configuration is not set, unable to process the spooled submissions')
+
+        self.spool = spool.Spool()
+        total = 0
+        while True:
+            groups = self.spool.pop_batch(options['batch_size'], options['max_attempts'])
+            if not groups:
+                if not options['follow']:
+                    break
+
+                time.sleep(options['interval'])
+                continue
+
+            if options['workers'] > 1:
+                with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                    total += sum(executor.map(self._apply_threaded, groups.values()))
+            else:
+                total += sum(self._apply(group) for group in groups.values())
+
+            rollups.refresh_dirty()  # Refresh the rollups of the packages modified by the batch
+
+        self.stdout.write(self.style.SUCCESS('Applied {count} spooled submissions'.format(count=total)))
+
+    def _apply_threaded(self, entries):
+        """Apply the entries from a thread, closing its own database connection at the end."""
+        try:
+            return self._apply(entries)
+        finally:
+            connection.close()
+
+    def _apply(self, entries):
+        """Apply in order all the coalesced entries of a single host or image, return the number of applied ones.
+
+        The processing of the remaining entries stops at the first failure to not apply them out of order.
+        """
+        applied = 0
+        for entry in entries:
+            try:
+                UPDATERS[entry.kind](entry.name, json.loads(entry.payload))
+            except Exception:
+                logger.exception("Unable to apply spooled submission %d for %s '%s'", entry.id, entry.kind, entry.name)
+                self.spool.failed(entry.id)
+                break
+
+            self.spool.delete([entry.id])
+            applied += 1
+
+        return applied
@@ -0,0 +1,175 @@
+"""Prometheus metrics of the requests, of the update submissions ingestion and of the resolution caches.
+
+The metrics are collected only if the optional prometheus_client module is installed. When running with multiple
+WSGI processes the PROMETHEUS_MULTIPROC_DIR environment variable must be set to a directory shared by all of them,
+see the prometheus_client documentation, to export the metrics aggregated across the processes.
+"""
+import os
+import time
+
+from django.db import connection
+
+from debmonitor import resolution
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+except ImportError:  # Optional dependency
+    prometheus_client = None
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+ITEM_KEYS = ('installed', 'uninstalled', 'upgradable')
+# The other methods are labeled as 'other', to not create a time series for each arbitrary method sent by the clients
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+if prometheus_client is not None:
+    REQUEST_DURATION = prometheus_client.Histogram(
+        'debmonitor_request_duration_seconds', 'Duration of the requests by view.', ['view', 'method', 'status'],
+        buckets=LATENCY_BUCKETS)
+    REQUEST_DB_QUERIES = prometheus_client.Histogram(
+        'debmonitor_request_db_queries', 'Number of database queries performed by the requests by view.', ['view'],
+        buckets=QUERIES_BUCKETS)
+    REQUEST_DB_DURATION = prometheus_client.Histogram(
+        'debmonitor_request_db_duration_seconds', 'Time spent in database queries by the requests by view.', ['view'],
+        buckets=LATENCY_BUCKETS)
+    INGESTION_PHASE_DURATION = prometheus_client.Histogram(
+        'debmonitor_ingestion_phase_duration_seconds', 'Duration of each phase of the update submissions ingestion.',
+        ['kind', 'phase'], buckets=LATENCY_BUCKETS)
+    INGESTION_ITEMS = prometheus_client.Counter(
+        'debmonitor_ingestion_items', 'Number of packages items ingested by update type.',
+        ['kind', 'update_type', 'items'])
+    SPOOL_DISCARDED = prometheus_client.Counter(
+        'debmonitor_spool_discarded', 'Number of spooled submissions discarded after too many failed attempts.',
+        ['kind'])
+
+
+class ResolutionCacheCollector:
+    """Prometheus collector of the hits, misses and size of the in-process resolution caches."""
+
+    def collect(self):
+        """Required by the prometheus_client API, return the metrics families of the resolution caches."""
+        hits = CounterMetricFamily('debmonitor_resolution_cache_hits', 'Number of hits of the resolution caches.',
+                                   labels=['cache'])
+        misses = CounterMetricFamily('debmonitor_resolution_cache_misses',
+                                     'Number of misses of the resolution caches.', labels=['cache'])
+        size = GaugeMetricFamily('debmonitor_resolution_cache_size',
+                                 'Number of objects in the resolution caches.', labels=['cache'])
+        for name, stats in sorted(resolution.stats().items()):
+            hits.add_metric([name], stats['hits'])
+            misses.add_metric([name], stats['misses'])
+            size.add_metric([name], stats['size'])
+
+        return [hits, misses, size]
+
+
+if prometheus_client is not None:
+    RESOLUTION_CACHE_COLLECTOR = ResolutionCacheCollector()
+    prometheus_client.REGISTRY.register(RESOLUTION_CACHE_COLLECTOR)
+
+
+def is_enabled():
+    """Return True if the metrics are collected."""
+    return prometheus_client is not None
+
+
+def export():
+    """Return a tuple with the metrics in the Prometheus text format and their content type."""
+    registry = prometheus_client.REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # The resolution caches are per process, only the ones of the process serving the request are exported
+        registry.register(RESOLUTION_CACHE_COLLECTOR)
+
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def count_items(kind, payload):
+    """Count the packages items of an update submission by update type.
+
+    Arguments:
+        kind (str): the kind of the updated object (i.e. hosts, images).
+        payload (dict): the update payload.
+    """
+    if not is_enabled():
+        return
+
+    for key in ITEM_KEYS:
+        items = payload.get(key, [])
+        if items:
+            INGESTION_ITEMS.labels(kind, payload['update_type'], key).inc(len(items))
+
+
+def count_discarded(kind):
+    """Count a spooled submission of the given kind discarded after too many failed attempts."""
+    if is_enabled():
+        SPOOL_DISCARDED.labels(kind).inc()
+
+
+class PhaseTimer:
+    """Measure the duration of the consecutive phases of an ingestion."""
+
+    def __init__(self, kind):
+        """Start the timer of the first phase.
+
+        Arguments:
+            kind (str): the kind of the updated object (i.e. hosts, images, kubernetes).
+        """
+        self.kind = kind
+        self.start = time.perf_counter()
+
+    def lap(self, phase):
+        """Record the duration of the given phase since the end of the previous one and start the next one."""
+        now = time.perf_counter()
+        if is_enabled():
+            INGESTION_PHASE_DURATION.labels(self.kind, phase).observe(now - self.start)
+
+        self.start = now
+
+
+class MetricsMiddleware:
+    """Middleware to collect the duration and database queries of the requests."""
+
+    def __init__(self, get_response):
+        """Required by Django API."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Required by Django API."""
+        if not is_enabled():
+            return self.get_response(request)
+
+        queries = _QueriesCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        view = resolver_match.view_name if resolver_match is not None else 'unknown'
+        method = request.method if request.method in METHODS else 'other'
+        REQUEST_DURATION.labels(view, method, response.status_code).observe(time.perf_counter() - start)
+        REQUEST_DB_QUERIES.labels(view).observe(queries.count)
+        REQUEST_DB_DURATION.labels(view).observe(queries.duration)
+
+        return response
+
+
+class _QueriesCounter:
+    """Database execute wrapper to count the queries and their duration."""
+
+    def __init__(self):
+        """Initialize the counters."""
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Execute the query, measuring it."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
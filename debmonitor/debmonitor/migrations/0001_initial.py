@@ -0,0 +1,88 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('src_packages', '0004_rollups'),
+        ('images', '0004_image_counts'),
+        ('bin_packages', '0002_rollups'),
+        ('hosts', '0009_host_counts'),
+        ('kernels', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.PositiveSmallIntegerField(
+                    choices=[(1, 'Hosts'), (2, 'Images'), (3, 'Packages'), (4, 'Source Packages'), (5, 'Kernels'),
+                             (6, 'Package Versions'), (7, 'Source Package Versions')],
+                    help_text='Type of the indexed object.')),
+                ('term', models.CharField(help_text='Searchable name or version of the indexed object.',
+                                          max_length=255)),
+                ('name', models.CharField(help_text='Name of the object to link to from the search results.',
+                                          max_length=255)),
+                ('version', models.CharField(blank=True, default='',
+                                             help_text='Version of the package or source package version, if any.',
+                                             max_length=255)),
+                ('slug', models.SlugField(blank=True, default='', help_text='Kernel URL slug, if any.',
+                                          max_length=255)),
+                ('host', models.OneToOneField(help_text='Indexed host.', null=True,
+                                              on_delete=django.db.models.deletion.CASCADE,
+                                              related_name='search_term', to='hosts.host')),
+                ('image', models.OneToOneField(help_text='Indexed image.', null=True,
+                                               on_delete=django.db.models.deletion.CASCADE,
+                                               related_name='search_term', to='images.image')),
+                ('kernel', models.OneToOneField(help_text='Indexed kernel.', null=True,
+                                                on_delete=django.db.models.deletion.CASCADE,
+                                                related_name='search_term', to='kernels.kernelversion')),
+                ('os', models.ForeignKey(db_index=False, help_text='Operating system of the indexed object, if any.',
+                                         null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                         to='src_packages.os', verbose_name='operating system')),
+                ('package', models.OneToOneField(help_text='Indexed binary package.', null=True,
+                                                 on_delete=django.db.models.deletion.CASCADE,
+                                                 related_name='search_term', to='bin_packages.package',
+                                                 verbose_name='binary package')),
+                ('package_version', models.OneToOneField(help_text='Indexed binary package version.', null=True,
+                                                         on_delete=django.db.models.deletion.CASCADE,
+                                                         related_name='search_term',
+                                                         to='bin_packages.packageversion',
+                                                         verbose_name='binary package version')),
+                ('src_package', models.OneToOneField(help_text='Indexed source package.', null=True,
+                                                     on_delete=django.db.models.deletion.CASCADE,
+                                                     related_name='search_term', to='src_packages.srcpackage',
+                                                     verbose_name='source package')),
+                ('src_package_version', models.OneToOneField(help_text='Indexed source package version.', null=True,
+                                                             on_delete=django.db.models.deletion.CASCADE,
+                                                             related_name='search_term',
+                                                             to='src_packages.srcpackageversion',
+                                                             verbose_name='source package version')),
+            ],
+            options={
+                'verbose_name': 'search term',
+                'verbose_name_plural': 'search terms',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(help_text='Lowercase trigram.', max_length=3)),
+                ('term', models.ForeignKey(help_text='Search term that contains the trigram.',
+                                           on_delete=django.db.models.deletion.CASCADE, related_name='trigrams',
+                                           to='debmonitor.searchterm')),
+            ],
+            options={
+                'verbose_name': 'search trigram',
+                'verbose_name_plural': 'search trigrams',
+                'unique_together': {('trigram', 'term')},
+            },
+        ),
+    ]
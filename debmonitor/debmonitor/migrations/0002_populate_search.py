@@ -0,0 +1,72 @@
+from django.db import migrations
+
+
+BATCH_SIZE = 1000
+# The app label, model name, SearchTerm category, reference field and related objects to select of each indexed model
+INDEXED = (
+    ('hosts', 'Host', 1, 'host', ()),
+    ('images', 'Image', 2, 'image', ()),
+    ('bin_packages', 'Package', 3, 'package', ()),
+    ('src_packages', 'SrcPackage', 4, 'src_package', ()),
+    ('kernels', 'KernelVersion', 5, 'kernel', ()),
+    ('bin_packages', 'PackageVersion', 6, 'package_version', ('package',)),
+    ('src_packages', 'SrcPackageVersion', 7, 'src_package_version', ('src_package',)),
+)
+
+
+def forwards_func(apps, schema_editor):
+    """Index all the already tracked objects for the search, like debmonitor.search.rebuild() does."""
+    SearchTerm = apps.get_model('debmonitor', 'SearchTerm')
+    SearchTrigram = apps.get_model('debmonitor', 'SearchTrigram')
+
+    for app_label, model_name, category, field, select_related in INDEXED:
+        objects = apps.get_model(app_label, model_name).objects.order_by('pk')
+        if select_related:
+            objects = objects.select_related(*select_related)
+
+        last = 0
+        while True:
+            batch = list(objects.filter(pk__gt=last)[:BATCH_SIZE])
+            if not batch:
+                break
+
+            last = batch[-1].pk
+            SearchTerm.objects.bulk_create([_term(SearchTerm, category, field, obj) for obj in batch])
+            trigrams = []
+            for pk, term in SearchTerm.objects.filter(**{'{field}__in'.format(field=field): batch}).values_list(
+                    'pk', 'term'):
+                lower = term.lower()
+                trigrams.extend(SearchTrigram(term_id=pk, trigram=trigram)
+                                for trigram in sorted({lower[i:i + 3] for i in range(len(lower) - 2)}))
+
+            SearchTrigram.objects.bulk_create(trigrams, batch_size=BATCH_SIZE)
+
+
+def _term(SearchTerm, category, field, obj):
+    """Return the SearchTerm object of the given object, like debmonitor.search does."""
+    term = SearchTerm(category=category, **{field: obj})
+    if category in (6, 7):
+        term.term = obj.version
+        term.name = obj.package.name if category == 6 else obj.src_package.name
+        term.version = obj.version
+        term.os_id = obj.os_id
+    else:
+        term.term = obj.name
+        term.name = obj.name
+
+    if category == 5:
+        term.slug = obj.slug
+        term.os_id = obj.os_id
+
+    return term
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('debmonitor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,86 @@
+from django.db import models
+
+from bin_packages.models import Package, PackageVersion
+from hosts.models import Host
+from images.models import Image
+from kernels.models import KernelVersion
+from src_packages.models import OS, SrcPackage, SrcPackageVersion
+
+
+class SearchTerm(models.Model):
+    """Searchable name or version of an object of the inventory, with the fields needed to render it as a result.
+
+    Each term references its object, hence it's deleted along with it.
+    """
+
+    HOST = 1
+    IMAGE = 2
+    PACKAGE = 3
+    SRC_PACKAGE = 4
+    KERNEL = 5
+    PACKAGE_VERSION = 6
+    SRC_PACKAGE_VERSION = 7
+    CATEGORIES = (
+        (HOST, 'Hosts'),
+        (IMAGE, 'Images'),
+        (PACKAGE, 'Packages'),
+        (SRC_PACKAGE, 'Source Packages'),
+        (KERNEL, 'Kernels'),
+        (PACKAGE_VERSION, 'Package Versions'),
+        (SRC_PACKAGE_VERSION, 'Source Package Versions'),
+    )
+
+    category = models.PositiveSmallIntegerField(choices=CATEGORIES, help_text='Type of the indexed object.')
+    term = models.CharField(max_length=255, help_text='Searchable name or version of the indexed object.')
+    name = models.CharField(max_length=255, help_text='Name of the object to link to from the search results.')
+    version = models.CharField(max_length=255, blank=True, default='',
+                               help_text='Version of the package or source package version, if any.')
+    slug = models.SlugField(max_length=255, blank=True, default='', help_text='Kernel URL slug, if any.')
+    os = models.ForeignKey(OS, null=True, on_delete=models.CASCADE, db_index=False, related_name='+',
+                           verbose_name='operating system', help_text='Operating system of the indexed object, if any.')
+
+    host = models.OneToOneField(Host, null=True, on_delete=models.CASCADE, related_name='search_term',
+                                help_text='Indexed host.')
+    image = models.OneToOneField(Image, null=True, on_delete=models.CASCADE, related_name='search_term',
+                                 help_text='Indexed image.')
+    package = models.OneToOneField(Package, null=True, on_delete=models.CASCADE, related_name='search_term',
+                                   verbose_name='binary package', help_text='Indexed binary package.')
+    src_package = models.OneToOneField(SrcPackage, null=True, on_delete=models.CASCADE, related_name='search_term',
+                                       verbose_name='source package', help_text='Indexed source package.')
+    kernel = models.OneToOneField(KernelVersion, null=True, on_delete=models.CASCADE, related_name='search_term',
+                                  help_text='Indexed kernel.')
+    package_version = models.OneToOneField(
+        PackageVersion, null=True, on_delete=models.CASCADE, related_name='search_term',
+        verbose_name='binary package version', help_text='Indexed binary package version.')
+    src_package_version = models.OneToOneField(
+        SrcPackageVersion, null=True, on_delete=models.CASCADE, related_name='search_term',
+        verbose_name='source package version', help_text='Indexed source package version.')
+
+    class Meta:
+        """Additional metadata."""
+
+        verbose_name = 'search term'
+        verbose_name_plural = 'search terms'
+
+    def __str__(self):
+        """Model representation."""
+        return self.term
+
+
+class SearchTrigram(models.Model):
+    """Lowercase trigram of a search term, to look up the terms that contain a given string."""
+
+    trigram = models.CharField(max_length=3, help_text='Lowercase trigram.')
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE, related_name='trigrams',
+                             help_text='Search term that contains the trigram.')
+
+    class Meta:
+        """Additional metadata."""
+
+        unique_together = ('trigram', 'term')
+        verbose_name = 'search trigram'
+        verbose_name_plural = 'search trigrams'
+
+    def __str__(self):
+        """Model representation."""
+        return self.trigram
@@ -0,0 +1,417 @@
+"""Helpers to read the update payloads from the requests."""
+import codecs
+import gzip
+import json
+import re
+import zlib
+
+from collections import namedtuple
+
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+
+API_V1 = 'v1'
+API_V2 = 'v2'
+API_VERSIONS = (API_V1, API_V2)
+IDENTITY_ENCODINGS = ('', 'identity')
+CHUNK_SIZE = 65536
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+InstalledItem = namedtuple('InstalledItem', ['name', 'version', 'source'])
+UninstalledItem = namedtuple('UninstalledItem', ['name', 'version', 'source'], defaults=(None, None))
+UpgradableItem = namedtuple('UpgradableItem', ['name', 'version_from', 'version_to', 'source', 'type'], defaults=('',))
+ITEM_TYPES = {'installed': InstalledItem, 'uninstalled': UninstalledItem, 'upgradable': UpgradableItem}
+
+
+class PayloadError(Exception):
+    """Raised when unable to read the payload of a request, with the HTTP status code to return."""
+
+    def __init__(self, message, status=400):
+        """Initialize the exception with the HTTP status code to return."""
+        super().__init__(message)
+        self.status = status
+
+
+def supported_encodings():
+    """Return the list of supported Content-Encoding values for the request bodies."""
+    encodings = ['gzip']
+    if zstandard is not None:
+        encodings.append('zstd')
+
+    return encodings
+
+
+def read_body(request):
+    """Return the body of the request, decompressing it as a stream according to its Content-Encoding header.
+
+    The size of the decompressed body is limited by the MAX_PAYLOAD_SIZE configuration to protect from zip bombs.
+
+    Arguments:
+        request (django.http.HttpRequest): the request to read the body from.
+
+    Raises:
+        debmonitor.payload.PayloadError: if the encoding is not supported, the body can't be decompressed or is too big.
+
+    Returns:
+        bytes: the decompressed body.
+    """
+    if _get_encoding(request) in IDENTITY_ENCODINGS:
+        return request.body
+
+    return b''.join(_iter_chunks(request))
+
+
+def parse_update(request):
+    """Incrementally parse the JSON update payload of the request, reading its body in bounded chunks.
+
+    The items of the packages lists are validated and converted to their compact named tuples while reading, so that
+    neither the raw body nor the full parsed JSON are ever held in memory.
+
+    Both API versions are supported. In the v1 format each item is an object with the field names as keys. In the
+    compact v2 format all the names and versions are interned in the ``strings`` list and each item is a list with the
+    indexes of its field values in that list, in the order of the fields of the named tuples. The ``api_version`` and
+    ``strings`` keys of a v2 payload must precede the packages lists.
+
+    Arguments:
+        request (django.http.HttpRequest): the request to read the payload from.
+
+    Raises:
+        debmonitor.payload.PayloadError: if the body can't be read or decompressed, is not valid JSON or any of the
+        packages items is not valid.
+
+    Returns:
+        dict: the parsed payload, with the packages lists as lists of named tuples.
+    """
+    decoder = _StreamDecoder(_iter_chunks(request))
+    if not decoder.peek():
+        raise PayloadError('Empty POST, expected JSON string')
+
+    payload = _parse_update(decoder)
+    if decoder.peek():
+        decoder.error('Extra data')
+
+    return payload
+
+
+def parse_batch_update(request, key):
+    """Incrementally parse a JSON batch update payload, that has the list of the single update payloads in a key.
+
+    Each single update payload is parsed like parse_update() does, all the other keys are ignored.
+
+    Arguments:
+        request (django.http.HttpRequest): the request to read the payload from.
+        key (str): the key of the list of the single update payloads.
+
+    Raises:
+        debmonitor.payload.PayloadError: if the body can't be read or decompressed, is not valid JSON or any of the
+        single update payloads is not valid.
+
+    Returns:
+        list: the parsed single update payloads.
+    """
+    decoder = _StreamDecoder(_iter_chunks(request))
+    if not decoder.peek():
+        raise PayloadError('Empty POST, expected JSON string')
+
+    payloads = []
+    for name in _iter_keys(decoder):
+        if name != key:
+            decoder.value()
+            continue
+
+        for index in _iter_list(decoder, key):
+            try:
+                payloads.append(_parse_update(decoder))
+            except PayloadError as e:
+                raise PayloadError("Invalid item {index} of '{key}': {e}".format(index=index, key=key, e=e))
+
+    if decoder.peek():
+        decoder.error('Extra data')
+
+    return payloads
+
+
+def compact_item(key, index, item):
+    """Validate an item of a packages list of an update payload and return it as a compact named tuple.
+
+    Arguments:
+        key (str): the name of the packages list, one of debmonitor.MANIFEST_KEYS.
+        index (int): the index of the item in its list, used to report validation errors.
+        item (dict, list, tuple): the item, as an object with the field names as keys or as a list of field values.
+
+    Raises:
+        debmonitor.payload.PayloadError: if the item is not valid.
+
+    Returns:
+        tuple: the named tuple of the item.
+    """
+    item_type = ITEM_TYPES[key]
+    defaults = item_type._field_defaults
+    if isinstance(item, dict):
+        values = [item.get(field, defaults.get(field)) for field in item_type._fields]
+    elif isinstance(item, (list, tuple)) and 0 <= len(item_type._fields) - len(item) <= len(defaults):
+        values = list(item) + [defaults[field] for field in item_type._fields[len(item):]]
+    else:
+        raise PayloadError("Invalid item {index} of '{key}': expected an object".format(index=index, key=key))
+
+    for field, value in zip(item_type._fields, values):
+        if not isinstance(value, str) and (field not in defaults or value != defaults[field]):
+            raise PayloadError("Invalid item {index} of '{key}': missing or invalid '{field}'".format(
+                index=index, key=key, field=field))
+
+    return item_type(*values)
+
+
+def compact_payload(payload):
+    """Convert in place the packages lists of an already parsed update payload to lists of compact named tuples.
+
+    Arguments:
+        payload (dict): the update payload, like the spooled ones.
+
+    Raises:
+        debmonitor.payload.PayloadError: if any of the packages lists or their items is not valid.
+
+    Returns:
+        dict: the same payload.
+    """
+    for key in ITEM_TYPES:
+        if key not in payload:
+            continue
+
+        if not isinstance(payload[key], list):
+            raise PayloadError("Invalid '{key}': expected a list".format(key=key))
+
+        payload[key] = [compact_item(key, index, item) for index, item in enumerate(payload[key])]
+
+    return payload
+
+
+def _get_encoding(request):
+    """Return the normalized Content-Encoding of the request."""
+    return request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+
+
+def _iter_chunks(request):
+    """Generate the chunks of the decompressed body of the request, enforcing the MAX_PAYLOAD_SIZE limit."""
+    encoding = _get_encoding(request)
+    errors = (OSError, EOFError, zlib.error)
+    if encoding in IDENTITY_ENCODINGS:
+        reader = request
+        errors = ()  # Let the errors reading the request propagate as usual
+    elif encoding == 'gzip':
+        reader = gzip.GzipFile(fileobj=request, mode='rb')
+    elif encoding == 'zstd' and zstandard is not None:
+        reader = zstandard.ZstdDecompressor().stream_reader(request)
+        errors += (zstandard.ZstdError,)
+    else:
+        raise PayloadError("Unsupported Content-Encoding '{encoding}', supported values are: {supported}".format(
+            encoding=encoding, supported=', '.join(supported_encodings())), status=415)
+
+    limit = settings.DEBMONITOR_MAX_PAYLOAD_SIZE
+    size = 0
+    while True:
+        try:  # The decompression is bounded by the amount of data read
+            chunk = reader.read(min(CHUNK_SIZE, limit + 1 - size))
+        except errors as e:
+            raise PayloadError('Unable to decompress {encoding} payload: {e}'.format(encoding=encoding, e=e))
+
+        if not chunk:
+            return
+
+        size += len(chunk)
+        if size > limit:
+            raise PayloadError('Decompressed payload exceeds the maximum size of {limit} bytes'.format(limit=limit),
+                               status=413)
+
+        yield chunk
+
+
+def _parse_api_version(api_version, has_items):
+    """Validate the API version of an update payload, that must precede the packages lists if not the default one."""
+    if api_version not in API_VERSIONS:
+        raise PayloadError("Unsupported API version '{version}', supported values are: {supported}".format(
+            version=api_version, supported=', '.join(API_VERSIONS)))
+
+    if has_items and api_version != API_V1:
+        raise PayloadError("The 'api_version' key must precede the packages lists in {v2} payloads".format(v2=API_V2))
+
+    return api_version
+
+
+def _expand_item(key, index, item, strings):
+    """Replace the interned strings indexes of a v2 item with their values."""
+    if not isinstance(item, list):
+        raise PayloadError("Invalid item {index} of '{key}': expected a list".format(index=index, key=key))
+
+    try:
+        return [strings[i] if isinstance(i, int) and i >= 0 else None for i in item]
+    except IndexError:
+        raise PayloadError("Invalid item {index} of '{key}': string index out of range".format(index=index, key=key))
+
+
+def _parse_update(decoder):
+    """Parse a single update payload object from the decoder, see parse_update()."""
+    payload = {}
+    strings = None
+    for key in _iter_keys(decoder):
+        if key in ITEM_TYPES:
+            if payload.get('api_version') == API_V2 and strings is None:
+                raise PayloadError("The 'strings' key must precede the packages lists in {v2} payloads".format(
+                    v2=API_V2))
+
+            payload[key] = list(_iter_items(decoder, key, strings))
+        elif key == 'api_version':
+            payload[key] = _parse_api_version(decoder.value(), any(name in payload for name in ITEM_TYPES))
+        elif key == 'strings' and payload.get('api_version') == API_V2:
+            strings = decoder.value()
+            if not isinstance(strings, list) or not all(isinstance(string, str) for string in strings):
+                raise PayloadError("Invalid 'strings': expected a list of strings")
+        else:
+            payload[key] = decoder.value()
+
+    return payload
+
+
+def _iter_keys(decoder):
+    """Generate the keys of the JSON object read from the decoder, each value must be consumed before the next key."""
+    decoder.expect('{')
+    if decoder.peek() == '}':
+        decoder.expect('}')
+        return
+
+    while True:
+        if decoder.peek() != '"':
+            decoder.error('Expecting property name enclosed in double quotes')
+
+        key = decoder.value()
+        decoder.expect(':')
+        yield key
+        if decoder.expect(',}') == '}':
+            return
+
+
+def _iter_list(decoder, key):
+    """Generate the indexes of the JSON list read from the decoder, each item must be consumed before the next one."""
+    if decoder.peek() != '[':
+        decoder.error("Expecting a list for '{key}'".format(key=key))
+
+    decoder.expect('[')
+    if decoder.peek() == ']':
+        decoder.expect(']')
+        return
+
+    index = 0
+    while True:
+        yield index
+        index += 1
+        if decoder.expect(',]') == ']':
+            return
+
+
+def _iter_items(decoder, key, strings=None):
+    """Generate the compact named tuples of the items of a packages list while reading them from the decoder.
+
+    Arguments:
+        decoder (debmonitor.payload._StreamDecoder): the decoder to read the items from.
+        key (str): the name of the packages list.
+        strings (list, optional): the interned strings of a v2 payload, None for a v1 payload.
+    """
+    for index in _iter_list(decoder, key):
+        item = decoder.value()
+        if strings is not None:
+            item = _expand_item(key, index, item, strings)
+
+        yield compact_item(key, index, item)
+
+
+class _StreamDecoder:
+    """Minimal incremental JSON decoder that reads one value at a time from a stream of bytes chunks."""
+
+    def __init__(self, chunks):
+        """Initialize the decoder.
+
+        Arguments:
+            chunks (iterator): the iterator of the UTF-8 encoded bytes chunks to decode.
+        """
+        self._chunks = chunks
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._offset = 0  # Number of characters already discarded from the buffer
+        self._eof = False
+
+    def peek(self):
+        """Skip the whitespaces and return the next character without consuming it, an empty string at the end."""
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        """Consume and return the next character, that must be one of the given ones."""
+        char = self.peek()
+        if not char or char not in chars:
+            self.error('Expecting one of {chars}'.format(chars=', '.join(repr(c) for c in chars)))
+
+        self._pos += 1
+        return char
+
+    def value(self):
+        """Decode and return the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                # The value might be truncated, read at least as much data as is pending to keep the parsing linear
+                if self._fill(len(self._buffer) - self._pos):
+                    continue
+
+                self.error(e.msg, position=self._offset + e.pos)
+
+            if end == len(self._buffer) and self._fill():
+                continue  # A number might continue in the next chunk
+
+            self._pos = end
+            return value
+
+    def error(self, message, position=None):
+        """Raise a PayloadError for the given message at the current or given position."""
+        if position is None:
+            position = self._offset + self._pos
+
+        raise PayloadError('Unable to parse JSON string payload: {message} at char {position}'.format(
+            message=message, position=position))
+
+    def _fill(self, size=1):
+        """Read at least size more characters into the buffer, if available. Return False if there was no more data."""
+        if self._eof:
+            return False
+
+        parts = []
+        read = 0
+        while read < size:
+            chunk = next(self._chunks, None)
+            try:
+                text = self._decoder.decode(chunk or b'', final=chunk is None)
+            except UnicodeDecodeError as e:
+                raise PayloadError('Unable to decode UTF-8 payload: {e}'.format(e=e))
+
+            parts.append(text)
+            read += len(text)
+            if chunk is None:
+                self._eof = True
+                break
+
+        self._offset += self._pos
+        self._buffer = self._buffer[self._pos:] + ''.join(parts)
+        self._pos = 0
+        return read > 0
@@ -0,0 +1,187 @@
+"""Cache of the resolution of immutable natural keys to model objects, like OS names and package versions."""
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.db import transaction
+
+
+GENERATION_KEY = 'debmonitor:resolution:generation'
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class ResolutionCache:
+    """In-process LRU cache of model objects indexed by their natural keys, optionally shared via the Django cache.
+
+    The objects are added to the cache only when the current transaction is committed, to never cache objects that
+    might be rolled back. All the caches are invalidated at once by invalidate(), that bumps a generation number in the
+    Django cache, so that the other processes detect it at their next lookup also when the objects are not shared.
+    """
+
+    def __init__(self, name):
+        """Initialize the cache.
+
+        Arguments:
+            name (str): the name of the cache, used as namespace in the Django cache.
+        """
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._objects = OrderedDict()  # key: (expiration timestamp, object)
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        """Return a dictionary with the cached objects of the given keys, missing keys are not included.
+
+        Arguments:
+            keys (iterable): the natural keys to look up.
+
+        Returns:
+            dict: the found objects indexed by their natural key.
+        """
+        keys = list(keys)
+        config = _get_config()
+        if not keys or not config['SIZE']:
+            return {}
+
+        generation = self._sync_generation()
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._objects.get(key, None)
+                if entry is None or entry[0] < now:
+                    continue
+
+                self._objects.move_to_end(key)
+                found[key] = entry[1]
+
+        if config['SHARED'] and len(found) < len(keys):
+            missing = {self._shared_key(generation, key): key for key in keys if key not in found}
+            shared = {missing[shared_key]: obj for shared_key, obj in django_cache.get_many(missing.keys()).items()}
+            self._store(shared, config)
+            found.update(shared)
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return found
+
+    def get(self, key):
+        """Return the cached object of the given key or None if not cached."""
+        return self.get_many([key]).get(key, None)
+
+    def set_many(self, objects):
+        """Add the given objects to the cache once the current transaction, if any, is committed.
+
+        Arguments:
+            objects (dict): the objects to cache indexed by their natural key.
+        """
+        config = _get_config()
+        if not objects or not config['SIZE']:
+            return
+
+        objects = dict(objects)
+        generation = self._sync_generation()  # The objects might be deleted if invalidated before the commit
+        transaction.on_commit(lambda: self._set_many(objects, config, generation))
+
+    def set(self, key, obj):
+        """Add the given object to the cache once the current transaction, if any, is committed."""
+        self.set_many({key: obj})
+
+    def clear(self):
+        """Clear the in-process cache."""
+        with self._lock:
+            self._objects.clear()
+
+    def stats(self):
+        """Return a dictionary with the hits, misses and size counters."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._objects)}
+
+    def _set_many(self, objects, config, generation):
+        """Add the given objects to the in-process cache and to the shared one, if still of the given generation."""
+        if self._sync_generation() != generation:
+            return
+
+        self._store(objects, config)
+        if config['SHARED']:
+            django_cache.set_many({self._shared_key(generation, key): obj for key, obj in objects.items()},
+                                  timeout=config['TIMEOUT'])
+
+    def _store(self, objects, config):
+        """Add the given objects to the in-process cache, evicting the least recently used ones."""
+        expiration = time.monotonic() + config['TIMEOUT']
+        with self._lock:
+            for key, obj in objects.items():
+                self._objects[key] = (expiration, obj)
+                self._objects.move_to_end(key)
+
+            while len(self._objects) > config['SIZE']:
+                self._objects.popitem(last=False)
+
+    def _sync_generation(self):
+        """Clear the in-process cache if the generation in the Django cache changed and return the current one."""
+        generation = django_cache.get_or_set(GENERATION_KEY, 0, timeout=None)
+        if generation != self._generation:
+            with self._lock:
+                self._objects.clear()
+                self._generation = generation
+
+        return generation
+
+    def _shared_key(self, generation, key):
+        """Return the key in the Django cache for the given natural key, safe for all the cache backends."""
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return 'debmonitor:resolution:{generation}:{name}:{digest}'.format(
+            generation=generation, name=self.name, digest=digest)
+
+
+def get_cache(name):
+    """Return the resolution cache with the given name, creating it if needed."""
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = ResolutionCache(name)
+
+        return _caches[name]
+
+
+def invalidate():
+    """Invalidate all the resolution caches, also in the other processes if the Django cache is shared by them."""
+    try:
+        django_cache.incr(GENERATION_KEY)
+    except ValueError:  # Not set yet
+        django_cache.set(GENERATION_KEY, 1, timeout=None)
+
+    clear()
+
+
+def clear():
+    """Clear all the in-process resolution caches."""
+    with _caches_lock:
+        caches = list(_caches.values())
+
+    for cache in caches:
+        cache.clear()
+
+
+def stats():
+    """Return a dictionary with the counters of all the resolution caches, indexed by cache name."""
+    with _caches_lock:
+        caches = list(_caches.values())
+
+    return {cache.name: cache.stats() for cache in caches}
+
+
+def _get_config():
+    """Return the resolution cache configuration with the defaults applied."""
+    config = {'SIZE': 10000, 'SHARED': False, 'TIMEOUT': 86400}
+    config.update(settings.DEBMONITOR_RESOLUTION_CACHE)
+    return config
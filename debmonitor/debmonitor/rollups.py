@@ -0,0 +1,179 @@
+"""Precomputed aggregates of the binary and source packages for their list pages.
+
+The ingestion, deletions and garbage collection only mark as dirty the packages they modify, the rollups of the dirty
+packages are then refreshed in batches by refresh_dirty(), without locking the packages tables. The new packages and
+versions are added to the search index along with their rollups. When the updates are not spooled a bounded batch of
+the dirty packages is refreshed after each submission is committed, see refresh_on_commit().
+"""
+import logging
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from bin_packages.models import DirtyPackage, Package, PackageRollup, PackageVersion
+from debmonitor import generation, search
+from hosts.models import HostPackage, SECURITY_UPGRADE
+from images.models import ImagePackage
+from src_packages.models import DirtySrcPackage, SrcPackage, SrcPackageRollup, SrcPackageVersion
+
+
+DEFAULT_BATCH_SIZE = 1000
+logger = logging.getLogger(__name__)
+
+
+def refresh_dirty(batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """Refresh the rollups of all the dirty binary and source packages.
+
+    Arguments:
+        batch_size (int, optional): the number of packages to refresh in each transaction.
+        max_batches (int, optional): the maximum number of batches to refresh for each dirty set, all if None.
+
+    Returns:
+        tuple: the number of refreshed binary and source packages.
+    """
+    return (_refresh_dirty(DirtyPackage, refresh_packages, batch_size, max_batches),
+            _refresh_dirty(DirtySrcPackage, refresh_src_packages, batch_size, max_batches))
+
+
+def refresh_on_commit(batch_size=DEFAULT_BATCH_SIZE):
+    """Refresh one batch of each dirty set once the current transaction, if any, is committed.
+
+    It keeps the rollups and the search index up to date when the updates are applied synchronously, bounding the
+    work done by each request. The packages left dirty are refreshed by the next submissions or by
+    ``debmonitorrebuild --dirty``.
+
+    Arguments:
+        batch_size (int, optional): the maximum number of packages of each dirty set to refresh.
+    """
+    transaction.on_commit(lambda: _refresh_batch(batch_size))
+
+
+def rebuild(batch_size=DEFAULT_BATCH_SIZE):
+    """Rebuild the rollups of all the binary and source packages.
+
+    Arguments:
+        batch_size (int, optional): the number of packages to refresh in each transaction.
+
+    Returns:
+        tuple: the number of refreshed binary and source packages.
+    """
+    counts = []
+    for model, dirty_model, refresh in ((Package, DirtyPackage, refresh_packages),
+                                        (SrcPackage, DirtySrcPackage, refresh_src_packages)):
+        dirty_model.objects.all().delete()  # The packages modified from now on are marked again
+        pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+        for i in range(0, len(pks), batch_size):
+            refresh(pks[i:i + batch_size])
+
+        counts.append(len(pks))
+
+    generation.bump()
+    return tuple(counts)
+
+
+def refresh_packages(pks):
+    """Recompute the rollups of the binary packages with the given primary keys, skipping the deleted ones.
+
+    As the upgradable package of a HostPackage or ImagePackage object is always its installed package, the upgrades
+    are counted by installed package too.
+
+    Arguments:
+        pks (list): the primary keys of the binary packages.
+    """
+    versions = PackageVersion.objects.select_related(None).filter(package__in=pks)
+    rollups = {pk: PackageRollup(package_id=pk, versions_count=count) for pk, count in versions.order_by().values(
+        'package').annotate(count=Count('pk')).values_list('package', 'count')}
+
+    for pk, os_list in _os_lists(versions, 'package').items():
+        rollups[pk].os_list = os_list
+
+    for model, upgradable_field, prefix in ((HostPackage, 'upgradable_package', 'hosts'),
+                                            (ImagePackage, 'upgradable_imagepackage', 'images')):
+        for pk, installed, upgrades, security in _installed_counts(model, upgradable_field, pks):
+            rollup = rollups.setdefault(pk, PackageRollup(package_id=pk))
+            setattr(rollup, '{prefix}_count'.format(prefix=prefix), installed)
+            setattr(rollup, '{prefix}_upgrades_count'.format(prefix=prefix), upgrades)
+            setattr(rollup, '{prefix}_security_count'.format(prefix=prefix), security)
+
+    search.index(Package, pk__in=pks)
+    search.index(PackageVersion, package__in=pks)
+    existing = set(Package.objects.filter(pk__in=pks).values_list('pk', flat=True))
+    with transaction.atomic():
+        PackageRollup.objects.filter(pk__in=pks).delete()
+        PackageRollup.objects.bulk_create(rollups.get(pk, PackageRollup(package_id=pk)) for pk in sorted(existing))
+
+
+def refresh_src_packages(pks):
+    """Recompute the rollups of the source packages with the given primary keys, skipping the deleted ones.
+
+    Arguments:
+        pks (list): the primary keys of the source packages.
+    """
+    versions = SrcPackageVersion.objects.select_related(None).filter(src_package__in=pks)
+    rollups = {pk: SrcPackageRollup(src_package_id=pk, versions_count=count) for pk, count in versions.order_by(
+        ).values('src_package').annotate(count=Count('pk')).values_list('src_package', 'count')}
+
+    for pk, os_list in _os_lists(versions, 'src_package').items():
+        rollups[pk].os_list = os_list
+
+    search.index(SrcPackage, pk__in=pks)
+    search.index(SrcPackageVersion, src_package__in=pks)
+    existing = set(SrcPackage.objects.filter(pk__in=pks).values_list('pk', flat=True))
+    with transaction.atomic():
+        SrcPackageRollup.objects.filter(pk__in=pks).delete()
+        SrcPackageRollup.objects.bulk_create(
+            rollups.get(pk, SrcPackageRollup(src_package_id=pk)) for pk in sorted(existing))
+
+
+def _refresh_batch(batch_size):
+    """Refresh one batch of each dirty set, logging the failures as the submission was already committed."""
+    try:
+        refresh_dirty(batch_size, max_batches=1)
+    except Exception:  # The claimed packages are marked again and retried at the next refresh
+        logger.exception('Unable to refresh the rollups of the dirty packages')
+
+
+def _refresh_dirty(dirty_model, refresh, batch_size, max_batches):
+    """Claim and refresh in batches the packages of the given dirty set, return the number of refreshed ones."""
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            pks = list(dirty_model.objects.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            # Claim them before reading the aggregates, the packages modified afterwards are marked again
+            dirty_model.objects.filter(pk__in=pks).delete()
+
+        if not pks:
+            return total
+
+        try:
+            refresh(pks)
+        except Exception:
+            dirty_model.objects.mark(pks)  # Retry them at the next refresh
+            raise
+
+        total += len(pks)
+        batches += 1
+        generation.bump()  # The list pages read the rollups
+        logger.info('Refreshed the rollups of %d %s objects', len(pks), dirty_model.__name__)
+
+    return total
+
+
+def _os_lists(versions, field):
+    """Return the sorted comma-separated list of the distinct OS names of the given versions by the given field."""
+    os_names = defaultdict(set)
+    for pk, os_name in versions.order_by().values_list(field, 'os__name').distinct():
+        os_names[pk].add(os_name)
+
+    return {pk: ', '.join(sorted(names)) for pk, names in os_names.items()}
+
+
+def _installed_counts(model, upgradable_field, pks):
+    """Return the installed, upgradable and security upgradable counts of the given packages in the given model."""
+    return model.objects.select_related(None).filter(package__in=pks).order_by().values('package').annotate(
+        installed=Count('pk'), upgrades=Count(upgradable_field),
+        security=Count('pk', filter=Q(upgrade_type=SECURITY_UPGRADE))).values_list(
+        'package', 'installed', 'upgrades', 'security')
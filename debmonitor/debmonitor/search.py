@@ -0,0 +1,167 @@
+"""Trigram index of the names and versions of the inventory, to search them by substring without scanning the tables.
+
+The hosts, images and kernels are indexed when created, while the binary and source packages and their versions are
+indexed when their rollups are refreshed. The terms are deleted along with the indexed objects.
+"""
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, IntegerField, When, Window
+from django.db.models.functions import RowNumber
+
+from bin_packages.models import Package, PackageVersion
+from debmonitor.models import SearchTerm, SearchTrigram
+from hosts.models import Host
+from images.models import Image
+from kernels.models import KernelVersion
+from src_packages.models import SrcPackage, SrcPackageVersion
+
+
+DEFAULT_BATCH_SIZE = 1000
+RESULT_FIELDS = ('category', 'name', 'version', 'slug', 'os_id', 'os_name')
+# The SearchTerm category, the reference field and the related objects to select of each indexed model
+Indexed = namedtuple('Indexed', ['category', 'field', 'select_related'])
+INDEXED = {
+    Host: Indexed(SearchTerm.HOST, 'host', ()),
+    Image: Indexed(SearchTerm.IMAGE, 'image', ()),
+    Package: Indexed(SearchTerm.PACKAGE, 'package', ()),
+    SrcPackage: Indexed(SearchTerm.SRC_PACKAGE, 'src_package', ()),
+    KernelVersion: Indexed(SearchTerm.KERNEL, 'kernel', ('os',)),
+    PackageVersion: Indexed(SearchTerm.PACKAGE_VERSION, 'package_version', ('package',)),
+    SrcPackageVersion: Indexed(SearchTerm.SRC_PACKAGE_VERSION, 'src_package_version', ('src_package',)),
+}
+
+
+def trigrams(text):
+    """Return the set of lowercase trigrams of the given text, empty if shorter than three characters."""
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def add(objects):
+    """Index the given objects of the same indexed model, skipping the already indexed ones.
+
+    Arguments:
+        objects (list): the objects to index, with the related objects of their model already selected.
+    """
+    if not objects:
+        return
+
+    indexed = INDEXED[type(objects[0])]
+    terms = [_term(indexed, obj) for obj in objects]
+    with transaction.atomic():
+        # Objects indexed in the meanwhile by a concurrent request are silently skipped and their trigrams too
+        SearchTerm.objects.bulk_create(terms, ignore_conflicts=True)
+        trigram_objects = []
+        for pk, term in SearchTerm.objects.filter(**{'{field}__in'.format(field=indexed.field): objects}).values_list(
+                'pk', 'term'):
+            trigram_objects.extend(SearchTrigram(term_id=pk, trigram=trigram) for trigram in sorted(trigrams(term)))
+
+        SearchTrigram.objects.bulk_create(trigram_objects, ignore_conflicts=True, batch_size=DEFAULT_BATCH_SIZE)
+
+
+def index(model, batch_size=DEFAULT_BATCH_SIZE, **filters):
+    """Index the objects of the given model that are not indexed yet, optionally filtered.
+
+    Arguments:
+        model (django.db.models.Model): the indexed model.
+        batch_size (int, optional): the number of objects to index in each transaction.
+        **filters: the optional filters to apply to the objects of the model.
+
+    Returns:
+        int: the number of indexed objects.
+    """
+    indexed = INDEXED[model]
+    missing = model.objects.select_related(None).filter(search_term__isnull=True, **filters)
+    if indexed.select_related:
+        missing = missing.select_related(*indexed.select_related)
+
+    total = 0
+    while True:
+        objects = list(missing.order_by('pk')[:batch_size])
+        if not objects:
+            return total
+
+        add(objects)
+        total += len(objects)
+
+
+def rebuild(batch_size=DEFAULT_BATCH_SIZE):
+    """Index all the objects of the inventory that are not indexed yet, return the number of indexed objects."""
+    return sum(index(model, batch_size=batch_size) for model in INDEXED)
+
+
+def search(query, limit, category=None, offset=0):
+    """Search the terms that contain the query, case-insensitive, with the exact and prefix matches ranked first.
+
+    The results of each category are capped to the given limit, all the categories are searched with a single query.
+
+    Arguments:
+        query (str): the string to search.
+        limit (int): the maximum number of results of each category.
+        category (int, optional): the SearchTerm category to search, all of them if not set.
+        offset (int, optional): the number of results of the category to skip, to paginate them.
+
+    Returns:
+        dict: a dictionary with the SearchTerm categories as keys and the list of their results as values, with up to
+        limit + 1 results each to tell if there are more. Each result is a dictionary with the RESULT_FIELDS keys.
+    """
+    terms = SearchTerm.objects.filter(term__icontains=query).annotate(
+        os_name=F('os__name'),
+        match_rank=Case(When(term__iexact=query, then=0), When(term__istartswith=query, then=1), default=2,
+                        output_field=IntegerField()))
+
+    query_trigrams = trigrams(query)
+    if query_trigrams:  # Select the terms that have all the trigrams first, to not scan the whole table
+        terms = terms.filter(pk__in=SearchTrigram.objects.filter(trigram__in=query_trigrams).order_by().values(
+            'term').annotate(matches=Count('pk')).filter(matches=len(query_trigrams)).values('term'))
+
+    results = {category_id: [] for category_id, _ in SearchTerm.CATEGORIES}
+    if category is not None:
+        rows = terms.filter(category=category).order_by('match_rank', 'term', 'name').values(
+            *RESULT_FIELDS)[offset:offset + limit + 1]
+    elif connection.features.supports_over_clause:
+        rows = _ranked_rows(terms, limit)
+    else:
+        rows = []
+        for category_id in results:
+            rows.extend(terms.filter(category=category_id).order_by('match_rank', 'term', 'name').values(
+                *RESULT_FIELDS)[:limit + 1])
+
+    for row in rows:
+        results[row['category']].append(row)
+
+    return results
+
+
+def _ranked_rows(terms, limit):
+    """Return the first limit + 1 rows of each category of the given terms, with a window function."""
+    ranked = terms.annotate(match_row=Window(
+        expression=RowNumber(), partition_by=[F('category')], order_by=[F('match_rank'), F('term'), F('name')]))
+    # Filtering on a window function is not supported by the ORM, select the rows from the ranked query
+    sql, params = ranked.order_by().values(*RESULT_FIELDS, 'match_row').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT {fields} FROM ({sql}) ranked WHERE match_row <= %s ORDER BY category, match_row'.format(
+                fields=', '.join(RESULT_FIELDS), sql=sql), (*params, limit + 1))
+        return [dict(zip(RESULT_FIELDS, row)) for row in cursor.fetchall()]
+
+
+def _term(indexed, obj):
+    """Return the SearchTerm object of the given indexed object."""
+    term = SearchTerm(category=indexed.category, **{indexed.field: obj})
+    if indexed.category in (SearchTerm.PACKAGE_VERSION, SearchTerm.SRC_PACKAGE_VERSION):
+        package = obj.package if indexed.category == SearchTerm.PACKAGE_VERSION else obj.src_package
+        term.term = obj.version
+        term.name = package.name
+        term.version = obj.version
+        term.os_id = obj.os_id
+    else:
+        term.term = obj.name
+        term.name = obj.name
+
+    if indexed.category == SearchTerm.KERNEL:
+        term.slug = obj.slug
+        term.os_id = obj.os_id
+
+    return term
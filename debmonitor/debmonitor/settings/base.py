@@ -25,7 +25,20 @@ DEBMONITOR_PROXY_IMAGES = DEBMONITOR_CONFIG.get('PROXY_IMAGES', [])
 DEBMONITOR_HOST_EXTERNAL_LINKS = DEBMONITOR_CONFIG.get('HOST_EXTERNAL_LINKS', {})
 DEBMONITOR_IMAGE_EXTERNAL_LINKS = DEBMONITOR_CONFIG.get('IMAGE_EXTERNAL_LINKS', {})
 DEBMONITOR_SEARCH_MIN_LENGTH = DEBMONITOR_CONFIG.get('SEARCH_MIN_LENGTH', 3)
+DEBMONITOR_SEARCH_PAGE_SIZE = DEBMONITOR_CONFIG.get('SEARCH_PAGE_SIZE', 100)
+DEBMONITOR_TABLES_MAX_PAGE_LENGTH = DEBMONITOR_CONFIG.get('TABLES_MAX_PAGE_LENGTH', 1000)
 DEBMONITOR_JAVASCRIPT_STORAGE = DEBMONITOR_CONFIG.get('JAVASCRIPT_STORAGE', 'Debian')
+# Asynchronous updates: {"PATH": "/path/to/spool.sqlite"}, processed by the debmonitorworker management command
+DEBMONITOR_SPOOL = DEBMONITOR_CONFIG.get('SPOOL', {})
+# Maximum size in bytes of the decompressed update payloads sent with a Content-Encoding
+DEBMONITOR_MAX_PAYLOAD_SIZE = DEBMONITOR_CONFIG.get('MAX_PAYLOAD_SIZE', 100 * 1024 * 1024)
+# Number of attempts to apply an update in case of deadlocks or other transient database errors
+DEBMONITOR_UPDATE_RETRIES = DEBMONITOR_CONFIG.get('UPDATE_RETRIES', 3)
+DEBMONITOR_RESOLUTION_CACHE = DEBMONITOR_CONFIG.get('RESOLUTION_CACHE', {})
+DEBMONITOR_ADMISSION_CONTROL = DEBMONITOR_CONFIG.get('ADMISSION_CONTROL', {})
+DEBMONITOR_IDEMPOTENCY = DEBMONITOR_CONFIG.get('IDEMPOTENCY', {})
+DEBMONITOR_STATISTICS_CACHE = DEBMONITOR_CONFIG.get('STATISTICS_CACHE', {})
+DEBMONITOR_CONDITIONAL_GET = DEBMONITOR_CONFIG.get('CONDITIONAL_GET', {})
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -53,6 +66,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'debmonitor.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -126,6 +140,11 @@ else:
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
+# Cache, shared between the processes only if configured with a shared backend like Memcached or Redis
+
+if DEBMONITOR_CONFIG.get('CACHES', {}):
+    CACHES = DEBMONITOR_CONFIG['CACHES']
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
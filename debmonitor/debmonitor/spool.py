@@ -0,0 +1,143 @@
+"""Local durable spool to asynchronously apply the update submissions."""
+import json
+import logging
+import sqlite3
+import time
+
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from debmonitor import metrics
+
+
+FULL_UPDATE = 'full'
+SCHEMA = """CREATE TABLE IF NOT EXISTS spool (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    update_type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+)"""
+SpoolEntry = namedtuple('SpoolEntry', ['id', 'kind', 'name', 'update_type', 'payload', 'attempts'])
+logger = logging.getLogger(__name__)
+
+
+def is_enabled():
+    """Return True if the update submissions must be spooled instead of being applied synchronously."""
+    return bool(settings.DEBMONITOR_SPOOL.get('PATH', ''))
+
+
+def coalesce(entries):
+    """Group the spooled entries by object, discarding the ones superseded by a later full update.
+
+    For each object only the newest full update and all the partial updates submitted after it need to be applied,
+    in the order in which they were submitted.
+
+    Arguments:
+        entries (list): the list of SpoolEntry objects, sorted by submission order.
+
+    Returns:
+        tuple: a tuple with an OrderedDict with (kind, name) tuples as keys and the list of SpoolEntry objects to
+        apply as values, and a list with the IDs of the superseded entries.
+    """
+    groups = OrderedDict()
+    for entry in entries:
+        groups.setdefault((entry.kind, entry.name), []).append(entry)
+
+    superseded = []
+    for key, group in groups.items():
+        last_full = max((i for i, entry in enumerate(group) if entry.update_type == FULL_UPDATE), default=0)
+        superseded.extend(entry.id for entry in group[:last_full])
+        groups[key] = group[last_full:]
+
+    return groups, superseded
+
+
+class Spool:
+    """SQLite-backed spool of the update submissions."""
+
+    def __init__(self, path=None):
+        """Initialize the spool.
+
+        Arguments:
+            path (str, optional): the path of the SQLite file. If not set the configured one is used.
+        """
+        if path is None:
+            path = settings.DEBMONITOR_SPOOL['PATH']
+
+        self.path = path
+
+    def push(self, kind, name, payload):
+        """Add an update submission to the spool.
+
+        Arguments:
+            kind (str): the kind of object to update (i.e. hosts, images).
+            name (str): the name of the object to update.
+            payload (dict): the already validated update payload.
+        """
+        with self._connect() as conn:
+            conn.execute('INSERT INTO spool (kind, name, update_type, payload, created) VALUES (?, ?, ?, ?, ?)',
+                         (kind, name, payload['update_type'], json.dumps(payload), time.time()))
+
+    def pop_batch(self, size, max_attempts):
+        """Return a batch of coalesced entries to apply, deleting the superseded and exhausted ones.
+
+        Each exhausted entry is logged and counted in the metrics before being deleted, as its update is lost.
+
+        Arguments:
+            size (int): the maximum number of spooled entries to read.
+            max_attempts (int): the number of failed attempts after which an entry is discarded.
+
+        Returns:
+            collections.OrderedDict: the coalesced entries as returned by coalesce().
+        """
+        with self._connect() as conn:
+            exhausted = list(conn.execute(
+                'SELECT id, kind, name, update_type, attempts FROM spool WHERE attempts >= ? ORDER BY id',
+                (max_attempts,)))
+            for entry_id, kind, name, update_type, attempts in exhausted:
+                logger.error("Discarded spooled %s submission %d for %s '%s' after %d failed attempts",
+                             update_type, entry_id, kind, name, attempts)
+                metrics.count_discarded(kind)
+
+            conn.executemany('DELETE FROM spool WHERE id = ?', ((row[0],) for row in exhausted))
+            entries = [SpoolEntry(*row) for row in conn.execute(
+                'SELECT id, kind, name, update_type, payload, attempts FROM spool ORDER BY id LIMIT ?', (size,))]
+
+        groups, superseded = coalesce(entries)
+        self.delete(superseded)
+        return groups
+
+    def delete(self, ids):
+        """Delete the given entries from the spool."""
+        if not ids:
+            return
+
+        with self._connect() as conn:
+            conn.executemany('DELETE FROM spool WHERE id = ?', ((entry_id,) for entry_id in ids))
+
+    def failed(self, entry_id):
+        """Record a failed attempt to apply the given entry."""
+        with self._connect() as conn:
+            conn.execute('UPDATE spool SET attempts = attempts + 1 WHERE id = ?', (entry_id,))
+
+    def __len__(self):
+        """Return the number of spooled entries."""
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+    @contextmanager
+    def _connect(self):
+        """Context manager that yields a transaction on the spool database, creating the schema if needed."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')  # Allow the web workers to write while the worker is reading
+            with conn:  # Commit or rollback the transaction
+                conn.execute(SCHEMA)
+                yield conn
+        finally:
+            conn.close()
@@ -13,6 +13,7 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('search', views.search, name='search'),
     path('auth-check', views.auth_check, name='auth_check'),
+    path('metrics', views.metrics, name='metrics'),
     path('hosts/', include('hosts.urls')),
     path('images/', include('images.urls')),
     path('kernels/', include('kernels.urls')),
@@ -5,14 +5,17 @@ from collections import namedtuple
 
 from django import http
 from django.conf import settings
-from django.db.models import Count, F, Max, Min
+from django.db.models import Count, Max, Min
 from django.shortcuts import render
+from django.utils.http import urlencode
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET, require_safe
 
 from bin_packages.models import Package, PackageVersion
-from debmonitor.decorators import verify_clients
+from debmonitor import generation, metrics as debmonitor_metrics, search as debmonitor_search
+from debmonitor.decorators import conditional_get, inventory_validators, verify_clients
 from debmonitor.middleware import TEXT_PLAIN
+from debmonitor.models import SearchTerm
 from hosts.models import Host, HostPackage, SECURITY_UPGRADE
 from images.models import Image, ImagePackage
 from kernels.models import KernelVersion
@@ -22,13 +25,30 @@ from src_packages.models import SrcPackage, SrcPackageVersion
 
 CLIENT_VERSION_HEADER = 'X-Debmonitor-Client-Version'
 CLIENT_CHECKSUM_HEADER = 'X-Debmonitor-Client-Checksum'
-SearchResult = namedtuple('SearchResult', ['title', 'url_name', 'results'])
+STATISTICS_KEY = 'debmonitor:statistics'
+SearchResult = namedtuple('SearchResult', ['title', 'url_name', 'results', 'previous_url', 'next_url'])
+SEARCH_URL_NAMES = {
+    SearchTerm.HOST: 'hosts:detail',
+    SearchTerm.IMAGE: 'images:detail',
+    SearchTerm.PACKAGE: 'bin_packages:detail',
+    SearchTerm.SRC_PACKAGE: 'src_packages:detail',
+    SearchTerm.KERNEL: 'kernels:detail',
+    SearchTerm.PACKAGE_VERSION: 'bin_packages:detail',
+    SearchTerm.SRC_PACKAGE_VERSION: 'src_packages:detail',
+}
 logger = logging.getLogger(__name__)
 
 
 @require_safe
+@conditional_get(inventory_validators)
 def index(request):
-    """Homepage."""
+    """Homepage, with the statistics cached until the inventory changes."""
+    args = generation.cached(STATISTICS_KEY, settings.DEBMONITOR_STATISTICS_CACHE.get('MAX_AGE', 60), _statistics)
+    return render(request, 'index.html', args)
+
+
+def _statistics():
+    """Return the template arguments of the homepage with the statistics of the whole inventory."""
     hosts = Host.objects.values('modified').aggregate(
         Max('modified'),
         Min('modified'),
@@ -88,7 +108,7 @@ def index(request):
         ]},
     ]
 
-    args = {
+    return {
         'updates': [
             {'title': 'Latest', 'value': hosts['modified__max']},
             {'title': 'Oldest', 'value': hosts['modified__min']},
@@ -112,33 +132,16 @@ def index(request):
         ],
     }
 
-    return render(request, 'index.html', args)
-
 
 @require_GET
+@conditional_get(inventory_validators)
 def search(request):
+    """Search results page, with the results of each category capped and paginated."""
     search_results = []
     query = request.GET.get('q')
 
     if query and len(query) >= settings.DEBMONITOR_SEARCH_MIN_LENGTH:
-        search_results = [
-            SearchResult(title='Hosts', url_name='hosts:detail',
-                         results=Host.objects.filter(name__contains=query).select_related(None).values('name')),
-            SearchResult(title='Images', url_name='images:detail',
-                         results=Image.objects.filter(name__contains=query).select_related(None).values('name')),
-            SearchResult(title='Packages', url_name='bin_packages:detail',
-                         results=Package.objects.filter(name__contains=query).select_related(None).values('name')),
-            SearchResult(title='Source Packages', url_name='src_packages:detail',
-                         results=SrcPackage.objects.filter(name__contains=query).select_related(None).values('name')),
-            SearchResult(title='Kernels', url_name='kernels:detail',
-                         results=KernelVersion.objects.filter(name__contains=query).select_related(None)),
-            SearchResult(title='Package Versions', url_name='bin_packages:detail',
-                         results=PackageVersion.objects.filter(version__contains=query).select_related(
-                            'package').annotate(name=F('package__name')).values('name', 'version', 'os__name')),
-            SearchResult(title='Source Package Versions', url_name='src_packages:detail',
-                         results=SrcPackageVersion.objects.filter(version__contains=query).select_related(
-                            'src_package').annotate(name=F('src_package__name')).values('name', 'version', 'os__name')),
-        ]
+        search_results = _search_results(request, query)
 
     args = {
         # The IDs are DataTable column IDs.
@@ -156,9 +159,53 @@ def search(request):
     return render(request, 'search.html', args)
 
 
+def _search_results(request, query):
+    """Return the list of SearchResult of the query, of all the categories or of the one requested with its page."""
+    page_size = settings.DEBMONITOR_SEARCH_PAGE_SIZE
+    try:
+        category = int(request.GET['category'])
+        page = max(int(request.GET.get('page', 1)), 1)
+    except (KeyError, ValueError):
+        category = None
+        page = 1
+
+    if category not in SEARCH_URL_NAMES:
+        category = None
+
+    results = debmonitor_search.search(query, page_size, category=category, offset=(page - 1) * page_size)
+    search_results = []
+    for category_id, title in SearchTerm.CATEGORIES:
+        if category is not None and category_id != category:
+            continue
+
+        previous_url = next_url = None
+        if page > 1:
+            previous_url = '?' + urlencode({'q': query, 'category': category_id, 'page': page - 1})
+        if len(results[category_id]) > page_size:
+            next_url = '?' + urlencode({'q': query, 'category': category_id, 'page': page + 1})
+
+        search_results.append(SearchResult(title=title, url_name=SEARCH_URL_NAMES[category_id],
+                                           results=results[category_id][:page_size], previous_url=previous_url,
+                                           next_url=next_url))
+
+    return search_results
+
+
 @verify_clients
 @csrf_exempt
 @require_safe
 def auth_check(request):
     """Endpoint to verify the authentication via certificate."""
     return http.HttpResponse('OK', content_type=TEXT_PLAIN)
+
+
+@verify_clients
+@require_safe
+def metrics(request):
+    """Endpoint to export the Prometheus metrics."""
+    if not debmonitor_metrics.is_enabled():
+        return http.HttpResponseNotFound('Metrics not available, the prometheus_client module is not installed',
+                                         content_type=TEXT_PLAIN)
+
+    content, content_type = debmonitor_metrics.export()
+    return http.HttpResponse(content, content_type=content_type)
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.25 on 2026-10-17 01:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hosts', '0006_auto_20200114_0021'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='host',
+            name='manifest_digest',
+            field=models.CharField(
+                blank=True, max_length=64, null=True,
+                help_text='Digest of the packages manifest of the last full update, if not modified afterwards.'),
+        ),
+    ]
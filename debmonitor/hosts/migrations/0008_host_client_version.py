@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-17 01:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hosts', '0007_host_manifest_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='host',
+            name='client_version',
+            field=models.CharField(
+                blank=True, max_length=255, null=True, help_text='Version of the client that sent the last update.'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:14
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def forwards_func(apps, schema_editor):
+    """Populate the packages counters of all the hosts from their HostPackage objects."""
+    Host = apps.get_model('hosts', 'Host')
+    HostPackage = apps.get_model('hosts', 'HostPackage')
+
+    def count(**filters):
+        counts = HostPackage.objects.filter(host=OuterRef('pk'), **filters).order_by().values('host').annotate(
+            count=Count('*')).values('count')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    Host.objects.update(
+        packages_count=count(), upgrades_count=count(upgradable_package__isnull=False),
+        security_count=count(upgrade_type='security'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hosts', '0008_host_client_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='host',
+            name='packages_count',
+            field=models.PositiveIntegerField(
+                default=0, help_text='Number of binary packages installed on this host.'),
+        ),
+        migrations.AddField(
+            model_name='host',
+            name='security_count',
+            field=models.PositiveIntegerField(
+                default=0, help_text='Number of binary packages installed on this host pending a security upgrade.'),
+        ),
+        migrations.AddField(
+            model_name='host',
+            name='upgrades_count',
+            field=models.PositiveIntegerField(
+                default=0, help_text='Number of binary packages installed on this host that could be upgraded.'),
+        ),
+        migrations.AddIndex(
+            model_name='host',
+            index=models.Index(fields=['packages_count'], name='hosts_host_package_019f2c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='host',
+            index=models.Index(fields=['upgrades_count'], name='hosts_host_upgrade_bd37ad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='host',
+            index=models.Index(fields=['security_count'], name='hosts_host_securit_948b20_idx'),
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
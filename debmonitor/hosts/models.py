@@ -1,8 +1,9 @@
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Count, Q
 
 from bin_packages.models import Package, PackageVersion
-from debmonitor import SelectManager
+from debmonitor import refresh_counts, SelectManager
 from kernels.models import KernelVersion
 from src_packages.models import OS
 
@@ -34,6 +35,18 @@ class Host(models.Model):
         PackageVersion, related_name='+', through='HostPackage', through_fields=('host', 'upgradable_version'),
         db_index=True, blank=True, verbose_name='upgradable binary package versions',
         help_text='Binary package versions installed on this host that could be upgraded.')
+    manifest_digest = models.CharField(
+        max_length=64, blank=True, null=True,
+        help_text='Digest of the packages manifest of the last full update, if not modified afterwards.')
+    client_version = models.CharField(
+        max_length=255, blank=True, null=True, help_text='Version of the client that sent the last update.')
+
+    packages_count = models.PositiveIntegerField(
+        default=0, help_text='Number of binary packages installed on this host.')
+    upgrades_count = models.PositiveIntegerField(
+        default=0, help_text='Number of binary packages installed on this host that could be upgraded.')
+    security_count = models.PositiveIntegerField(
+        default=0, help_text='Number of binary packages installed on this host pending a security upgrade.')
 
     created = models.DateTimeField(auto_now_add=True, help_text='Datetime of the creation of this object.')
     modified = models.DateTimeField(auto_now=True, help_text='Datetime of the last modification of this object.')
@@ -43,6 +56,9 @@ class Host(models.Model):
     class Meta:
         """Additional metadata."""
 
+        # One index for each counter, as each one is sorted and filtered on its own
+        indexes = [models.Index(fields=['packages_count']), models.Index(fields=['upgrades_count']),
+                   models.Index(fields=['security_count'])]
         ordering = ['name']
         verbose_name = 'host'
         verbose_name_plural = 'hosts'
@@ -51,6 +67,28 @@ class Host(models.Model):
         """Model representation."""
         return self.name
 
+    def to_dict(self):
+        """Simple dict representation of the Host, with the ETag of its inventory if known."""
+        return {'name': self.name, 'os': self.os.name, 'kernel': self.kernel.name, 'etag': self.manifest_digest,
+                'client_version': self.client_version, 'created': self.created, 'modified': self.modified}
+
+    @classmethod
+    def refresh_counts(cls, hosts):
+        """Recompute the stored packages counters of the given hosts from their HostPackage objects.
+
+        Arguments:
+            hosts (list): the Host objects to refresh, with the counters fields loaded.
+
+        Returns:
+            int: the number of hosts whose counters were changed.
+        """
+        hosts = list(hosts)
+        rows = HostPackage.objects.select_related(None).filter(host__in=hosts).order_by().values('host').annotate(
+            packages=Count('pk'), upgrades=Count('upgradable_package'),
+            security=Count('pk', filter=Q(upgrade_type=SECURITY_UPGRADE))).values_list(
+            'host', 'packages', 'upgrades', 'security')
+        return refresh_counts(hosts, {row[0]: row[1:] for row in rows})
+
     @classmethod
     def _check_m2m_through_same_relationship(cls):
         return []  # Disable models.E003 check for this model
@@ -6,6 +6,7 @@ from hosts import views
 app_name = 'hosts'
 urlpatterns = [
     path('', views.index, name='index'),
+    path('update', views.update_hosts, name='update_batch'),
     path('<name>', views.DetailView.as_view(), name='detail'),
     path('<name>/update', views.update, name='update'),
 ]
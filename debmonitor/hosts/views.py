@@ -1,69 +1,74 @@
 import json
 import logging
 
-from collections import defaultdict
+from collections import ChainMap
 
 from django import http
 from django.core.exceptions import ValidationError
 from django.conf import settings
-from django.db.models import BooleanField, Case, Count, When
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import BooleanField, Case, When
 from django.shortcuts import get_object_or_404, render
-from django.utils import timezone
+from django.urls import reverse
+from django.utils import dateformat, timezone
 from django.utils.decorators import method_decorator
+from django.utils.html import escape
+from django.utils.http import parse_etags, quote_etag
+from django.utils.timesince import timesince
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_safe, require_POST
 
-from bin_packages.models import PackageVersion
-from debmonitor.decorators import verify_clients
-from debmonitor.middleware import TEXT_PLAIN
-from hosts.models import Host, HostPackage, SECURITY_UPGRADE
+from bin_packages.models import DirtyPackage, PackageVersion
+from debmonitor import (datatables, generation, idempotency, manifest_digest, MANIFEST_KEYS, metrics, resolution,
+                        rollups, search, spool)
+from debmonitor.decorators import (admission_control, atomic_retry, conditional_get, inventory_validators,
+                                   is_retryable_error, verify_clients)
+from debmonitor.middleware import APPLICATION_JSON, SSL_CLIENT_SUBJECT_DN_HEADER, TEXT_PLAIN
+from debmonitor.payload import compact_payload, parse_batch_update, parse_update, PayloadError
+from debmonitor.views import CLIENT_VERSION_HEADER
+from hosts.models import Host, HostPackage
 from kernels.models import KernelVersion
 from src_packages.models import OS
 
 
+UPGRADABLE_UPDATE = 'upgradable'
+INDEX_TABLE_HEADERS = [
+    {'title': 'Hostname', 'badges': [
+     {'style': 'primary', 'tooltip': 'Number of packages installed in this host'},
+     {'style': 'warning', 'tooltip': 'Number of packages pending an upgrade in this host'},
+     {'style': 'danger', 'tooltip': 'Number of packages pending a security upgrade in this host'}]},
+    {'title': 'OS', 'tooltip': 'Operating System that the host is running'},
+    {'title': 'Last update', 'tooltip': 'Last time the host data was updated'},
+    {'title': '# Packages'},
+    {'title': '# Upgrades'},
+    {'title': '# Security Upgrades'},
+    {'title': 'Last update timestamp'},
+]
+INDEX_COLUMNS = [
+    datatables.Column(lambda host: datatables.render_name_with_badges(
+        host.name, reverse('hosts:detail', args=[host.name]), INDEX_TABLE_HEADERS[0]['badges'],
+        [host.packages_count, host.upgrades_count, host.security_count]), order_by=('name',), search='name'),
+    datatables.Column(lambda host: escape(host.os.name), order_by=('os__name',), search='os__name'),
+    datatables.Column(lambda host: '{since} ago'.format(since=timesince(host.modified)), order_by=('modified',)),
+    datatables.Column(lambda host: host.packages_count, order_by=('packages_count',)),
+    datatables.Column(lambda host: host.upgrades_count, order_by=('upgrades_count',)),
+    datatables.Column(lambda host: host.security_count, order_by=('security_count',)),
+    datatables.Column(lambda host: dateformat.format(host.modified, 'U'), order_by=('modified',)),
+]
 logger = logging.getLogger(__name__)
 
 
+class PreconditionFailed(Exception):
+    """Raised when the If-Match or If-None-Match preconditions of an update are not met."""
+
+
 @require_safe
+@conditional_get(inventory_validators)
 def index(request):
-    """Hosts list page."""
-    hosts = Host.objects.all()
-
-    # Get all the additional annotations separately for query optimization purposes
-    host_annotations = defaultdict(lambda: defaultdict(int))
-    packages_count = Host.objects.select_related(None).values('id').annotate(
-        packages_count=Count('packages', distinct=True))
-    for host in packages_count:
-        host_annotations[host['id']]['packages_count'] = host['packages_count']
-
-    upgrades_count = Host.objects.select_related(None).values('id').annotate(
-        upgrades_count=Count('upgradable_packages', distinct=True))
-    for host in upgrades_count:
-        host_annotations[host['id']]['upgrades_count'] = host['upgrades_count']
-
-    security_count = HostPackage.objects.select_related(None).filter(upgrade_type=SECURITY_UPGRADE).values(
-        'host').annotate(security_count=Count('package', distinct=True)).order_by('host')
-    for host in security_count:
-        host_annotations[host['host']]['security_count'] = host['security_count']
-
-    # Insert all the annotated data back into the package objects for easy access in the templates
-    for host in hosts:
-        for annotation in ('packages_count', 'upgrades_count', 'security_count'):
-            setattr(host, annotation, host_annotations[host.id][annotation])
-
-    table_headers = [
-        {'title': 'Hostname', 'badges': [
-         {'style': 'primary', 'tooltip': 'Number of packages installed in this host'},
-         {'style': 'warning', 'tooltip': 'Number of packages pending an upgrade in this host'},
-         {'style': 'danger', 'tooltip': 'Number of packages pending a security upgrade in this host'}]},
-        {'title': 'OS', 'tooltip': 'Operating System that the host is running'},
-        {'title': 'Last update', 'tooltip': 'Last time the host data was updated'},
-        {'title': '# Packages'},
-        {'title': '# Upgrades'},
-        {'title': '# Security Upgrades'},
-        {'title': 'Last update timestamp'},
-    ]
+    """Hosts list page, with its rows returned to the DataTables server-side processing requests."""
+    if datatables.is_request(request):
+        return datatables.response(request, Host.objects.all(), INDEX_COLUMNS)
 
     args = {
         # The IDs are DataTable column IDs.
@@ -74,13 +79,28 @@ def index(request):
             {'targets': [2, 3, 4, 5, 6], 'searchable': False},
         ]),
         'datatables_page_length': 50,
-        'hosts': hosts,
+        'datatables_server_side': True,
         'section': 'hosts',
         'subtitle': '',
-        'table_headers': table_headers,
+        'table_headers': INDEX_TABLE_HEADERS,
         'title': 'Hosts',
     }
-    return render(request, 'hosts/index.html', args)
+    return render(request, 'base_table.html', args)
+
+
+def _detail_validators(request, name):
+    """Validators for conditional_get() of the host detail page, based on its modification time.
+
+    The JSON representation keeps the ETag of the packages inventory, used by the conditional updates.
+    """
+    if request.META.get('HTTP_ACCEPT', '') == APPLICATION_JSON:
+        return None
+
+    modified = Host.objects.select_related(None).filter(name=name).values_list('modified', flat=True).first()
+    if modified is None:  # Let the view return the 404
+        return None
+
+    return modified, modified
 
 
 class DetailView(View):
@@ -90,9 +110,16 @@ class DetailView(View):
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
+    @method_decorator(conditional_get(_detail_validators))
     def get(self, request, name):
         """Host detail page."""
         host = get_object_or_404(Host, name=name)
+        if request.META.get('HTTP_ACCEPT', '') == APPLICATION_JSON:
+            response = http.JsonResponse(host.to_dict())
+            if host.manifest_digest is not None:
+                response['ETag'] = quote_etag(host.manifest_digest)
+
+            return response
 
         host_packages = HostPackage.objects.filter(host=host).annotate(
             has_upgrade=Case(
@@ -126,7 +153,15 @@ class DetailView(View):
 
     def delete(self, request, name):
         host = get_object_or_404(Host, name=name)
-        host.delete()
+        packages = list(HostPackage.objects.select_related(None).filter(host=host).order_by().values_list(
+            'package', flat=True))
+        deleted, _ = host.delete()
+        DirtyPackage.objects.mark(packages)
+        if not spool.is_enabled():  # Otherwise refreshed by the worker
+            rollups.refresh_on_commit()
+
+        if deleted:  # Not already deleted by a concurrent request
+            generation.bump()
 
         return http.HttpResponse(status=204, content_type=TEXT_PLAIN)
 
@@ -134,21 +169,137 @@ class DetailView(View):
 @verify_clients
 @csrf_exempt
 @require_POST
+@admission_control
 def update(request, name):
     """Update a host and all it's related information from a JSON."""
-    if not request.body:
-        return http.HttpResponseBadRequest("Empty POST, expected JSON string: {req}".format(
-            req=request), content_type=TEXT_PLAIN)
+    timer = metrics.PhaseTimer('hosts')
+    try:
+        payload = parse_update(request)
+    except PayloadError as e:
+        return http.HttpResponse(str(e), status=e.status, content_type=TEXT_PLAIN)
 
     try:
-        payload = json.loads(request.body.decode('utf-8'))
-    except json.JSONDecodeError as e:
-        return http.HttpResponseBadRequest(
-            'Unable to parse JSON string payload: {e}'.format(e=e), content_type=TEXT_PLAIN)
+        os = _validate_payload(name, payload)
+    except ValueError as e:
+        return http.HttpResponseBadRequest(str(e), content_type=TEXT_PLAIN)
+
+    timer.lap('parse')
+
+    _set_request_metadata(request, payload)
+    return idempotency.run(idempotency.get_key(request, 'hosts', name, payload), _update_host, request, name, os,
+                           payload)
+
+
+@verify_clients
+@csrf_exempt
+@require_POST
+@admission_control
+def update_hosts(request):
+    """Update multiple hosts and all their related information from a single JSON, for the proxy hosts."""
+    if settings.DEBMONITOR_VERIFY_CLIENTS and request.user.hostname not in settings.DEBMONITOR_PROXY_HOSTS:
+        return http.HttpResponseForbidden("Unauthorized to modify hosts with certificate '{dn}'".format(
+            dn=request.META.get(SSL_CLIENT_SUBJECT_DN_HEADER, '')), content_type=TEXT_PLAIN)
+
+    timer = metrics.PhaseTimer('hosts')
+    try:
+        payloads = parse_batch_update(request, 'hosts')
+    except PayloadError as e:
+        return http.HttpResponse(str(e), status=e.status, content_type=TEXT_PLAIN)
+
+    timer.lap('parse')
+    return idempotency.run(idempotency.get_key(request, 'hosts', '', payloads), _update_hosts, request, payloads)
+
+
+def apply_update(name, payload):
+    """Validate and apply an already parsed update payload outside of a request, like the spooled ones."""
+    compact_payload(payload)
+    _update_v1(None, name, _validate_payload(name, payload), payload)
+
+
+def _update_host(request, name, os, payload):
+    """Spool or apply a validated host update submission and return the response."""
+    message = "Unable to update host '{host}'".format(host=name)
+    if spool.is_enabled():
+        try:  # Verify the preconditions also before spooling, they are verified again when applied
+            _check_preconditions(Host.objects.select_related(None).filter(name=name).first(), os, payload)
+        except PreconditionFailed as e:
+            return http.HttpResponse(str(e), status=412, content_type=TEXT_PLAIN)
+
+        spool.Spool().push('hosts', name, payload)
+        return http.HttpResponse(status=202, content_type=TEXT_PLAIN)
+
+    try:
+        etag = _update_v1(request, name, os, payload)
+    except PreconditionFailed as e:
+        return http.HttpResponse(str(e), status=412, content_type=TEXT_PLAIN)
+    except (KeyError, TypeError, ValidationError) as e:
+        logger.exception(message)
+        return http.HttpResponseBadRequest('{message}: {e}'.format(message=message, e=e), content_type=TEXT_PLAIN)
+    except Exception as e:  # Force a response to avoid using the HTML template for all other 500s
+        logger.error(message, exc_info=True)
+        return http.HttpResponseServerError('{message}: {e}'.format(message=message, e=e), content_type=TEXT_PLAIN)
+
+    rollups.refresh_on_commit()
+    response = http.HttpResponse(status=201, content_type=TEXT_PLAIN)
+    if etag is not None:
+        response['ETag'] = quote_etag(etag)
 
+    return response
+
+
+def _update_hosts(request, payloads):
+    """Spool or apply the host update submissions of a batch and return the response."""
+    response = {'hosts': {}, 'errors': 0}
+    valid = []
+    for payload in payloads:
+        name = payload.get('hostname', '')
+        try:
+            if not name or not isinstance(name, str):
+                raise ValueError('Hostname not specified in POST payload')
+
+            os = _validate_payload(name, payload)
+        except ValueError as e:
+            response['hosts'][str(name)] = {'success': False, 'error': str(e)}
+            response['errors'] += 1
+            continue
+
+        _set_request_metadata(request, payload, batch=True)
+        valid.append((name, os, payload))
+
+    if spool.is_enabled():
+        for name, _, payload in valid:
+            spool.Spool().push('hosts', name, payload)
+            response['hosts'][name] = {'success': True}
+    else:
+        results = _update_batch_v1(request, valid)
+        rollups.refresh_on_commit()
+        response['hosts'].update(results)
+        response['errors'] += sum(1 for result in results.values() if not result['success'])
+
+    logger.info("Updated %d hosts in batch, %d failed", len(payloads) - response['errors'], response['errors'])
+    response['success'] = response['errors'] == 0
+    return http.JsonResponse(response, status=201 if response['success'] and not spool.is_enabled() else 202)
+
+
+def _validate_payload(name, payload):
+    """Validate an update payload and return the related OS, creating it if needed. Raise ValueError if invalid."""
     if name != payload.get('hostname', ''):
-        return http.HttpResponseBadRequest("URL host '{name}' and POST payload hostname '{host}' do not match".format(
-            name=name, host=payload.get('hostname', '')), content_type=TEXT_PLAIN)
+        raise ValueError("URL host '{name}' and POST payload hostname '{host}' do not match".format(
+            name=name, host=payload.get('hostname', '')))
+
+    if not payload.get('update_type', ''):
+        raise ValueError('Update type not specified in POST payload')
+
+    if not isinstance(payload.get('running_kernel', None), dict) or not payload['running_kernel'].get('version', ''):
+        raise ValueError('Running kernel version not specified in POST payload')
+
+    if not isinstance(payload.get('os', None), str) or not payload['os']:
+        raise ValueError('OS not specified in POST payload')
+
+    cache = resolution.get_cache('os')
+    os = cache.get(payload['os'])
+    if os is not None:
+        return os
 
     try:
         os = OS.objects.get(name=payload['os'])
@@ -160,152 +311,494 @@ def update(request, name):
             os.clean_fields()
             os.save()
         except ValidationError as e:
-            return http.HttpResponseBadRequest(
-                "OS name '{os}' is not valid: {e}".format(os=payload['os'], e=e), content_type=TEXT_PLAIN)
+            raise ValueError("OS name '{os}' is not valid: {e}".format(os=payload['os'], e=e))
 
-    message = "Unable to update host '{host}'".format(host=name)
-    try:
-        _update_v1(request, name, os, payload)
-    except (KeyError, TypeError) as e:
-        logger.exception(message)
-        return http.HttpResponseBadRequest('{message}: {e}'.format(message=message, e=e), content_type=TEXT_PLAIN)
-    except Exception as e:  # Force a response to avoid using the HTML template for all other 500s
-        logger.error(message, exc_info=True)
-        return http.HttpResponseServerError('{message}: {e}'.format(message=message, e=e), content_type=TEXT_PLAIN)
-    else:
-        return http.HttpResponse(status=201, content_type=TEXT_PLAIN)
+    cache.set(payload['os'], os)
+    return os
+
+
+def _set_request_metadata(request, payload, batch=False):
+    """Set into the payload the client version and the preconditions sent in the request headers.
+
+    The headers of a batch update are the ones of the proxy host that sent it, hence they are not set into the payloads
+    and the client version of the hosts of the batch is left unchanged.
+    """
+    for key in ('client_version', 'if_match', 'if_none_match'):
+        payload.pop(key, None)  # Not allowed in the payload itself
+
+    if batch:
+        return
+
+    payload['client_version'] = request.headers.get(CLIENT_VERSION_HEADER, None)  # Old clients don't send it
+    for header, key in (('If-Match', 'if_match'), ('If-None-Match', 'if_none_match')):
+        if header in request.headers:
+            payload[key] = parse_etags(request.headers[header])
+
+
+def _check_preconditions(host, os, payload):
+    """Verify the If-Match and If-None-Match preconditions of the payload against the host inventory ETag.
+
+    Arguments:
+        host (hosts.models.Host, None): the existing host or None if the host doesn't exist yet.
+        os (src_packages.models.OS): the OS of the payload, the inventory is considered changed if different.
+        payload (dict): the update payload.
+
+    Raises:
+        hosts.views.PreconditionFailed: if any precondition is not met.
+    """
+    etag = None
+    if host is not None and host.manifest_digest is not None and host.os_id == os.id:
+        etag = quote_etag(host.manifest_digest)
+
+    if_match = payload.get('if_match', None)
+    if if_match is not None and not (host is not None and '*' in if_match or etag is not None and etag in if_match):
+        raise PreconditionFailed("The inventory of host '{name}' doesn't match the If-Match ETags".format(
+            name=payload['hostname']))
+
+    if_none_match = payload.get('if_none_match', None)
+    if if_none_match is not None and (host is not None and '*' in if_none_match or etag in if_none_match):
+        raise PreconditionFailed("The inventory of host '{name}' matches the If-None-Match ETags".format(
+            name=payload['hostname']))
+
+
+@atomic_retry
+def _update_batch_v1(request, valid):
+    """Apply the validated host updates of a batch in a single transaction, each one within its own savepoint.
+
+    The package versions shared by the hosts of the same OS are resolved once within the same transaction, hence they
+    are resolved again if the whole batch is retried.
 
+    Arguments:
+        request (django.http.HttpRequest): the request.
+        valid (list): the (name, os, payload) tuples of the validated host updates.
 
-def _update_v1(request, name, os, payload):
-    """Update API v1."""
-    start_time = timezone.now()
-    kernel, _ = KernelVersion.objects.get_or_create(name=payload['running_kernel']['version'], os=os)
+    Returns:
+        dict: the result of the update of each host, indexed by hostname.
+    """
+    resolved = {}
+    for os, items in _batch_to_resolve(valid).items():
+        try:
+            with transaction.atomic():
+                resolved[os.id] = PackageVersion.objects.get_or_create_many(os, items)
+        except ValidationError:  # Let each host resolve its own items, failing only the hosts with invalid ones
+            resolved[os.id] = None
+
+    results = {}
+    for name, os, payload in valid:
+        message = "Unable to update host '{host}'".format(host=name)
+        try:
+            etag = _update_batch_host(request, name, os, payload, resolved[os.id])
+        except OperationalError as e:
+            if is_retryable_error(e):  # Deadlock or lock wait, the whole transaction must be retried
+                raise
+
+            logger.exception(message)
+            results[name] = {'success': False, 'error': '{message}: {e}'.format(message=message, e=e)}
+        except Exception as e:  # Only the savepoint of this host has been rolled back
+            logger.exception(message)
+            results[name] = {'success': False, 'error': '{message}: {e}'.format(message=message, e=e)}
+        else:
+            results[name] = {'success': True, 'etag': etag}
+
+    return results
+
+
+def _update_batch_host(request, name, os, payload, resolved):
+    """Apply a host update of a batch within its own savepoint, once more if the host was created concurrently."""
+    try:
+        return _update_v1(request, name, os, payload, resolved=resolved)
+    except IntegrityError as e:
+        if not is_retryable_error(e):
+            raise
+
+        logger.warning("Updating again host '%s' after a concurrent change: %s", name, e)
+        return _update_v1(request, name, os, payload, resolved=resolved)
+
+
+@atomic_retry
+def _update_v1(request, name, os, payload, resolved=None):
+    """Update API v1, atomically applied while holding a lock on the host. Return the new inventory ETag, if any.
+
+    Arguments:
+        request (django.http.HttpRequest, None): the request, if any.
+        name (str): the hostname.
+        os (src_packages.models.OS): the OS of the host.
+        payload (dict): the validated update payload.
+        resolved (dict, optional): the already resolved PackageVersion objects of the OS, indexed by (name, version)
+            tuples, to reuse across the hosts of a batch update.
+
+    Returns:
+        str: the inventory ETag, or None if not known.
+    """
+    metrics.count_items('hosts', payload)
+    timer = metrics.PhaseTimer('hosts')
+    kernels_cache = resolution.get_cache('kernels')
+    kernel = kernels_cache.get((os.id, payload['running_kernel']['version']))
+    if kernel is None:
+        kernel, created = KernelVersion.objects.get_or_create(name=payload['running_kernel']['version'], os=os)
+        if created:
+            search.add([kernel])
+
+        kernels_cache.set((os.id, kernel.name), kernel)
+
+    timer.lap('resolution')
+    digest = None
+    if payload['update_type'] == 'full':
+        digest = manifest_digest(os.name, payload)
+
+    # A matching If-Match without any packages list confirms that the inventory is unchanged
+    unchanged = payload.get('if_match', None) is not None and not any(key in payload for key in MANIFEST_KEYS)
 
     os_changed = False
     try:
-        host = Host.objects.get(name=name)
-        if host.os != os:
+        host = Host.objects.select_related(None).select_for_update().get(name=name)  # Serialize the host updates
+        _check_preconditions(host, os, payload)
+        if 'client_version' in payload:  # Not set by the batch updates
+            host.client_version = payload['client_version']
+
+        if unchanged or (digest is not None and host.manifest_digest == digest):
+            if host.kernel_id != kernel.id:
+                generation.bump()
+
+            host.kernel = kernel
+            host.save()  # Update only the running kernel and the modification time
+            logger.info("Skipped unchanged packages manifest for host '%s'", name)
+            return host.manifest_digest
+
+        generation.bump()
+        if host.os_id != os.id:
             os_changed = True
         host.os = os
         host.kernel = kernel
+        host.manifest_digest = None  # Reset it until the update is completed
         host.save()  # Always update at least the modification time
-        host_packages = {host_pkg.package.name: host_pkg for host_pkg in HostPackage.objects.filter(host=host)}
+        if not os_changed and _is_upgradable_only(payload):
+            _update_upgradable(host, os, payload.get('upgradable', []), resolved)
+            Host.refresh_counts([host])
+            timer.lap('upgradable')
+            return None
+
+        # The OS migration needs all the packages, the partial updates only the ones they modify
+        host_packages = _load_host_packages(host, payload, full=payload['update_type'] == 'full' or os_changed)
 
     except Host.DoesNotExist:
-        host = Host(name=name, os=os, kernel=kernel)
+        _check_preconditions(None, os, payload)
+        host = Host(name=name, os=os, kernel=kernel, client_version=payload.get('client_version', None))
         host.save()
+        search.add([host])
+        generation.bump()
         host_packages = {}
         logger.info("Created Host '%s'", name)
 
+    timer.lap('load')
     # Transition all existing packages with the new OS name to prevent OS mismatching
     if os_changed:
-        for host_package in host_packages.values():
-            _host_package_migrate_os(os, host_package)
-
-        # Refresh the cached image packages to ensure we get the data from the database
-        host_packages = {host_pkg.package.name: host_pkg for host_pkg in HostPackage.objects.filter(host=host)}
+        _host_packages_migrate_os(os, host, host_packages)
+        timer.lap('migrate_os')
 
-    existing_not_updated = []
     existing_upgradable_not_updated = []
+    updated = {}  # Already existing HostPackage objects that were modified, indexed by primary key
+    deleted = []  # Primary keys of the HostPackage objects to delete
 
     installed = payload.get('installed', [])
+    package_versions = _resolve_package_versions(os, _installed_to_resolve(host_packages, installed), resolved)
     for item in installed:
-        _process_installed(host, os, host_packages, existing_not_updated, item)
+        _process_installed(host, host_packages, package_versions, updated, item)
 
     logger.info("Tracked %d installed packages for host '%s'", len(installed), name)
+    timer.lap('installed')
 
     uninstalled = payload.get('uninstalled', [])
     for item in uninstalled:
-        existing = host_packages.get(item['name'], None)
-        if existing is not None:
-            existing.delete()
+        existing = host_packages.pop(item.name, None)
+        if existing is not None and existing.pk is not None:
+            updated.pop(existing.pk, None)
+            deleted.append(existing.pk)
 
     logger.info("Untracked %d uninstalled packages for host '%s'", len(uninstalled), name)
+    timer.lap('uninstalled')
 
     upgradable = payload.get('upgradable', [])
+    package_versions = _resolve_package_versions(os, _upgradable_to_resolve(host_packages, upgradable), resolved)
     for item in upgradable:
-        _process_upgradable(host, os, host_packages, existing_upgradable_not_updated, item)
+        _process_upgradable(host, host_packages, package_versions, existing_upgradable_not_updated, updated, item)
 
     logger.info("Tracked %d upgradable packages for host '%s'", len(upgradable), name)
+    timer.lap('upgradable')
 
     if payload['update_type'] == 'full':
-        _garbage_collection(host, name, start_time, existing_not_updated, existing_upgradable_not_updated)
+        _garbage_collection(name, host_packages, installed, existing_upgradable_not_updated, updated, deleted)
+        timer.lap('garbage_collection')
 
+    _save_host_packages(host_packages, updated, deleted)
+    Host.refresh_counts([host])
 
-def _host_package_migrate_os(os, host_package):
-    """Migrate to the new OS an HostPackage object with the related package and upgradable package."""
-    package_args = {
-        "os": os,
-        "name": host_package.package.name,
-        "source": host_package.package_version.src_package_version.src_package.name,
-    }
-    package_version, _ = PackageVersion.objects.get_or_create(
-        version=host_package.package_version.version, **package_args)
-    host_package.package_version = package_version
-    host_package.package = package_version.package
+    if payload['update_type'] == 'full':
+        Host.objects.select_related(None).filter(pk=host.pk).update(manifest_digest=digest)
+
+    timer.lap('save')
+
+    return digest
+
+
+def _is_upgradable_only(payload):
+    """Return True if the payload is an upgradable-only update, with the complete list of upgradable packages."""
+    return (payload['update_type'] == UPGRADABLE_UPDATE and not payload.get('installed', [])
+            and not payload.get('uninstalled', []))
+
+
+def _update_upgradable(host, os, upgradable, resolved=None):
+    """Apply an upgradable-only update with bulk queries, without loading the installed versions details.
+
+    As the list of upgradable packages is complete, the upgradable info of all the other packages is cleared.
+
+    Arguments:
+        host (hosts.models.Host): the host.
+        os (src_packages.models.OS): the OS of the host.
+        upgradable (list): the upgradable items.
+        resolved (dict, optional): the already resolved PackageVersion objects, see _update_v1().
+    """
+    items = {item.name: item for item in upgradable}
+    host_packages = {host_pkg.package.name: host_pkg for host_pkg in HostPackage.objects.select_related(
+        None).select_related('package').filter(host=host, package__name__in=items.keys()).order_by()}
+
+    to_resolve = set()
+    for item in items.values():
+        to_resolve.add((item.name, item.source, item.version_to))
+        if item.name not in host_packages:
+            to_resolve.add((item.name, item.source, item.version_from))
+
+    package_versions = _resolve_package_versions(os, to_resolve, resolved)
+
+    now = timezone.now()
+    created = []
+    updated = []
+    for item in items.values():
+        upgradable_version = package_versions[(item.name, item.version_to)]
+        existing = host_packages.get(item.name, None)
+        if existing is None:
+            installed_version = package_versions[(item.name, item.version_from)]
+            created.append(HostPackage(
+                host=host, package=installed_version.package, package_version=installed_version,
+                upgradable_package=upgradable_version.package, upgradable_version=upgradable_version))
+            continue
+
+        if existing.package_version_id == upgradable_version.id:  # The package has been already upgraded
+            target = (None, None)
+        else:
+            target = (upgradable_version.package_id, upgradable_version.id)
+
+        if (existing.upgradable_package_id, existing.upgradable_version_id) == target:
+            continue  # Already up-to-date
+
+        existing.upgradable_package_id, existing.upgradable_version_id = target
+        if target[1] is None:
+            existing.upgrade_type = None
+
+        existing.modified = now  # bulk_update() doesn't update the auto_now fields
+        updated.append(existing)
+
+    to_clean = HostPackage.objects.select_related(None).filter(host=host, upgradable_package__isnull=False).exclude(
+        pk__in=[host_package.pk for host_package in host_packages.values()])
+    dirty = set(to_clean.order_by().values_list('package', flat=True))
+    cleaned = to_clean.update(upgradable_package=None, upgradable_version=None, upgrade_type=None, modified=now)
+
+    if updated:
+        HostPackage.objects.bulk_update(
+            updated, ['upgradable_package', 'upgradable_version', 'upgrade_type', 'modified'])
+
+    if created:
+        HostPackage.objects.bulk_create(created)
 
-    if host_package.upgradable_version is not None:
-        package_args["name"] = host_package.upgradable_package.name
-        package_args["source"] = host_package.upgradable_version.src_package_version.src_package.name
+    dirty.update(host_package.package_id for host_package in updated + created)
+    DirtyPackage.objects.mark(dirty)
 
-        upgradable_version, _ = PackageVersion.objects.get_or_create(
-            version=host_package.upgradable_version.version, **package_args)
-        host_package.upgradable_version = upgradable_version
-        host_package.upgradable_package = upgradable_version.package
+    logger.info("Tracked %d upgradable packages (%d new, %d updated) and cleaned %d for host '%s'",
+                len(items), len(created), len(updated), cleaned, host.name)
 
-    host_package.save()
 
+def _load_host_packages(host, payload, full=True):
+    """Return the HostPackage objects of the host indexed by package name, selecting only the needed related objects.
 
-def _garbage_collection(host, name, start_time, existing_not_updated, existing_upgradable_not_updated):
-    # Delete orphaned entries based on the modification datetime and the list of already up-to-date IDs
-    res = HostPackage.objects.filter(host=host, modified__lt=start_time).exclude(pk__in=existing_not_updated).delete()
-    logger.info("Deleted %d HostPackage orphaned entries for host '%s'", res[0], name)
+    Arguments:
+        host (hosts.models.Host): the host.
+        payload (dict): the update payload.
+        full (bool, optional): whether to load all the HostPackage objects or only the ones named in the payload.
 
-    # Cleanup orphaned upgrades based on the modification datetime and the list of already up-to-date IDs
-    host_packages = HostPackage.objects.filter(
-        host=host, modified__lt=start_time, upgradable_package__isnull=False).exclude(
-        pk__in=existing_upgradable_not_updated)
+    Returns:
+        dict: the HostPackage objects indexed by package name.
+    """
+    host_packages = HostPackage.objects.select_related(None).select_related(
+        'package', 'package_version', 'upgradable_version').filter(host=host).order_by()
+    if not full:
+        host_packages = host_packages.filter(
+            package__name__in={item.name for key in MANIFEST_KEYS for item in payload.get(key, [])})
+
+    return {host_pkg.package.name: host_pkg for host_pkg in host_packages}
+
+
+def _host_packages_migrate_os(os, host, host_packages):
+    """Migrate to the new OS all the HostPackage objects of a host with the related package and upgradable package.
+
+    All the PackageVersion objects of the new OS are resolved in bulk and the HostPackage objects are repointed to them
+    with a single bulk update, keeping the already loaded objects up-to-date.
+    """
+    versions = {}  # HostPackage primary key: ((name, source, version), (name, source, version) or None)
+    rows = HostPackage.objects.select_related(None).filter(host=host).values_list(
+        'pk', 'package__name', 'package_version__src_package_version__src_package__name', 'package_version__version',
+        'upgradable_package__name', 'upgradable_version__src_package_version__src_package__name',
+        'upgradable_version__version')
+    for pk, *fields in rows:
+        versions[pk] = (tuple(fields[:3]), tuple(fields[3:]) if fields[3] is not None else None)
+
+    package_versions = PackageVersion.objects.get_or_create_many(
+        os, {item for pair in versions.values() for item in pair if item is not None})
+
+    now = timezone.now()
+    migrated = []
+    for host_package in host_packages.values():
+        installed, upgradable = versions[host_package.pk]
+        host_package.package_version = package_versions[(installed[0], installed[2])]
+        if upgradable is not None:
+            host_package.upgradable_version = package_versions[(upgradable[0], upgradable[2])]
+
+        host_package.modified = now  # bulk_update() doesn't update the auto_now fields
+        migrated.append(host_package)
+
+    if migrated:
+        HostPackage.objects.bulk_update(migrated, ['package_version', 'upgradable_version', 'modified'])
+
+    logger.info("Migrated %d HostPackage entries to OS '%s' for host '%s'", len(migrated), os.name, host.name)
+
+
+def _garbage_collection(name, host_packages, installed, existing_upgradable_not_updated, updated, deleted):
+    """Mark the orphaned entries of a full update for deletion and clean their orphaned upgradable info.
+
+    As all the HostPackage objects of the host are already loaded, the orphaned entries are detected in memory and
+    then deleted or updated with the other changes, without relying on the modification datetime.
+    """
+    installed_names = {item.name for item in installed}
+    orphaned = [package for package, host_package in host_packages.items() if host_package.pk is not None and
+                host_package.pk not in updated and package not in installed_names]
+    for package in orphaned:
+        deleted.append(host_packages.pop(package).pk)
+
+    logger.info("Deleted %d HostPackage orphaned entries for host '%s'", len(orphaned), name)
+
+    upgradable_not_updated = set(existing_upgradable_not_updated)
+    cleaned = 0
+    for host_package in host_packages.values():
+        if (host_package.pk is None or host_package.pk in updated or
+                host_package.pk in upgradable_not_updated or host_package.upgradable_package_id is None):
+            continue
 
-    for host_package in host_packages:
         host_package.upgradable_package = None
         host_package.upgradable_version = None
         host_package.upgrade_type = None
-        host_package.save()
+        updated[host_package.pk] = host_package
+        cleaned += 1
+
+    logger.info("Cleaned %d HostPackage upgradable info for host '%s'", cleaned, name)
+
+
+def _batch_to_resolve(valid):
+    """Return the union of the (name, source, version) tuples of all the validated payloads of a batch, by OS."""
+    items = {}
+    for _, os, payload in valid:
+        os_items = items.setdefault(os, set())
+        os_items.update(_installed_to_resolve({}, payload.get('installed', [])))
+        os_items.update(_upgradable_to_resolve({}, payload.get('upgradable', [])))
+
+    return items
+
+
+def _installed_to_resolve(host_packages, installed):
+    """Generate the (name, source, version) tuples of the installed items that are not already up-to-date."""
+    for item in installed:
+        existing = host_packages.get(item.name, None)
+        if existing is None or existing.package_version.version != item.version:
+            yield item.name, item.source, item.version
+
+
+def _upgradable_to_resolve(host_packages, upgradable):
+    """Generate the (name, source, version) tuples of the upgradable items that are not already up-to-date."""
+    for item in upgradable:
+        existing = host_packages.get(item.name, None)
+        if existing is None:
+            yield item.name, item.source, item.version_from
+            yield item.name, item.source, item.version_to
+        elif existing.upgradable_package_id is None or existing.upgradable_version.version != item.version_to:
+            yield item.name, item.source, item.version_to
+
+
+def _resolve_package_versions(os, items, resolved=None):
+    """Get or create the PackageVersion objects of the (name, source, version) tuples, reusing the resolved ones.
+
+    The already resolved objects are not modified, as the ones created here might be rolled back with the update.
+    """
+    if resolved is None:
+        return PackageVersion.objects.get_or_create_many(os, items)
+
+    missing = [item for item in items if (item[0], item[2]) not in resolved]
+    return ChainMap(PackageVersion.objects.get_or_create_many(os, missing), resolved)
+
+
+def _save_host_packages(host_packages, updated, deleted):
+    """Persist all the HostPackage changes with bulk queries and mark their packages as dirty."""
+    dirty = {host_package.package_id for host_package in updated.values()}
+    if deleted:
+        dirty.update(HostPackage.objects.select_related(None).filter(pk__in=deleted).order_by().values_list(
+            'package', flat=True))
+        HostPackage.objects.filter(pk__in=deleted).delete()
+
+    if updated:
+        now = timezone.now()
+        for host_package in updated.values():  # bulk_update() doesn't update the auto_now fields
+            host_package.modified = now
+
+        HostPackage.objects.bulk_update(
+            updated.values(),
+            ['package_version', 'upgradable_package', 'upgradable_version', 'upgrade_type', 'modified'])
+
+    created = [host_package for host_package in host_packages.values() if host_package.pk is None]
+    if created:
+        HostPackage.objects.bulk_create(created)
 
-    logger.info("Cleaned %d HostPackage upgradable info for host '%s'", len(host_packages), name)
+    dirty.update(host_package.package_id for host_package in created)
+    DirtyPackage.objects.mark(dirty)
 
 
-def _process_installed(host, os, host_packages, existing_not_updated, item):
-    """Process an installed package item, return True if it was created or updated."""
-    existing = host_packages.get(item['name'], None)
+def _process_installed(host, host_packages, package_versions, updated, item):
+    """Process an installed package item."""
+    existing = host_packages.get(item.name, None)
 
-    if existing is not None and existing.package_version.version == item['version']:
-        existing_not_updated.append(existing.pk)
+    if existing is not None and existing.package_version.version == item.version:
         return  # Already up-to-date
 
-    package_version, _ = PackageVersion.objects.get_or_create(os=os, entity_package=existing, **item)
+    package_version = package_versions[(item.name, item.version)]
     if existing is not None:
         existing.package_version = package_version
         existing.upgradable_package = None
         existing.upgradable_version = None
         existing.upgrade_type = None
-        existing.save()
+        if existing.pk is not None:
+            updated[existing.pk] = existing
     else:
-        host_packages[package_version.package.name], _ = HostPackage.objects.get_or_create(
+        host_packages[item.name] = HostPackage(
             host=host, package=package_version.package, package_version=package_version)
 
 
-def _process_upgradable(host, os, host_packages, existing_upgradable_not_updated, item):
+def _process_upgradable(host, host_packages, package_versions, existing_upgradable_not_updated, updated, item):
     """Process an upgradable package item."""
-    existing = host_packages.get(item['name'], None)
+    existing = host_packages.get(item.name, None)
 
     if existing is not None:
-        if existing.upgradable_package is not None and existing.upgradable_version.version == item['version_to']:
-            existing_upgradable_not_updated.append(existing.pk)
+        if existing.upgradable_package_id is not None and existing.upgradable_version.version == item.version_to:
+            if existing.pk is not None:
+                existing_upgradable_not_updated.append(existing.pk)
             return  # Already up-to-date
 
-        upgradable_version, _ = PackageVersion.objects.get_or_create(
-            os=os, version=item['version_to'], entity_package=existing, **item)
+        upgradable_version = package_versions[(item.name, item.version_to)]
 
         if existing.package_version == upgradable_version:  # The package has been already upgraded
             existing.upgradable_package = None
@@ -315,10 +808,11 @@ def _process_upgradable(host, os, host_packages, existing_upgradable_not_updated
             existing.upgradable_package = upgradable_version.package
             existing.upgradable_version = upgradable_version
 
-        existing.save()
+        if existing.pk is not None:
+            updated[existing.pk] = existing
     else:
-        installed_version, _ = PackageVersion.objects.get_or_create(os=os, version=item['version_from'], **item)
-        upgradable_version, _ = PackageVersion.objects.get_or_create(os=os, version=item['version_to'], **item)
-        HostPackage.objects.create(
+        installed_version = package_versions[(item.name, item.version_from)]
+        upgradable_version = package_versions[(item.name, item.version_to)]
+        host_packages[item.name] = HostPackage(
             host=host, package=installed_version.package, package_version=installed_version,
             upgradable_package=upgradable_version.package, upgradable_version=upgradable_version)
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.25 on 2026-10-17 01:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0002_auto_20200114_1132'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='manifest_digest',
+            field=models.CharField(
+                blank=True, db_index=True, max_length=64, null=True,
+                help_text='Digest of the packages manifest of the last full update, if not modified afterwards.'),
+        ),
+    ]
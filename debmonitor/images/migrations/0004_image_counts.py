@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:14
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def forwards_func(apps, schema_editor):
+    """Populate the packages counters of all the container images from their ImagePackage objects."""
+    Image = apps.get_model('images', 'Image')
+    ImagePackage = apps.get_model('images', 'ImagePackage')
+
+    def count(**filters):
+        counts = ImagePackage.objects.filter(image=OuterRef('pk'), **filters).order_by().values('image').annotate(
+            count=Count('*')).values('count')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+    Image.objects.update(
+        packages_count=count(), upgrades_count=count(upgradable_imagepackage__isnull=False),
+        security_count=count(upgrade_type='security'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0003_image_manifest_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='packages_count',
+            field=models.PositiveIntegerField(
+                default=0, help_text='Number of binary packages installed on this container image.'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='security_count',
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text='Number of binary packages installed on this container image pending a security upgrade.'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='upgrades_count',
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text='Number of binary packages installed on this container image that could be upgraded.'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['packages_count'], name='images_imag_package_139311_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['upgrades_count'], name='images_imag_upgrade_bbcbd5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['security_count'], name='images_imag_securit_14b1fb_idx'),
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
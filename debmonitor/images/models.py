@@ -1,8 +1,9 @@
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Count, Q
 
 from bin_packages.models import Package, PackageVersion
-from debmonitor import SelectManager
+from debmonitor import refresh_counts, SelectManager
 from src_packages.models import OS
 
 
@@ -31,6 +32,16 @@ class Image(models.Model):
         PackageVersion, related_name='+', through='ImagePackage', through_fields=('image', 'upgradable_imageversion'),
         db_index=True, blank=True, verbose_name='upgradable binary package versions',
         help_text='Binary package versions installed on this image that could be upgraded.')
+    manifest_digest = models.CharField(
+        max_length=64, blank=True, null=True, db_index=True,
+        help_text='Digest of the packages manifest of the last full update, if not modified afterwards.')
+
+    packages_count = models.PositiveIntegerField(
+        default=0, help_text='Number of binary packages installed on this container image.')
+    upgrades_count = models.PositiveIntegerField(
+        default=0, help_text='Number of binary packages installed on this container image that could be upgraded.')
+    security_count = models.PositiveIntegerField(
+        default=0, help_text='Number of binary packages installed on this container image pending a security upgrade.')
 
     created = models.DateTimeField(auto_now_add=True, help_text='Datetime of the creation of this object.')
     modified = models.DateTimeField(auto_now=True, help_text='Datetime of the last modification of this object.')
@@ -40,6 +51,9 @@ class Image(models.Model):
     class Meta:
         """Additional metadata."""
 
+        # One index for each counter, as each one is sorted and filtered on its own
+        indexes = [models.Index(fields=['packages_count']), models.Index(fields=['upgrades_count']),
+                   models.Index(fields=['security_count'])]
         ordering = ['name']
         verbose_name = 'image'
         verbose_name_plural = 'images'
@@ -52,6 +66,23 @@ class Image(models.Model):
         """Simple dict representation of the Image."""
         return {'name': self.name, 'os': self.os.name, 'created': self.created, 'modified': self.modified}
 
+    @classmethod
+    def refresh_counts(cls, images):
+        """Recompute the stored packages counters of the given container images from their ImagePackage objects.
+
+        Arguments:
+            images (list): the Image objects to refresh, with the counters fields loaded.
+
+        Returns:
+            int: the number of container images whose counters were changed.
+        """
+        images = list(images)
+        rows = ImagePackage.objects.select_related(None).filter(image__in=images).order_by().values('image').annotate(
+            packages=Count('pk'), upgrades=Count('upgradable_imagepackage'),
+            security=Count('pk', filter=Q(upgrade_type=SECURITY_UPGRADE))).values_list(
+            'image', 'packages', 'upgrades', 'security')
+        return refresh_counts(images, {row[0]: row[1:] for row in rows})
+
     @classmethod
     def _check_m2m_through_same_relationship(cls):
         return []  # Disable models.E003 check for this model
@@ -6,6 +6,7 @@ from images import views
 app_name = 'images'
 urlpatterns = [
     path('', views.index, name='index'),
+    path('update', views.update_images, name='update_batch'),
     path('<path:name>/update', views.update_image, name='update'),
     path('<path:name>', views.DetailView.as_view(), name='detail'),
 ]
@@ -1,68 +1,64 @@
 import json
 import logging
 
-from collections import defaultdict
-
 from django import http
 from django.core.exceptions import ValidationError
 from django.conf import settings
-from django.db.models import Count, BooleanField, Case, When
+from django.db.models import BooleanField, Case, Count, Max, When
 from django.shortcuts import get_object_or_404, render
-from django.utils import timezone
+from django.urls import reverse
+from django.utils import dateformat, timezone
 from django.utils.decorators import method_decorator
+from django.utils.html import escape
+from django.utils.timesince import timesince
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_safe, require_POST
 
-from bin_packages.models import PackageVersion
-from debmonitor.decorators import verify_clients
-from images.models import Image, ImagePackage, SECURITY_UPGRADE
+from bin_packages.models import DirtyPackage, PackageVersion
+from debmonitor import (COUNTS_FIELDS, datatables, generation, idempotency, manifest_digest, metrics, resolution,
+                        rollups, search, spool)
+from debmonitor.decorators import (admission_control, atomic_retry, conditional_get, inventory_validators,
+                                   verify_clients)
+from debmonitor.payload import PayloadError, read_body
+from images.models import Image, ImagePackage
 from src_packages.models import OS
-from debmonitor.middleware import APPLICATION_JSON, TEXT_PLAIN
-
-
+from debmonitor.middleware import (APPLICATION_JSON, SSL_CLIENT_SUBJECT_DN_HEADER, TEXT_PLAIN,
+                                   is_valid_image_proxy)
+
+
+INDEX_TABLE_HEADERS = [
+    {'title': 'Image name', 'badges': [
+     {'style': 'primary', 'tooltip': 'Number of packages installed in this image'},
+     {'style': 'warning', 'tooltip': 'Number of packages pending an upgrade in this image'},
+     {'style': 'danger', 'tooltip': 'Number of packages pending a security upgrade in this image'}]},
+    {'title': 'OS', 'tooltip': 'Operating System that the image is running'},
+    {'title': 'Last update', 'tooltip': 'Last time the image data was updated'},
+    {'title': '# Packages', 'tooltip': 'Number of package which the image has installed'},
+    {'title': '# Upgrades'},
+    {'title': '# Security Upgrades'},
+    {'title': 'Last update timestamp'},
+]
+INDEX_COLUMNS = [
+    datatables.Column(lambda image: datatables.render_name_with_badges(
+        image.name, reverse('images:detail', args=[image.name]), INDEX_TABLE_HEADERS[0]['badges'],
+        [image.packages_count, image.upgrades_count, image.security_count]), order_by=('name',), search='name'),
+    datatables.Column(lambda image: escape(image.os.name), order_by=('os__name',), search='os__name'),
+    datatables.Column(lambda image: '{since} ago'.format(since=timesince(image.modified)), order_by=('modified',)),
+    datatables.Column(lambda image: image.packages_count, order_by=('packages_count',)),
+    datatables.Column(lambda image: image.upgrades_count, order_by=('upgrades_count',)),
+    datatables.Column(lambda image: image.security_count, order_by=('security_count',)),
+    datatables.Column(lambda image: dateformat.format(image.modified, 'U'), order_by=('modified',)),
+]
 logger = logging.getLogger(__name__)
 
 
 @require_safe
+@conditional_get(inventory_validators)
 def index(request):
-    """Container image list page."""
-    images = Image.objects.all()
-
-    # Get all the additional annotations separately for query optimization purposes
-    image_annotations = defaultdict(lambda: defaultdict(int))
-    packages_count = Image.objects.select_related(None).values('id').annotate(
-        packages_count=Count('packages', distinct=True))
-    for image in packages_count:
-        image_annotations[image['id']]['packages_count'] = image['packages_count']
-
-    upgrades_count = Image.objects.select_related(None).values('id').annotate(
-        upgrades_count=Count('upgradable_imagepackages', distinct=True))
-    for image in upgrades_count:
-        image_annotations[image['id']]['upgrades_count'] = image['upgrades_count']
-
-    security_count = ImagePackage.objects.select_related(None).filter(upgrade_type=SECURITY_UPGRADE).values(
-        'image').annotate(security_count=Count('package', distinct=True)).order_by('image')
-    for image in security_count:
-        image_annotations[image['image']]['security_count'] = image['security_count']
-
-    # Insert all the annotated data back into the package objects for easy access in the templates
-    for image in images:
-        for annotation in ('packages_count', 'upgrades_count', 'security_count'):
-            setattr(image, annotation, image_annotations[image.id][annotation])
-
-    table_headers = [
-        {'title': 'Image name', 'badges': [
-         {'style': 'primary', 'tooltip': 'Number of packages installed in this image'},
-         {'style': 'warning', 'tooltip': 'Number of packages pending an upgrade in this image'},
-         {'style': 'danger', 'tooltip': 'Number of packages pending a security upgrade in this image'}]},
-        {'title': 'OS', 'tooltip': 'Operating System that the image is running'},
-        {'title': 'Last update', 'tooltip': 'Last time the image data was updated'},
-        {'title': '# Packages', 'tooltip': 'Number of package which the image has installed'},
-        {'title': '# Upgrades'},
-        {'title': '# Security Upgrades'},
-        {'title': 'Last update timestamp'},
-    ]
+    """Container image list page, with its rows returned to the DataTables server-side processing requests."""
+    if datatables.is_request(request):
+        return datatables.response(request, Image.objects.all(), INDEX_COLUMNS)
 
     args = {
         # The IDs are DataTable column IDs.
@@ -74,13 +70,31 @@ def index(request):
         ]),
 
         'datatables_page_length': 50,
-        'images': images,
+        'datatables_server_side': True,
         'section': 'images',
         'subtitle': '',
-        'table_headers': table_headers,
+        'table_headers': INDEX_TABLE_HEADERS,
         'title': 'Images',
     }
-    return render(request, 'images/index.html', args)
+    return render(request, 'base_table.html', args)
+
+
+def _detail_validators(request, name):
+    """Validators for conditional_get() of the image detail page, based on its and its namespaces modification time.
+
+    The Last-Modified is set only for the images without namespaces, as the deletion of a namespace is detected only
+    by their count.
+    """
+    if request.META.get('HTTP_ACCEPT', '') == APPLICATION_JSON:
+        return None
+
+    values = Image.objects.select_related(None).filter(name=name).annotate(
+        namespaces_modified=Max('namespaces__modified'), namespaces_count=Count('namespaces')).values_list(
+        'modified', 'namespaces_modified', 'namespaces_count').first()
+    if values is None:  # Let the view return the 404
+        return None
+
+    return values, values[0] if not values[2] else None
 
 
 class DetailView(View):
@@ -90,6 +104,7 @@ class DetailView(View):
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
+    @method_decorator(conditional_get(_detail_validators))
     def get(self, request, name):
         """Image detail page."""
         image = get_object_or_404(Image, name=name)
@@ -132,7 +147,15 @@ class DetailView(View):
 
     def delete(self, request, name):
         image = get_object_or_404(Image, name=name)
-        image.delete()
+        packages = list(ImagePackage.objects.select_related(None).filter(image=image).order_by().values_list(
+            'package', flat=True))
+        deleted, _ = image.delete()
+        DirtyPackage.objects.mark(packages)
+        if not spool.is_enabled():  # Otherwise refreshed by the worker
+            rollups.refresh_on_commit()
+
+        if deleted:  # Not already deleted by a concurrent request
+            generation.bump()
 
         return http.HttpResponse(status=204, content_type=TEXT_PLAIN)
 
@@ -140,147 +163,376 @@ class DetailView(View):
 @verify_clients
 @csrf_exempt
 @require_POST
+@admission_control
 def update_image(request, name):
     """Update an image record and all it's related information from a JSON."""
-    if not request.body:
+    timer = metrics.PhaseTimer('images')
+    try:
+        body = read_body(request)
+    except PayloadError as e:
+        return http.HttpResponse(str(e), status=e.status, content_type=TEXT_PLAIN)
+
+    if not body:
         return http.HttpResponseBadRequest("Empty POST, expected JSON string: {req}".format(
             req=request), content_type=TEXT_PLAIN)
 
     try:
-        payload = json.loads(request.body.decode('utf-8'))
+        payload = json.loads(body.decode('utf-8'))
     except json.JSONDecodeError as e:
         return http.HttpResponseBadRequest(
             'Unable to parse JSON string payload: {e}'.format(e=e), content_type=TEXT_PLAIN)
 
-    if not payload.get('update_type', ''):
-        return http.HttpResponseBadRequest("Update type not specificed in passed parameters match",
-                                           content_type=TEXT_PLAIN)
+    try:
+        os = _validate_payload(name, payload)
+    except ValueError as e:
+        return http.HttpResponseBadRequest(str(e), content_type=TEXT_PLAIN)
+
+    timer.lap('parse')
+    return idempotency.run(idempotency.get_key(request, 'images', name, payload), _update_image, request, name, os,
+                           payload)
+
+
+@verify_clients
+@csrf_exempt
+@require_POST
+@admission_control
+def update_images(request):
+    """Update multiple image records and all their related information from a single JSON."""
+    timer = metrics.PhaseTimer('images')
+    if settings.DEBMONITOR_VERIFY_CLIENTS and not is_valid_image_proxy(request.user.hostname):
+        return http.HttpResponseForbidden("Unauthorized to modify images with certificate '{dn}'".format(
+            dn=request.META.get(SSL_CLIENT_SUBJECT_DN_HEADER, '')), content_type=TEXT_PLAIN)
 
-    if name != payload.get('image_name', ''):
-        return http.HttpResponseBadRequest("URL image '{name}' and POST payload image name '{image}'"
-                                           "do not match".format(name=name, image=payload.get('image_name', '')),
-                                           content_type=TEXT_PLAIN)
     try:
-        os = OS.objects.get(name=payload['os'])
-    except OS.DoesNotExist as e:
-        logger.info(
-            "The OS name %s is not present in the DB. Error: %s", payload['os'], e)
-        try:
-            os = OS(name=payload['os'])
-            os.clean_fields()
-            os.save()
-        except ValidationError as e:
-            return http.HttpResponseBadRequest(
-                "OS name '{os}' is not valid: {e}".format(os=payload['os'], e=e), content_type=TEXT_PLAIN)
+        body = read_body(request)
+    except PayloadError as e:
+        return http.HttpResponse(str(e), status=e.status, content_type=TEXT_PLAIN)
+
+    if not body:
+        return http.HttpResponseBadRequest("Empty POST, expected JSON string: {req}".format(
+            req=request), content_type=TEXT_PLAIN)
+
+    try:
+        payload = json.loads(body.decode('utf-8'))
+    except json.JSONDecodeError as e:
+        return http.HttpResponseBadRequest(
+            'Unable to parse JSON string payload: {e}'.format(e=e), content_type=TEXT_PLAIN)
+
+    images = payload.get('images', []) if isinstance(payload, dict) else None
+    if not isinstance(images, list):
+        return http.HttpResponseBadRequest('JSON Payload key "images" is not a list', content_type=TEXT_PLAIN)
+
+    timer.lap('parse')
+    return idempotency.run(idempotency.get_key(request, 'images', '', images), _update_images, request, images)
+
 
+def apply_update(name, payload):
+    """Validate and apply an update payload outside of a request, like the spooled ones."""
+    _update_v1(None, name, _validate_payload(name, payload), payload)
+
+
+def _update_image(request, name, os, payload):
+    """Spool or apply a validated image update submission and return the response."""
     message = "Unable to update image '{image}'".format(image=name)
+    if spool.is_enabled():
+        spool.Spool().push('images', name, payload)
+        return http.HttpResponse(status=202, content_type=TEXT_PLAIN)
+
     try:
         _update_v1(request, name, os, payload)
-    except (KeyError, TypeError) as e:
+    except (KeyError, TypeError, ValidationError) as e:
         logger.exception(message)
         return http.HttpResponseBadRequest('{message}: {e}'.format(message=message, e=e), content_type=TEXT_PLAIN)
     except Exception as e:  # Force a response to avoid using the HTML template for all other 500s
         logger.exception(message)
         return http.HttpResponseServerError('{message}: {e}'.format(message=message, e=e), content_type=TEXT_PLAIN)
     else:
+        rollups.refresh_on_commit()
         return http.HttpResponse(status=201, content_type=TEXT_PLAIN)
 
 
+def _update_images(request, images):
+    """Spool or apply the image update submissions of a batch and return the response."""
+    response = {'images': {}, 'errors': 0}
+    for image_payload in images:
+        name = image_payload.get('image_name', '') if isinstance(image_payload, dict) else ''
+        name = name if isinstance(name, str) else str(name)
+        message = "Unable to update image '{image}'".format(image=name)
+        try:
+            os = _validate_payload(name, image_payload)
+            if spool.is_enabled():
+                spool.Spool().push('images', name, image_payload)
+            else:
+                _update_v1(request, name, os, image_payload)
+        except ValueError as e:
+            response['images'][name] = {'success': False, 'error': str(e)}
+        except Exception as e:
+            logger.exception(message)
+            response['images'][name] = {'success': False, 'error': '{message}: {e}'.format(message=message, e=e)}
+        else:
+            response['images'][name] = {'success': True}
+            continue
+
+        response['errors'] += 1
+
+    if not spool.is_enabled():
+        rollups.refresh_on_commit()
+
+    logger.info("Updated %d images in batch, %d failed", len(images) - response['errors'], response['errors'])
+    response['success'] = response['errors'] == 0
+    return http.JsonResponse(response, status=201 if response['success'] and not spool.is_enabled() else 202)
+
+
+def _validate_payload(name, payload):
+    """Validate an update payload and return the related OS, creating it if needed. Raise ValueError if invalid."""
+    if not isinstance(payload, dict):
+        raise ValueError('Invalid POST payload, expected a JSON object')
+
+    if not payload.get('update_type', ''):
+        raise ValueError("Update type not specificed in passed parameters match")
+
+    if not name or name != payload.get('image_name', ''):
+        raise ValueError("URL image '{name}' and POST payload image name '{image}'do not match".format(
+            name=name, image=payload.get('image_name', '')))
+
+    if not isinstance(payload.get('os', None), str) or not payload['os']:
+        raise ValueError('OS not specified in POST payload')
+
+    cache = resolution.get_cache('os')
+    os = cache.get(payload['os'])
+    if os is not None:
+        return os
+
+    try:
+        os = OS.objects.get(name=payload['os'])
+    except OS.DoesNotExist as e:
+        logger.info(
+            "The OS name %s is not present in the DB. Error: %s", payload['os'], e)
+        try:
+            os = OS(name=payload['os'])
+            os.clean_fields()
+            os.save()
+        except ValidationError as e:
+            raise ValueError("OS name '{os}' is not valid: {e}".format(os=payload['os'], e=e))
+
+    cache.set(payload['os'], os)
+    return os
+
+
+@atomic_retry
 def _update_v1(request, name, os, payload):
-    """Update API v1."""
-    start_time = timezone.now()
+    """Update API v1, atomically applied while holding a lock on the image."""
+    metrics.count_items('images', payload)
+    timer = metrics.PhaseTimer('images')
+    digest = None
+    if payload['update_type'] == 'full':
+        digest = manifest_digest(os.name, payload)
 
     try:
-        im = Image.objects.get(name=name)
+        im = Image.objects.select_related(None).select_for_update().get(name=name)  # Serialize the image updates
+        if digest is not None and im.manifest_digest == digest:
+            im.save()  # Update only the modification time
+            logger.info("Skipped unchanged packages manifest for image '%s'", name)
+            return
+
+        generation.bump()
         im.os = os
+        im.manifest_digest = None  # Reset it until the update is completed
         im.save()  # Always update at least the modification time
-        image_packages = {image_pkg.package.name: image_pkg for image_pkg in ImagePackage.objects.filter(image=im)}
-
+        created = False
     except Image.DoesNotExist:
         im = Image(name=name, os=os)
         im.save()
-        image_packages = {}
+        search.add([im])
+        generation.bump()
+        created = True
         logger.info("Created image '%s'", name)
 
-    existing_not_updated = []
+    if digest is not None:
+        source = Image.objects.select_related(None).filter(manifest_digest=digest).exclude(pk=im.pk).first()
+        if source is not None:
+            _copy_image_packages(im, source, created)
+            Image.objects.select_related(None).filter(pk=im.pk).update(manifest_digest=digest, **{
+                field: getattr(source, field) for field in COUNTS_FIELDS})
+            logger.info("Copied packages for image '%s' from image '%s' with the same manifest", name, source.name)
+            return
+
+    if created:
+        image_packages = {}
+    else:
+        image_packages = {image_pkg.package.name: image_pkg for image_pkg in ImagePackage.objects.filter(image=im)}
+
+    timer.lap('load')
+
     existing_upgradable_not_updated = []
+    updated = {}  # Already existing ImagePackage objects that were modified, indexed by primary key
+    deleted = []  # Primary keys of the ImagePackage objects to delete
 
     installed = payload.get('installed', [])
+    package_versions = PackageVersion.objects.get_or_create_many(os, _installed_to_resolve(image_packages, installed))
     for item in installed:
-        _process_installed(im, os, image_packages, existing_not_updated, item)
+        _process_installed(im, image_packages, package_versions, updated, item)
 
     logger.info("Tracked %d installed packages for image '%s'", len(installed), name)
+    timer.lap('installed')
 
     uninstalled = payload.get('uninstalled', [])
     for item in uninstalled:
-        existing = image_packages.get(item['name'], None)
-        if existing is not None:
-            existing.delete()
+        existing = image_packages.pop(item['name'], None)
+        if existing is not None and existing.pk is not None:
+            updated.pop(existing.pk, None)
+            deleted.append(existing.pk)
 
     logger.info("Untracked %d uninstalled packages for image '%s'", len(uninstalled), name)
+    timer.lap('uninstalled')
 
     upgradable = payload.get('upgradable', [])
+    package_versions = PackageVersion.objects.get_or_create_many(
+        os, _upgradable_to_resolve(image_packages, upgradable))
     for item in upgradable:
-        _process_upgradable(im, os, image_packages, existing_upgradable_not_updated, item)
+        _process_upgradable(im, image_packages, package_versions, existing_upgradable_not_updated, updated, item)
 
     logger.info("Tracked %d upgradable packages for image '%s'", len(upgradable), name)
+    timer.lap('upgradable')
 
     if payload['update_type'] == 'full':
-        _garbage_collection(im, name, start_time, existing_not_updated, existing_upgradable_not_updated)
+        _garbage_collection(name, image_packages, installed, existing_upgradable_not_updated, updated, deleted)
+        timer.lap('garbage_collection')
+
+    _save_image_packages(image_packages, updated, deleted)
+    Image.refresh_counts([im])
+
+    if payload['update_type'] == 'full':
+        Image.objects.select_related(None).filter(pk=im.pk).update(manifest_digest=digest)
+
+    timer.lap('save')
+
 
+def _copy_image_packages(image, source, created):
+    """Replace all the ImagePackage objects of an image with a copy of the ones of the source image."""
+    dirty = set()
+    if not created:
+        dirty.update(ImagePackage.objects.select_related(None).filter(image=image).order_by().values_list(
+            'package', flat=True))
+        ImagePackage.objects.filter(image=image).delete()
 
-def _garbage_collection(image, name, start_time, existing_not_updated, existing_upgradable_not_updated):
-    # Delete orphaned entries based on the modification datetime and the list of already up-to-date IDs
-    res = ImagePackage.objects.filter(image=image,
-                                      modified__lt=start_time).exclude(pk__in=existing_not_updated).delete()
-    logger.info("Deleted %d ImagePackage orphaned entries for image '%s'", res[0], name)
+    fields = ('package_id', 'package_version_id', 'upgradable_imagepackage_id', 'upgradable_imageversion_id',
+              'upgrade_type')
+    image_packages = [ImagePackage(image=image, **image_package)
+                      for image_package in ImagePackage.objects.filter(image=source).values(*fields).order_by()]
+    ImagePackage.objects.bulk_create(image_packages)
 
-    # Cleanup orphaned upgrades based on the modification datetime and the list of already up-to-date IDs
-    image_packages = ImagePackage.objects.filter(
-        image=image, modified__lt=start_time, upgradable_imagepackage__isnull=False).exclude(
-        pk__in=existing_upgradable_not_updated)
+    dirty.update(image_package.package_id for image_package in image_packages)
+    DirtyPackage.objects.mark(dirty)
+
+
+def _garbage_collection(name, image_packages, installed, existing_upgradable_not_updated, updated, deleted):
+    """Mark the orphaned entries of a full update for deletion and clean their orphaned upgradable info.
+
+    As all the ImagePackage objects of the image are already loaded, the orphaned entries are detected in memory and
+    then deleted or updated with the other changes, without relying on the modification datetime.
+    """
+    installed_names = {item['name'] for item in installed}
+    orphaned = [package for package, image_package in image_packages.items() if image_package.pk is not None and
+                image_package.pk not in updated and package not in installed_names]
+    for package in orphaned:
+        deleted.append(image_packages.pop(package).pk)
+
+    logger.info("Deleted %d ImagePackage orphaned entries for image '%s'", len(orphaned), name)
+
+    upgradable_not_updated = set(existing_upgradable_not_updated)
+    cleaned = 0
+    for image_package in image_packages.values():
+        if (image_package.pk is None or image_package.pk in updated or
+                image_package.pk in upgradable_not_updated or image_package.upgradable_imagepackage_id is None):
+            continue
 
-    for image_package in image_packages:
         image_package.upgradable_imagepackage = None
         image_package.upgradable_imageversion = None
         image_package.upgrade_type = None
-        image_package.save()
+        updated[image_package.pk] = image_package
+        cleaned += 1
+
+    logger.info("Cleaned %d ImagePackage upgradable info for image '%s'", cleaned, name)
+
+
+def _installed_to_resolve(image_packages, installed):
+    """Generate the (name, source, version) tuples of the installed items that are not already up-to-date."""
+    for item in installed:
+        existing = image_packages.get(item['name'], None)
+        if existing is None or existing.package_version.version != item['version']:
+            yield item['name'], item['source'], item['version']
+
+
+def _upgradable_to_resolve(image_packages, upgradable):
+    """Generate the (name, source, version) tuples of the upgradable items that are not already up-to-date."""
+    for item in upgradable:
+        existing = image_packages.get(item['name'], None)
+        if existing is None:
+            yield item['name'], item['source'], item['version_from']
+            yield item['name'], item['source'], item['version_to']
+        elif (existing.upgradable_imagepackage is None or
+                existing.upgradable_imageversion.version != item['version_to']):
+            yield item['name'], item['source'], item['version_to']
+
+
+def _save_image_packages(image_packages, updated, deleted):
+    """Persist all the ImagePackage changes with bulk queries and mark their packages as dirty."""
+    dirty = {image_package.package_id for image_package in updated.values()}
+    if deleted:
+        dirty.update(ImagePackage.objects.select_related(None).filter(pk__in=deleted).order_by().values_list(
+            'package', flat=True))
+        ImagePackage.objects.filter(pk__in=deleted).delete()
+
+    if updated:
+        now = timezone.now()
+        for image_package in updated.values():  # bulk_update() doesn't update the auto_now fields
+            image_package.modified = now
+
+        ImagePackage.objects.bulk_update(
+            updated.values(),
+            ['package_version', 'upgradable_imagepackage', 'upgradable_imageversion', 'upgrade_type', 'modified'])
+
+    created = [image_package for image_package in image_packages.values() if image_package.pk is None]
+    if created:
+        ImagePackage.objects.bulk_create(created)
 
-    logger.info("Cleaned %d ImagePackage upgradable info for image '%s'", len(image_packages), name)
+    dirty.update(image_package.package_id for image_package in created)
+    DirtyPackage.objects.mark(dirty)
 
 
-def _process_installed(image, os, image_packages, existing_not_updated, item):
-    """Process an installed package item, return True if it was created or updated."""
+def _process_installed(image, image_packages, package_versions, updated, item):
+    """Process an installed package item."""
     existing = image_packages.get(item['name'], None)
 
     if existing is not None and existing.package_version.version == item['version']:
-        existing_not_updated.append(existing.pk)
         return  # Already up-to-date
 
-    package_version, _ = PackageVersion.objects.get_or_create(os=os, entity_package=existing, **item)
+    package_version = package_versions[(item['name'], item['version'])]
     if existing is not None:
         existing.package_version = package_version
         existing.upgradable_imagepackage = None
         existing.upgradable_imageversion = None
         existing.upgrade_type = None
-        existing.save()
+        if existing.pk is not None:
+            updated[existing.pk] = existing
     else:
-        image_packages[package_version.package.name] = ImagePackage.objects.create(
+        image_packages[item['name']] = ImagePackage(
             image=image, package=package_version.package, package_version=package_version)
 
 
-def _process_upgradable(image, os, image_packages, existing_upgradable_not_updated, item):
+def _process_upgradable(image, image_packages, package_versions, existing_upgradable_not_updated, updated, item):
     """Process an upgradable package item."""
     existing = image_packages.get(item['name'], None)
 
     if existing is not None:
         if (existing.upgradable_imagepackage is not None and
                 existing.upgradable_imageversion.version == item['version_to']):
-            existing_upgradable_not_updated.append(existing.pk)
+            if existing.pk is not None:
+                existing_upgradable_not_updated.append(existing.pk)
             return  # Already up-to-date
 
-        upgradable_version, _ = PackageVersion.objects.get_or_create(
-            os=os, version=item['version_to'], entity_package=existing, **item)
+        upgradable_version = package_versions[(item['name'], item['version_to'])]
 
         if existing.package_version == upgradable_version:  # The package has been already upgraded
             existing.upgradable_imagepackage = None
@@ -290,10 +542,11 @@ def _process_upgradable(image, os, image_packages, existing_upgradable_not_updat
             existing.upgradable_imagepackage = upgradable_version.package
             existing.upgradable_imageversion = upgradable_version
 
-        existing.save()
+        if existing.pk is not None:
+            updated[existing.pk] = existing
     else:
-        installed_version, _ = PackageVersion.objects.get_or_create(os=os, version=item['version_from'], **item)
-        upgradable_version, _ = PackageVersion.objects.get_or_create(os=os, version=item['version_to'], **item)
-        ImagePackage.objects.create(
+        installed_version = package_versions[(item['name'], item['version_from'])]
+        upgradable_version = package_versions[(item['name'], item['version_to'])]
+        image_packages[item['name']] = ImagePackage(
             image=image, package=installed_version.package, package_version=installed_version,
             upgradable_imagepackage=upgradable_version.package, upgradable_imageversion=upgradable_version)
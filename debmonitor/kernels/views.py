@@ -5,11 +5,13 @@ from django.db.models import Count, Prefetch
 from django.shortcuts import render
 from django.views.decorators.http import require_safe
 
+from debmonitor.decorators import conditional_get, inventory_validators
 from hosts.models import Host
 from kernels.models import KernelVersion
 
 
 @require_safe
+@conditional_get(inventory_validators)
 def index(request):
     """Kernels list page."""
     kernels = KernelVersion.objects.annotate(hosts_count=Count('hosts'))
@@ -33,6 +35,7 @@ def index(request):
 
 
 @require_safe
+@conditional_get(inventory_validators)
 def detail(request, os_id, slug):
     """Kernel detail page."""
     kernel = KernelVersion.objects.filter(os__id=os_id, slug=slug).prefetch_related(
@@ -3,33 +3,49 @@ import logging
 
 from django import http
 from django.shortcuts import render
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.html import escape, format_html
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_safe
 
 from kubernetes.models import KubernetesImage
 
-from debmonitor.decorators import verify_clients
+from debmonitor import datatables, generation, idempotency, metrics
+from debmonitor.decorators import (admission_control, atomic_retry, conditional_get, inventory_validators,
+                                   verify_clients)
 from debmonitor.middleware import TEXT_PLAIN
+from debmonitor.payload import PayloadError, read_body
 from images.models import Image
 
 
+INDEX_TABLE_HEADERS = [
+    {'title': 'Cluster'},
+    {'title': 'Namespace'},
+    {'title': 'Image name', 'tooltip':
+     'Image that is deployed in the Kubernetes cluster and namespace'},
+    {'title': 'OS', 'tooltip': 'Operating System that the image is running'},
+    {'title': '# of containers', 'tooltip': 'Number of containers deployed'},
+]
+INDEX_COLUMNS = [
+    datatables.Column(lambda kub_image: escape(kub_image.cluster), order_by=('cluster',), search='cluster'),
+    datatables.Column(lambda kub_image: escape(kub_image.namespace), order_by=('namespace',), search='namespace'),
+    datatables.Column(lambda kub_image: format_html(
+        '<a href="{url}">{name}</a>', url=reverse('images:detail', args=[kub_image.image.name]),
+        name=kub_image.image.name), order_by=('image__name',), search='image__name'),
+    datatables.Column(lambda kub_image: escape(kub_image.image.os), order_by=('image__os__name',),
+                      search='image__os__name'),
+    datatables.Column(lambda kub_image: kub_image.containers, order_by=('containers',)),
+]
 logger = logging.getLogger(__name__)
 
 
 @require_safe
+@conditional_get(inventory_validators)
 def index(request):
-    """Kubernetes deployed images list page."""
-    images = KubernetesImage.objects.all()
-
-    table_headers = [
-        {'title': 'Cluster'},
-        {'title': 'Namespace'},
-        {'title': 'Image name', 'tooltip':
-         'Image that is deployed in the Kubernetes cluster and namespace'},
-        {'title': 'OS', 'tooltip': 'Operating System that the image is running'},
-        {'title': '# of containers', 'tooltip': 'Number of containers deployed'},
-    ]
+    """Kubernetes deployed images list page, with its rows returned to the DataTables server-side requests."""
+    if datatables.is_request(request):
+        return datatables.response(request, KubernetesImage.objects.select_related('image', 'image__os'), INDEX_COLUMNS)
 
     args = {
         # The IDs are DataTable column IDs.
@@ -46,25 +62,32 @@ def index(request):
         ]),
 
         'datatables_page_length': 50,
-        'images': images,
+        'datatables_server_side': True,
         'section': 'kubernetes',
         'subtitle': '',
-        'table_headers': table_headers,
+        'table_headers': INDEX_TABLE_HEADERS,
         'title': 'Live Kubernetes Images',
     }
-    return render(request, 'kubernetes/index.html', args)
+    return render(request, 'base_table.html', args)
 
 
 @verify_clients
 @csrf_exempt
 @require_POST
+@admission_control
 def update_kubernetes_images(request):
     """Update the KubernetesImages objects from a JSON."""
-    if not request.body:
+    timer = metrics.PhaseTimer('kubernetes')
+    try:
+        body = read_body(request)
+    except PayloadError as e:
+        return http.HttpResponse(str(e), status=e.status, content_type=TEXT_PLAIN)
+
+    if not body:
         return http.HttpResponseBadRequest(f'Empty POST, expected JSON string: {request}', content_type=TEXT_PLAIN)
 
     try:
-        payload = json.loads(request.body.decode('utf-8'))
+        payload = json.loads(body.decode('utf-8'))
     except json.JSONDecodeError as e:
         return http.HttpResponseBadRequest(f'Unable to parse JSON string payload: {e}', content_type=TEXT_PLAIN)
 
@@ -78,6 +101,13 @@ def update_kubernetes_images(request):
         return http.HttpResponseBadRequest(
             'JSON Payload key "images" is not a dictionary', content_type=TEXT_PLAIN)
 
+    timer.lap('parse')
+    return idempotency.run(idempotency.get_key(request, 'kubernetes', cluster, images), _update_cluster, cluster,
+                           images)
+
+
+def _update_cluster(cluster, images):
+    """Apply a validated Kubernetes images update submission and return the response."""
     message = f'Unable to update Kubernetes images for cluster {cluster}'
     try:
         response = _update_v1(cluster, images)
@@ -89,36 +119,73 @@ def update_kubernetes_images(request):
         return http.JsonResponse(response, status=201 if response['success'] else 202)
 
 
+@atomic_retry
 def _update_v1(cluster, images):
-    """Update API v1."""
-    start_time = timezone.now()
-
-    counter = 0
+    """Update API v1, reconciling in memory the existing objects of the cluster and applying the changes in bulk."""
+    timer = metrics.PhaseTimer('kubernetes')
     failed = {'missing': [], 'errors': []}
+    existing_images = {image.name: image for image in Image.objects.select_related(None).filter(
+        name__in=images.keys()).only('id', 'name')}
+    existing = {(kub_image.namespace, kub_image.image_id): kub_image
+                for kub_image in KubernetesImage.objects.filter(cluster=cluster)}
+    containers_field = KubernetesImage._meta.get_field('containers')
+
+    created = []
+    updated = []
+    tracked = set()
     for name, data in images.items():
-        try:
-            image = Image.objects.get(name=name)
-        except Image.DoesNotExist:
+        image = existing_images.get(name, None)
+        if image is None:
             failed['missing'].append(name)
             continue
 
         for namespace, containers in data.items():
             try:
-                kub_image, _ = KubernetesImage.objects.update_or_create(
-                    defaults={'containers': containers}, cluster=cluster, namespace=namespace, image=image)
-                counter += 1
-            except Exception as e:
+                containers = containers_field.get_prep_value(containers)
+                if containers < 0:
+                    raise ValueError(f"Field 'containers' expected a positive number but got {containers!r}.")
+            except (TypeError, ValueError) as e:
                 failed['errors'].append({'image': name, 'cluster': cluster, 'namespace': namespace, 'error': str(e)})
+                continue
+
+            tracked.add((namespace, image.id))
+            kub_image = existing.get((namespace, image.id), None)
+            if kub_image is None:
+                created.append(
+                    KubernetesImage(cluster=cluster, namespace=namespace, image=image, containers=containers))
+            elif kub_image.containers != containers:
+                kub_image.containers = containers
+                updated.append(kub_image)
+
+    if created:
+        KubernetesImage.objects.bulk_create(created)
+
+    if updated:
+        now = timezone.now()
+        for kub_image in updated:  # bulk_update() doesn't update the auto_now fields
+            kub_image.modified = now
+
+        KubernetesImage.objects.bulk_update(updated, ['containers', 'modified'])
 
     logger.info(
-        "Tracked %d deployed Kubernetes images for cluster '%s', skipped %d missing images and %d that errored out",
-        counter,
+        "Tracked %d deployed Kubernetes images for cluster '%s' (%d new, %d updated), skipped %d missing images and %d "
+        "that errored out",
+        len(tracked),
         cluster,
+        len(created),
+        len(updated),
         len(failed['missing']),
         len(failed['errors']),
     )
 
-    # Delete orphaned entries based on the modification datetime for the given cluster
-    res = KubernetesImage.objects.filter(cluster=cluster, modified__lt=start_time).delete()
-    logger.info("Deleted %d Kubernetes images orphaned entries for cluster '%s'", res[0], cluster)
+    # Delete the orphaned entries that are not deployed anymore in the given cluster
+    orphaned = [kub_image.pk for key, kub_image in existing.items() if key not in tracked]
+    if orphaned:
+        KubernetesImage.objects.filter(pk__in=orphaned).delete()
+
+    if created or updated or orphaned:
+        generation.bump()
+
+    logger.info("Deleted %d Kubernetes images orphaned entries for cluster '%s'", len(orphaned), cluster)
+    timer.lap('apply')
     return failed
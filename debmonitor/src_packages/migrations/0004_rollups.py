@@ -0,0 +1,58 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def forwards_func(apps, schema_editor):
+    """Mark all the source packages as dirty to compute their rollups at the next refresh."""
+    SrcPackage = apps.get_model('src_packages', 'SrcPackage')
+    DirtySrcPackage = apps.get_model('src_packages', 'DirtySrcPackage')
+
+    pks = list(SrcPackage.objects.values_list('pk', flat=True))
+    DirtySrcPackage.objects.bulk_create([DirtySrcPackage(src_package_id=pk) for pk in pks], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('src_packages', '0003_alter_os_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtySrcPackage',
+            fields=[
+                ('src_package', models.OneToOneField(
+                    help_text='Source package.', on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                    related_name='+', serialize=False, to='src_packages.srcpackage',
+                    verbose_name='source package')),
+            ],
+            options={
+                'verbose_name': 'dirty source package',
+                'verbose_name_plural': 'dirty source packages',
+            },
+        ),
+        migrations.CreateModel(
+            name='SrcPackageRollup',
+            fields=[
+                ('src_package', models.OneToOneField(
+                    help_text='Source package.', on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                    related_name='rollup', serialize=False, to='src_packages.srcpackage',
+                    verbose_name='source package')),
+                ('versions_count', models.PositiveIntegerField(
+                    default=0, help_text='Number of versions of the source package.')),
+                ('os_list', models.TextField(
+                    blank=True, default='',
+                    help_text='Comma-separated list of the operating systems of the versions of the source package.',
+                    verbose_name='operating systems')),
+                ('modified', models.DateTimeField(
+                    auto_now=True, help_text='Datetime of the last modification of this object.')),
+            ],
+            options={
+                'verbose_name': 'source package rollup',
+                'verbose_name_plural': 'source package rollups',
+            },
+        ),
+        migrations.RunPython(forwards_func, migrations.RunPython.noop),
+    ]
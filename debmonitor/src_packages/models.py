@@ -1,7 +1,7 @@
 from django.core.validators import RegexValidator
 from django.db import models
 
-from debmonitor import SelectManager
+from debmonitor import DirtyManager, NameManager, SelectManager
 
 
 class OS(models.Model):
@@ -35,6 +35,8 @@ class SrcPackage(models.Model):
 
     name = models.CharField(max_length=255, unique=True, help_text='Source package name.')
 
+    objects = NameManager()
+
     class Meta:
         """Additional metadata."""
 
@@ -59,7 +61,46 @@ class SrcPackageVersionManager(SelectManager):
         else:
             arguments['src_package'], _ = SrcPackage.objects.get_or_create(name=kwargs['name'])
 
-        return super().get_or_create(**arguments)
+        obj, created = super().get_or_create(**arguments)
+        if created:
+            DirtySrcPackage.objects.mark([obj.src_package_id])
+
+        return obj, created
+
+    def get_or_create_many(self, os, items):
+        """Bulk version of get_or_create() to resolve many source package versions of the same OS with few queries.
+
+        Arguments:
+            os (src_packages.models.OS): the operating system of all the source package versions.
+            items (iterable): an iterable of (name, version) tuples.
+
+        Returns:
+            dict: a dictionary with (name, version) tuples as keys and SrcPackageVersion objects as values.
+        """
+        items = set(items)
+        if not items:
+            return {}
+
+        src_packages = SrcPackage.objects.get_or_create_many(name for name, _ in items)
+        resolved = self._filter_many(os, items)
+        missing = items - resolved.keys()
+        if missing:
+            # Objects created in the meanwhile by a concurrent request are silently skipped and fetched below
+            self.bulk_create([self.model(src_package=src_packages[name], version=version, os=os)
+                              for name, version in missing], ignore_conflicts=True)
+            resolved.update(self._filter_many(os, missing))
+            DirtySrcPackage.objects.mark(src_packages[name].pk for name, _ in missing)
+
+        return resolved
+
+    def _filter_many(self, os, items):
+        """Return a dictionary with the existing source package versions for the given (name, version) tuples."""
+        objects = self.get_queryset().filter(
+            os=os, src_package__name__in={name for name, _ in items}, version__in={version for _, version in items})
+
+        # The query selects a superset of the requested items, filter them out
+        return {(obj.src_package.name, obj.version): obj for obj in objects
+                if (obj.src_package.name, obj.version) in items}
 
 
 class SrcPackageVersion(models.Model):
@@ -87,3 +128,45 @@ class SrcPackageVersion(models.Model):
     def __str__(self):
         """Model representation."""
         return '{name} {version} ({os})'.format(name=self.src_package.name, version=self.version, os=self.os.name)
+
+
+class SrcPackageRollup(models.Model):
+    """Precomputed aggregates of a source package for the list page."""
+
+    src_package = models.OneToOneField(SrcPackage, on_delete=models.CASCADE, primary_key=True, related_name='rollup',
+                                       verbose_name='source package', help_text='Source package.')
+    versions_count = models.PositiveIntegerField(default=0, help_text='Number of versions of the source package.')
+    os_list = models.TextField(
+        blank=True, default='', verbose_name='operating systems',
+        help_text='Comma-separated list of the operating systems of the versions of the source package.')
+
+    modified = models.DateTimeField(auto_now=True, help_text='Datetime of the last modification of this object.')
+
+    class Meta:
+        """Additional metadata."""
+
+        verbose_name = 'source package rollup'
+        verbose_name_plural = 'source package rollups'
+
+    def __str__(self):
+        """Model representation."""
+        return str(self.src_package_id)
+
+
+class DirtySrcPackage(models.Model):
+    """Source packages whose rollup needs to be refreshed."""
+
+    src_package = models.OneToOneField(SrcPackage, on_delete=models.CASCADE, primary_key=True, related_name='+',
+                                       verbose_name='source package', help_text='Source package.')
+
+    objects = DirtyManager()
+
+    class Meta:
+        """Additional metadata."""
+
+        verbose_name = 'dirty source package'
+        verbose_name_plural = 'dirty source packages'
+
+    def __str__(self):
+        """Model representation."""
+        return str(self.src_package_id)
@@ -1,42 +1,59 @@
 import json
 
-from django.db.models import Count, Prefetch
+from django.db.models import F, IntegerField, Prefetch
+from django.db.models.functions import Coalesce
 from django.http import Http404
 from django.shortcuts import render
+from django.urls import reverse
+from django.utils.html import escape, format_html
 from django.views.decorators.http import require_safe
 
-from debmonitor import DistinctGroupConcat
+from debmonitor import datatables
+from debmonitor.decorators import conditional_get, inventory_validators
 from bin_packages.models import PackageVersion
 from src_packages.models import SrcPackage, SrcPackageVersion
 
 
+INDEX_TABLE_HEADERS = [
+    {'title': 'Package', 'tooltip': 'Name of the source package'},
+    {'title': '# Versions', 'tooltip': 'Number of distinct versions of this source package the hosts that have '
+     'binary packages derived from it have installed'},
+    {'title': 'Operating Systems',
+     'tooltip': ('List of distinct Operating Systems the hosts that have binary packages derived from this source '
+                 'package installed are running')},
+]
+INDEX_COLUMNS = [
+    datatables.Column(lambda package: format_html(
+        '<a href="{url}">{name}</a>', url=reverse('src_packages:detail', args=[package.name]), name=package.name),
+        order_by=('name',), search='name'),
+    datatables.Column(lambda package: package.versions_count, order_by=('versions_count',)),
+    datatables.Column(lambda package: escape(package.os_list or ''), order_by=('os_list',)),
+]
+
+
 @require_safe
+@conditional_get(inventory_validators)
 def index(request):
-    """Source packages list page."""
-    packages = SrcPackage.objects.all().annotate(
-        versions_count=Count('versions', distinct=True), os_list=DistinctGroupConcat('versions__os__name'))
-
-    table_headers = [
-        {'title': 'Package', 'tooltip': 'Name of the source package'},
-        {'title': '# Versions', 'tooltip': 'Number of distinct versions of this source package the hosts that have '
-         'binary packages derived from it have installed'},
-        {'title': 'Operating Systems',
-         'tooltip': ('List of distinct Operating Systems the hosts that have binary packages derived from this source '
-                     'package installed are running')},
-    ]
+    """Source packages list page, with its rows returned to the DataTables server-side processing requests."""
+    if datatables.is_request(request):
+        return datatables.response(request, SrcPackage.objects.all(), INDEX_COLUMNS, annotations={
+            'versions_count': Coalesce('rollup__versions_count', 0, output_field=IntegerField()),
+            'os_list': F('rollup__os_list'),
+        })
 
     args = {
         'datatables_page_length': 50,
-        'packages': packages,
+        'datatables_server_side': True,
         'section': 'src_packages',
         'subtitle': '',
-        'table_headers': table_headers,
+        'table_headers': INDEX_TABLE_HEADERS,
         'title': 'Source Packages',
     }
-    return render(request, 'src_packages/index.html', args)
+    return render(request, 'base_table.html', args)
 
 
 @require_safe
+@conditional_get(inventory_validators)
 def detail(request, name):
     """Source package detail page."""
     package_versions = SrcPackageVersion.objects.filter(src_package__name=name).prefetch_related(
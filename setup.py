@@ -24,8 +24,15 @@ extras_require = {
     'with-cas': [  # With CAS support
         'django-cas-ng',
     ],
+    'with-zstd': [  # With zstd compressed payloads support
+        'zstandard',
+    ],
+    'with-prometheus': [  # With Prometheus metrics support
+        'prometheus_client',
+    ],
     'tests': [  # Test dependencies
         'flake8>=3.5.0',
+        'prometheus_client',
         'pytest>=3.5.0',
         'pytest-cov>=2.5.1',
         'pytest-django>=3.1.2',
@@ -33,7 +40,8 @@ extras_require = {
         'requests-mock>=1.3.0',
     ],
 }
-extras_require['with-all'] = extras_require['with-mysql'] + extras_require['with-ldap'] + extras_require['with-cas']
+extras_require['with-all'] = (extras_require['with-mysql'] + extras_require['with-ldap'] + extras_require['with-cas']
+                              + extras_require['with-zstd'] + extras_require['with-prometheus'])
 
 setup_requires = [
     'setuptools_scm>=1.17.0',
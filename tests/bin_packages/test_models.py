@@ -49,3 +49,48 @@ def test_packageversion_clean():
 
     with pytest.raises(ValidationError, match='OS mismatch between'):
         package.save()
+
+
+def test_packageversion_get_or_create_many():
+    """Calling get_or_create_many() should return existing objects and bulk create the missing ones."""
+    package_name = str(uuid.uuid4())
+    os = OS.objects.get(name='Debian 11')
+    items = [('package1', 'package1', '1.0.0-1'), (package_name, package_name, '1.2.3-1'),
+             (package_name + '-bin', package_name, '1.2.3-1')]
+
+    package_versions = models.PackageVersion.objects.get_or_create_many(os, items)
+
+    assert set(package_versions.keys()) == {(name, version) for name, _, version in items}
+    assert package_versions[('package1', '1.0.0-1')] == models.PackageVersion.objects.get(
+        package__name='package1', version='1.0.0-1', os=os)
+    for name in (package_name, package_name + '-bin'):
+        package_version = package_versions[(name, '1.2.3-1')]
+        assert package_version.pk is not None
+        assert package_version.package.name == name
+        assert package_version.src_package_version.src_package.name == package_name
+        assert package_version.src_package_version.os == os
+
+
+@pytest.mark.parametrize('item, field', (
+    (('a' * 256, 'source', '1.0.0-1'), 'package name'),
+    (('name', 'a' * 256, '1.0.0-1'), 'source package name'),
+    (('name', 'source', 'a' * 256), 'package version version'),
+    (('name', 'source', ''), 'package version version'),
+))
+def test_packageversion_get_or_create_many_invalid(item, field):
+    """Calling get_or_create_many() with an invalid item should raise ValidationError without creating any object."""
+    os = OS.objects.get(name='Debian 11')
+    package_name = str(uuid.uuid4())
+    items = [(package_name, package_name, '1.2.3-1'), item]
+
+    with pytest.raises(ValidationError, match='Invalid {field}'.format(field=field)):
+        models.PackageVersion.objects.get_or_create_many(os, items)
+
+    assert not models.Package.objects.filter(name=package_name).exists()
+
+
+def test_packageversion_get_or_create_many_empty(django_assert_num_queries):
+    """Calling get_or_create_many() without items should not perform any query."""
+    os = OS.objects.get(name='Debian 11')
+    with django_assert_num_queries(0):
+        assert models.PackageVersion.objects.get_or_create_many(os, []) == {}
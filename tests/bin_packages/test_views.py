@@ -1,8 +1,12 @@
+import json
+
 import pytest
 
 from django.urls import resolve, reverse
 
 from bin_packages import views
+from bin_packages.models import Package
+from debmonitor import rollups
 from tests.conftest import setup_auth_settings, validate_status_code
 
 
@@ -31,6 +35,31 @@ def test_index_view_function():
     assert view.func is views.index
 
 
+@pytest.mark.django_db
+def test_index_datatables(client):
+    """Requesting the binary packages index page with the DataTables parameters should return the JSON rows."""
+    response = client.get(INDEX_URL, {'draw': '2', 'length': '-1', 'order[0][column]': '0', 'order[0][dir]': 'asc'})
+    data = json.loads(response.content.decode())
+
+    assert response.status_code == 200
+    assert data['draw'] == 2
+    assert data['recordsTotal'] == Package.objects.count()
+    assert data['recordsFiltered'] == data['recordsTotal']
+    assert len(data['data']) == data['recordsTotal']
+
+
+@pytest.mark.django_db
+def test_index_datatables_rollups(client):
+    """The binary packages index page rows should report the counters of the packages rollups."""
+    rollups.rebuild()
+    response = client.get(INDEX_URL, {'draw': '1', 'search[value]': 'package1'})
+    data = json.loads(response.content.decode())
+
+    assert response.status_code == 200
+    assert len(data['data']) == 1
+    assert data['data'][0][1:] == [2, 'Debian 11', 3, 2, 0]
+
+
 def test_detail_reverse_url_existing():
     """Reversing an existing binary package detail page URL name should return the correct URL."""
     url = reverse('bin_packages:detail', kwargs={'name': 'package1'})
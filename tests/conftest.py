@@ -15,6 +15,24 @@ STRONGHOLD_MIDDLEWARE = 'stronghold.middleware.LoginRequiredMiddleware'
 def django_db_setup(django_db_setup, django_db_blocker):
     with django_db_blocker.unblock():
         call_command('loaddata', 'tests/db.json')
+        from debmonitor import search  # Imported here as Django is not yet set up when the conftest is loaded
+        search.rebuild()  # The loaded objects are not indexed
+
+
+@pytest.fixture(autouse=True)
+def clear_resolution_caches():
+    """Clear the in-process resolution caches after each test to not leak cached objects across tests."""
+    yield
+    from debmonitor import resolution  # Imported here as Django is not yet set up when the conftest is loaded
+    resolution.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_django_cache():
+    """Clear the Django cache after each test to not serve the statistics cached by a previous test."""
+    yield
+    from django.core.cache import cache  # Imported here as Django is not yet set up when the conftest is loaded
+    cache.clear()
 
 
 @pytest.fixture()
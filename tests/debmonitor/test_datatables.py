@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from django.test import RequestFactory
+
+from debmonitor import datatables
+from hosts.models import Host, HostPackage
+
+
+COLUMNS = [
+    datatables.Column(lambda host: host.name, order_by=('name',), search='name'),
+    datatables.Column(lambda host: host.os.name, search='os__name'),
+    datatables.Column(lambda host: host.rows_count, order_by=('rows_count',)),
+]
+
+
+def _response(params):
+    """Return the parsed JSON response to a DataTables request with the given query parameters."""
+    request = RequestFactory().get('/hosts/', params)
+    response = datatables.response(request, Host.objects.all(), COLUMNS, annotations={
+        'rows_count': datatables.count_subquery(HostPackage.objects.all(), 'host')})
+    assert response.status_code == 200
+    return json.loads(response.content.decode())
+
+
+def test_is_request():
+    """Only the requests with the draw parameter should be DataTables server-side processing requests."""
+    assert datatables.is_request(RequestFactory().get('/hosts/', {'draw': '1'}))
+    assert not datatables.is_request(RequestFactory().get('/hosts/'))
+
+
+@pytest.mark.django_db
+def test_response_page():
+    """The requested page of the ordered rows should be returned with the counters."""
+    data = _response({'draw': '3', 'start': '1', 'length': '1', 'order[0][column]': '0', 'order[0][dir]': 'desc'})
+    names = list(Host.objects.order_by('-name').values_list('name', flat=True))
+
+    assert data['draw'] == 3
+    assert data['recordsTotal'] == len(names)
+    assert data['recordsFiltered'] == len(names)
+    assert [row[0] for row in data['data']] == names[1:2]
+
+
+@pytest.mark.django_db
+def test_response_order_annotation():
+    """Ordering by an annotated column should order by the annotation and return it in the rows."""
+    data = _response({'draw': '1', 'length': '-1', 'order[0][column]': '2', 'order[0][dir]': 'desc',
+                      'order[1][column]': '0', 'order[1][dir]': 'asc'})
+    expected = sorted(((host.packages.count(), host.name) for host in Host.objects.all()),
+                      key=lambda item: (-item[0], item[1]))
+
+    assert [(row[2], row[0]) for row in data['data']] == expected
+
+
+@pytest.mark.django_db
+def test_response_search():
+    """The global search should filter the rows on the searchable columns."""
+    data = _response({'draw': '1', 'search[value]': 'host2'})
+
+    assert data['recordsTotal'] == Host.objects.count()
+    assert data['recordsFiltered'] == 1
+    assert [row[0] for row in data['data']] == ['host2.example.com']
+
+
+@pytest.mark.django_db
+def test_response_invalid_parameters():
+    """The invalid parameters should be ignored."""
+    data = _response({'draw': 'a', 'start': '-5', 'length': 'b', 'order[0][column]': '10', 'order[1][column]': 'c'})
+
+    assert data['draw'] == 0
+    assert len(data['data']) == Host.objects.count()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('length', ('-1', '-10'))
+def test_response_negative_length(length, monkeypatch):
+    """The requests of all the rows should get the default page length."""
+    monkeypatch.setattr(datatables, 'DEFAULT_PAGE_LENGTH', 1)
+    data = _response({'draw': '1', 'length': length})
+
+    assert data['recordsTotal'] > 1
+    assert len(data['data']) == 1
+
+
+@pytest.mark.django_db
+def test_response_max_length(settings):
+    """The page length should be capped to the configured maximum."""
+    settings.DEBMONITOR_TABLES_MAX_PAGE_LENGTH = 1
+    data = _response({'draw': '1', 'length': '1000000'})
+
+    assert data['recordsTotal'] > 1
+    assert len(data['data']) == 1
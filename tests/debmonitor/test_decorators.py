@@ -1,6 +1,16 @@
+from unittest import mock
+
 import pytest
 
-from debmonitor import decorators
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse, HttpResponseNotFound
+from django.test import RequestFactory
+from django.utils import timezone
+
+from debmonitor import admission, decorators, generation
+from debmonitor.middleware import AuthHost, SSL_CLIENT_SUBJECT_DN_HEADER
 
 
 VALID_PARAMETERS = (
@@ -49,3 +59,235 @@ def test_verify_clients_params_ko(arg):
         assert 'Decorator verify_clients parameter must be a list or tuple' in str(e)
     else:
         raise AssertionError('The verify_clients decorator should have raised RuntimeError')
+
+
+@pytest.mark.parametrize('exc', (
+    OperationalError(1213, 'Deadlock found when trying to get lock; try restarting transaction'),
+    OperationalError('database is locked'),
+    IntegrityError('UNIQUE constraint failed: hosts_host.name'),
+    IntegrityError(1062, "Duplicate entry 'host1' for key 'name'"),
+))
+@pytest.mark.django_db(transaction=True)
+@mock.patch('debmonitor.decorators.time.sleep')
+def test_atomic_retry_transient(mocked_sleep, exc):
+    """The decorator should retry the function on transient database errors."""
+    func = mock.Mock(__name__='func', side_effect=[exc, 'result'])
+    assert decorators.atomic_retry(func)('arg') == 'result'
+    assert func.call_count == 2
+    func.assert_called_with('arg')
+    assert mocked_sleep.called
+
+
+@pytest.mark.django_db(transaction=True)
+@mock.patch('debmonitor.decorators.time.sleep')
+def test_atomic_retry_exhausted(mocked_sleep, settings):
+    """The decorator should re-raise the transient database errors after the configured attempts."""
+    settings.DEBMONITOR_UPDATE_RETRIES = 2
+    func = mock.Mock(__name__='func', side_effect=OperationalError(1205, 'Lock wait timeout exceeded'))
+    with pytest.raises(OperationalError, match='Lock wait timeout exceeded'):
+        decorators.atomic_retry(func)()
+
+    assert func.call_count == 2
+
+
+@pytest.mark.parametrize('exc', (
+    OperationalError('no such table: invalid'),
+    IntegrityError('NOT NULL constraint failed: hosts_host.os_id'),
+    IntegrityError(1048, "Column 'os_id' cannot be null"),
+))
+@pytest.mark.django_db(transaction=True)
+@mock.patch('debmonitor.decorators.time.sleep')
+def test_atomic_retry_not_transient(mocked_sleep, exc):
+    """The decorator should not retry the function on other database errors, including the persistent integrity ones."""
+    func = mock.Mock(__name__='func', side_effect=exc)
+    with pytest.raises(type(exc)):
+        decorators.atomic_retry(func)()
+
+    assert func.call_count == 1
+    assert not mocked_sleep.called
+
+
+def test_is_retryable_error_postgresql():
+    """Only the PostgreSQL duplicate key integrity errors should be retryable."""
+    for pgcode, expected in (('23505', True), ('23502', False)):
+        cause = Exception('error')
+        cause.pgcode = pgcode
+        exc = IntegrityError('error')
+        exc.__cause__ = cause
+        assert decorators.is_retryable_error(exc) is expected
+
+
+@pytest.mark.django_db
+def test_atomic_retry_in_transaction():
+    """The decorator should not retry the function when called from within a transaction."""
+    func = mock.Mock(__name__='func', side_effect=OperationalError('database is locked'))
+    with pytest.raises(OperationalError, match='database is locked'):
+        decorators.atomic_retry(func)()
+
+    assert func.call_count == 1
+
+
+@pytest.fixture()
+def admission_settings(settings):
+    """Reset the admission control counters and return the settings to configure it."""
+    cache.clear()
+    yield settings
+    cache.clear()
+
+
+@decorators.admission_control
+def admitted_view(request, name):
+    """Dummy update view."""
+    return HttpResponse('OK', status=201)
+
+
+def _post(name, cn=None):
+    """Call the dummy update view for the given name, optionally with a client certificate CN."""
+    headers = {}
+    if cn is not None:
+        headers[SSL_CLIENT_SUBJECT_DN_HEADER] = 'CN={cn},OU=debmonitor'.format(cn=cn)
+
+    return admitted_view(RequestFactory().post('/hosts/{name}/update'.format(name=name), **headers), name=name)
+
+
+def test_admission_control_disabled(admission_settings):
+    """Without configuration all the submissions should be admitted."""
+    for _ in range(20):
+        assert _post('host1').status_code == 201
+
+
+def test_admission_control_rate(admission_settings):
+    """Once the client bucket is empty its submissions should be rejected with a 429, not the other clients' ones."""
+    admission_settings.DEBMONITOR_ADMISSION_CONTROL = {'RATE': 0.5, 'BURST': 2}
+    assert _post('host1', cn='proxy1').status_code == 201
+    assert _post('host2', cn='proxy1').status_code == 201
+
+    response = _post('host3', cn='proxy1')
+    assert response.status_code == 429
+    assert response['Retry-After'] == '2'
+    assert "Too many update submissions from 'proxy1'" in response.content.decode()
+
+    assert _post('host1', cn='proxy2').status_code == 201
+    assert _post('host4').status_code == 201  # Identified by the name without certificate
+
+
+def test_admission_control_concurrency(admission_settings):
+    """The submissions exceeding the concurrency limit should be rejected with a 429 until a slot is released."""
+    admission_settings.DEBMONITOR_ADMISSION_CONTROL = {'MAX_CONCURRENT': 1, 'RETRY_AFTER': 3}
+    responses = []
+
+    @decorators.admission_control
+    def view(request, name):
+        responses.append(_post('host2'))  # Submitted while this one is still being processed
+        return HttpResponse('OK', status=201)
+
+    assert view(RequestFactory().post('/hosts/host1/update'), name='host1').status_code == 201
+    assert responses[0].status_code == 429
+    assert responses[0]['Retry-After'] == '3'
+    assert _post('host2').status_code == 201
+
+
+def test_admission_control_concurrency_expired(admission_settings):
+    """The in-flight counter expired while in flight should not go negative and allow more concurrent submissions."""
+    admission_settings.DEBMONITOR_ADMISSION_CONTROL = {'MAX_CONCURRENT': 1}
+    responses = []
+
+    @decorators.admission_control
+    def view(request, name):
+        cache.delete(admission.INFLIGHT_KEY)  # Expired while this one is still being processed
+        responses.append(_post('host2'))
+        return HttpResponse('OK', status=201)
+
+    assert view(RequestFactory().post('/hosts/host1/update'), name='host1').status_code == 201
+    assert responses[0].status_code == 201
+    assert admission.stats()['inflight'] == 0
+    assert cache.get(admission.INFLIGHT_KEY) == 0
+
+    with mock.patch.object(cache, 'touch', wraps=cache.touch) as mocked_touch:  # Refreshed at each acquired slot
+        assert _post('host3').status_code == 201
+
+    mocked_touch.assert_called_once_with(admission.INFLIGHT_KEY, timeout=admission.INFLIGHT_TIMEOUT)
+
+
+def _conditional_request(method='get', **headers):
+    """Return an anonymous request for the conditional_get() tests."""
+    request = getattr(RequestFactory(), method)('/hosts/host1', **headers)
+    request.user = AnonymousUser()
+    return request
+
+
+def test_conditional_get():
+    """The decorator should set the validators and answer the matching requests with a 304 without calling the view."""
+    modified = timezone.now()
+    view = mock.Mock(return_value=HttpResponse('page'))
+    decorated = decorators.conditional_get(lambda request: ('token', modified))(view)
+
+    response = decorated(_conditional_request())
+    assert response.status_code == 200
+    assert response['Last-Modified']
+    assert 'no-cache' in response['Cache-Control']
+    assert 'private' in response['Cache-Control']
+
+    not_modified = decorated(_conditional_request(HTTP_IF_NONE_MATCH=response['ETag']))
+    assert not_modified.status_code == 304
+    assert not_modified['ETag'] == response['ETag']
+    assert view.call_count == 1
+
+    modified_since = decorated(_conditional_request(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']))
+    assert modified_since.status_code == 304
+    assert view.call_count == 1
+
+
+def test_conditional_get_auth_host():
+    """The decorator should derive the ETag also for the hosts authenticated by their client certificate."""
+    view = mock.Mock(side_effect=lambda request: HttpResponse('page'))
+    decorated = decorators.conditional_get(lambda request: ('token', None))(view)
+    request = _conditional_request()
+    request.user = AuthHost('host1.example.com')
+    response = decorated(request)
+
+    assert response.status_code == 200
+    assert response['ETag'] != decorated(_conditional_request())['ETag']
+
+
+def test_conditional_get_changed():
+    """The decorator should call the view when the validators don't match anymore."""
+    tokens = iter(['token1', 'token2'])
+    view = mock.Mock(side_effect=lambda request: HttpResponse('page'))
+    decorated = decorators.conditional_get(lambda request: (next(tokens), None))(view)
+
+    response = decorated(_conditional_request())
+    assert 'Last-Modified' not in response
+
+    changed = decorated(_conditional_request(HTTP_IF_NONE_MATCH=response['ETag']))
+    assert changed.status_code == 200
+    assert changed['ETag'] != response['ETag']
+    assert view.call_count == 2
+
+
+@pytest.mark.parametrize('validators, view, method', (
+    (lambda request: None, HttpResponse, 'get'),
+    (lambda request: ('token', None), HttpResponseNotFound, 'get'),
+    (lambda request: ('token', None), HttpResponse, 'delete'),
+))
+def test_conditional_get_skipped(validators, view, method):
+    """The decorator should not set the validators without a token, for the errors and for the unsafe methods."""
+    response = decorators.conditional_get(validators)(lambda request: view())(_conditional_request(method))
+    assert 'ETag' not in response
+
+
+def test_inventory_validators(settings):
+    """The inventory validators should change with the generation of the inventory."""
+    cache.clear()
+    settings.DEBMONITOR_CONDITIONAL_GET = {'MAX_AGE': 60}
+    validators = decorators.inventory_validators(_conditional_request())
+    assert decorators.inventory_validators(_conditional_request()) == validators
+
+    generation._increment()
+    assert decorators.inventory_validators(_conditional_request()) != validators
+
+
+def test_inventory_validators_disabled(settings):
+    """The inventory validators should be disabled with a zero MAX_AGE."""
+    settings.DEBMONITOR_CONDITIONAL_GET = {'MAX_AGE': 0}
+    assert decorators.inventory_validators(_conditional_request()) is None
@@ -0,0 +1,55 @@
+from unittest import mock
+
+import pytest
+
+from django.core.cache import cache
+
+from debmonitor import generation
+
+
+def test_get_initializes():
+    """Getting the generation should initialize it when missing and return the same one afterwards."""
+    current = generation.get()
+    assert current > 0
+    assert generation.get() == current
+
+
+@pytest.mark.django_db
+def test_bump_after_commit(django_capture_on_commit_callbacks):
+    """Bumping the generation should increment it only once the transaction is committed."""
+    current = generation.get()
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        generation.bump()
+        assert generation.get() == current
+
+    assert len(callbacks) == 1
+    assert generation.get() == current + 1
+
+
+@pytest.mark.django_db
+def test_bump_missing(django_capture_on_commit_callbacks):
+    """Bumping the generation when missing from the cache should initialize it."""
+    with django_capture_on_commit_callbacks(execute=True):
+        generation.bump()
+
+    assert cache.get(generation.KEY) > 0
+
+
+def test_cached():
+    """The cached value should be returned until the generation changes."""
+    func = mock.Mock(side_effect=[1, 2])
+    assert generation.cached('key', 60, func) == 1
+    assert generation.cached('key', 60, func) == 1
+    assert func.call_count == 1
+
+    generation._increment()
+    assert generation.cached('key', 60, func) == 2
+    assert func.call_count == 2
+
+
+def test_cached_disabled():
+    """With a zero max age the value should be computed each time and not cached."""
+    func = mock.Mock(side_effect=[1, 2])
+    assert generation.cached('key', 0, func) == 1
+    assert generation.cached('key', 0, func) == 2
+    assert cache.get('key') is None
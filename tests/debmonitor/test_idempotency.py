@@ -0,0 +1,131 @@
+from unittest import mock
+
+import pytest
+
+from django import http
+from django.core.cache import cache
+from django.test import RequestFactory
+
+from debmonitor import idempotency
+
+
+KEY = idempotency.Key('key', 'digest')
+
+
+@pytest.fixture()
+def enabled(settings):
+    """Enable the deduplication of the update submissions with an empty cache."""
+    settings.DEBMONITOR_IDEMPOTENCY = {'TTL': 60, 'WAIT': 0}
+    cache.clear()
+    yield settings
+    cache.clear()
+
+
+def _request(key=None):
+    """Return a POST request, optionally with the Idempotency-Key header."""
+    headers = {}
+    if key is not None:
+        headers['HTTP_IDEMPOTENCY_KEY'] = key
+
+    return RequestFactory().post('/hosts/host1/update', **headers)
+
+
+def test_get_key_disabled():
+    """Without configuration no key should be returned."""
+    assert idempotency.get_key(_request('key1'), 'hosts', 'host1', {}) is None
+
+
+def test_get_key(enabled):
+    """The key should be taken from the header, scoped by object, or derived from the payload only if enabled."""
+    full = {'update_type': 'full', 'a': 1}
+    assert idempotency.get_key(_request('key1'), 'hosts', 'host1', {'a': 1}).cache_key == idempotency.get_key(
+        _request('key1'), 'hosts', 'host1', {'a': 2}).cache_key
+    assert idempotency.get_key(_request('key1'), 'hosts', 'host1', {'a': 1}).payload_digest != idempotency.get_key(
+        _request('key1'), 'hosts', 'host1', {'a': 2}).payload_digest
+    assert idempotency.get_key(_request('key1'), 'hosts', 'host1', {}) != idempotency.get_key(
+        _request('key1'), 'hosts', 'host2', {})
+    assert idempotency.get_key(_request(), 'hosts', 'host1', full) is None
+
+    enabled.DEBMONITOR_IDEMPOTENCY['DERIVE_KEY'] = True
+    assert idempotency.get_key(_request(), 'hosts', 'host1', full) == idempotency.get_key(
+        _request(), 'hosts', 'host1', dict(reversed(list(full.items()))))
+    assert idempotency.get_key(_request(), 'hosts', 'host1', full) != idempotency.get_key(
+        _request(), 'hosts', 'host1', dict(full, a=2))
+    assert idempotency.get_key(_request(), 'hosts', '', [full, full]) is not None
+
+
+@pytest.mark.parametrize('payload', (
+    {'update_type': 'partial'},
+    {'update_type': 'upgradable'},
+    {'a': 1},
+    [{'update_type': 'full'}, {'update_type': 'partial'}],
+    [],
+))
+def test_get_key_derived_not_full(enabled, payload):
+    """The key should not be derived from the payloads that are not all full updates."""
+    enabled.DEBMONITOR_IDEMPOTENCY['DERIVE_KEY'] = True
+    assert idempotency.get_key(_request(), 'hosts', 'host1', payload) is None
+
+
+def test_run_replay(enabled):
+    """A completed submission should be replayed from the cache without processing it again."""
+    def func():
+        response = http.HttpResponse(status=201)
+        response['ETag'] = '"etag"'
+        return response
+
+    mocked = mock.Mock(side_effect=func)
+    assert idempotency.run(KEY, mocked).status_code == 201
+    response = idempotency.run(KEY, mocked)
+
+    mocked.assert_called_once_with()
+    assert response.status_code == 201
+    assert response['ETag'] == '"etag"'
+    assert response[idempotency.REPLAYED_HEADER] == 'true'
+
+
+def test_run_different_payload(enabled):
+    """A completed submission should not be replayed for the same key with a different payload."""
+    mocked = mock.Mock(return_value=http.HttpResponse(status=201))
+    assert idempotency.run(KEY, mocked).status_code == 201
+    response = idempotency.run(KEY._replace(payload_digest='other'), mocked)
+
+    mocked.assert_called_once_with()
+    assert response.status_code == 422
+    assert 'already used for a different payload' in response.content.decode()
+
+
+def test_run_server_error_not_cached(enabled):
+    """A submission that failed with a server error should be processed again."""
+    mocked = mock.Mock(return_value=http.HttpResponseServerError())
+    idempotency.run(KEY, mocked)
+    idempotency.run(KEY, mocked)
+    assert mocked.call_count == 2
+
+
+def test_run_exception_not_cached(enabled):
+    """A submission that raised should be processed again."""
+    mocked = mock.Mock(side_effect=[RuntimeError('error'), http.HttpResponse(status=201)])
+    with pytest.raises(RuntimeError, match='error'):
+        idempotency.run(KEY, mocked)
+
+    assert idempotency.run(KEY, mocked).status_code == 201
+
+
+def test_run_in_progress(enabled):
+    """A submission still in progress in another request should return 409 Conflict once the wait expires."""
+    cache.set(KEY.cache_key, idempotency.IN_PROGRESS)
+    mocked = mock.Mock()
+    response = idempotency.run(KEY, mocked)
+
+    assert not mocked.called
+    assert response.status_code == 409
+    assert response['Retry-After'] == '0'
+
+
+def test_run_without_key():
+    """Without a key the submission should always be processed."""
+    mocked = mock.Mock(return_value=http.HttpResponse(status=201))
+    idempotency.run(None, mocked)
+    idempotency.run(None, mocked)
+    assert mocked.call_count == 2
@@ -0,0 +1,32 @@
+from debmonitor import manifest_digest
+
+
+PAYLOAD = {
+    'installed': [
+        {'name': 'package1', 'version': '1.0.0-1', 'source': 'package1'},
+        {'name': 'package2', 'version': '2.0.0-1', 'source': 'package2'},
+    ],
+    'upgradable': [
+        {'name': 'package1', 'version_from': '1.0.0-1', 'version_to': '1.0.0-2', 'source': 'package1', 'type': ''},
+    ],
+}
+
+
+def test_manifest_digest_order():
+    """The manifest digest should not depend on the order of the items and of their keys."""
+    reordered = {
+        'installed': [
+            {'source': 'package2', 'version': '2.0.0-1', 'name': 'package2'},
+            {'name': 'package1', 'version': '1.0.0-1', 'source': 'package1'},
+        ],
+        'upgradable': PAYLOAD['upgradable'],
+    }
+    assert manifest_digest('Debian 11', PAYLOAD) == manifest_digest('Debian 11', reordered)
+
+
+def test_manifest_digest_changes():
+    """The manifest digest should change if the OS or any package changes."""
+    changed = {'installed': PAYLOAD['installed'][:1], 'upgradable': PAYLOAD['upgradable']}
+    digest = manifest_digest('Debian 11', PAYLOAD)
+    assert digest != manifest_digest('Debian 12', PAYLOAD)
+    assert digest != manifest_digest('Debian 11', changed)
@@ -3,8 +3,11 @@ from io import StringIO
 import pytest
 
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.utils import timezone
 
+from bin_packages.models import DirtyPackage, PackageRollup
+from debmonitor import COUNTS_FIELDS, spool
 from hosts.models import Host, HostPackage
 from images.models import Image
 
@@ -29,6 +32,9 @@ def test_command_output_noop():
         message = 'Deleted 0 {obj} objects not referenced by any {ref_obj}'.format(obj=obj, ref_obj=ref_obj)
         assert message in out.getvalue()
 
+    assert 'Invalidated the resolution caches' in out.getvalue()
+    assert 'The Django cache is not shared' in out.getvalue()  # The tests use the local memory cache
+
 
 @pytest.mark.django_db
 def test_command_output_delete():
@@ -51,3 +57,68 @@ def test_command_output_delete():
         message = 'Deleted {num} {obj} objects not referenced by any {ref_obj}'.format(
             num=num, obj=obj, ref_obj=ref_obj)
         assert message in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_rebuild_command_noop():
+    """Calling the custom debmonitorrebuild command with consistent counters should not change them."""
+    out = StringIO()
+    call_command('debmonitorrebuild', stdout=out)
+
+    assert 'Fixed the packages counters of 0 Host objects' in out.getvalue()
+    assert 'Fixed the packages counters of 0 Image objects' in out.getvalue()
+    assert 'Refreshed the rollups of 6 Package and 4 SrcPackage objects' in out.getvalue()
+    assert 'Indexed 0 objects for the search' in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_rebuild_command_fix():
+    """Calling the custom debmonitorrebuild command with inconsistent counters should fix them."""
+    out = StringIO()
+    expected = list(Host.objects.order_by('pk').values_list(*COUNTS_FIELDS))
+    Host.objects.select_related(None).update(packages_count=0, upgrades_count=100, security_count=0)
+    call_command('debmonitorrebuild', '--batch-size', '2', stdout=out)
+
+    assert 'Fixed the packages counters of {count} Host objects'.format(count=len(expected)) in out.getvalue()
+    assert list(Host.objects.order_by('pk').values_list(*COUNTS_FIELDS)) == expected
+
+
+@pytest.mark.django_db
+def test_rebuild_command_dirty():
+    """Calling the custom debmonitorrebuild command with --dirty should refresh only the dirty rollups."""
+    out = StringIO()
+    DirtyPackage.objects.create(package_id=1)
+    call_command('debmonitorrebuild', '--dirty', stdout=out)
+
+    assert 'Refreshed the rollups of 1 Package and 0 SrcPackage objects' in out.getvalue()
+    assert 'packages counters' not in out.getvalue()
+    assert list(PackageRollup.objects.values_list('pk', flat=True)) == [1]
+
+
+@pytest.mark.django_db
+def test_worker_command_not_enabled(settings):
+    """Calling the custom debmonitorworker command without a spool configured should raise CommandError."""
+    settings.DEBMONITOR_SPOOL = {}
+    with pytest.raises(CommandError, match='SPOOL configuration is not set'):
+        call_command('debmonitorworker')
+
+
+@pytest.mark.django_db
+def test_worker_command_apply(settings, tmp_path):
+    """Calling the custom debmonitorworker command should apply the spooled submissions and empty the spool."""
+    settings.DEBMONITOR_SPOOL = {'PATH': str(tmp_path / 'spool.sqlite')}
+    queue = spool.Spool()
+    payload = {'update_type': 'full', 'os': 'Debian 11', 'hostname': 'host4.example.com',
+               'running_kernel': {'version': 'os1-100-1'},
+               'installed': [{'name': 'package1', 'version': '1.0.0-1', 'source': 'package1'}]}
+    queue.push('hosts', 'host4.example.com', payload)
+    payload['installed'].append({'name': 'package2', 'version': '2.0.0-1', 'source': 'package2'})
+    queue.push('hosts', 'host4.example.com', payload)
+    queue.push('hosts', 'host5.example.com', {'update_type': 'full', 'hostname': 'invalid'})
+
+    out = StringIO()
+    call_command('debmonitorworker', stdout=out)
+
+    assert 'Applied 1 spooled submissions' in out.getvalue()
+    assert HostPackage.objects.filter(host__name='host4.example.com').count() == 2
+    assert len(queue) == 0
@@ -0,0 +1,28 @@
+import importlib
+
+import pytest
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+from debmonitor.models import SearchTerm, SearchTrigram
+
+
+MIGRATION = ('debmonitor', '0002_populate_search')
+TERM_FIELDS = ('category', 'term', 'name', 'version', 'slug', 'os', 'host', 'image', 'package', 'src_package',
+               'kernel', 'package_version', 'src_package_version')
+
+
+@pytest.mark.django_db
+def test_migration_populate_search():
+    """The data migration should index all the already tracked objects like the search module does."""
+    expected_terms = set(SearchTerm.objects.values_list(*TERM_FIELDS))
+    expected_trigrams = set(SearchTrigram.objects.values_list('term__term', 'trigram'))
+    assert expected_terms
+    SearchTerm.objects.all().delete()
+
+    apps = MigrationExecutor(connection).loader.project_state(MIGRATION).apps
+    importlib.import_module('debmonitor.migrations.{name}'.format(name=MIGRATION[1])).forwards_func(apps, None)
+
+    assert set(SearchTerm.objects.values_list(*TERM_FIELDS)) == expected_terms
+    assert set(SearchTrigram.objects.values_list('term__term', 'trigram')) == expected_trigrams
@@ -0,0 +1,180 @@
+import gzip
+import json
+
+from unittest import mock
+
+import pytest
+
+from django.test import RequestFactory
+
+from debmonitor import payload
+
+
+BODY = b'{"key": "value"}'
+
+
+def _request(body, encoding=None):
+    """Return a POST request with the given body and Content-Encoding."""
+    extra = {}
+    if encoding is not None:
+        extra['HTTP_CONTENT_ENCODING'] = encoding
+
+    return RequestFactory().generic('POST', '/', body, content_type='application/json', **extra)
+
+
+@pytest.mark.parametrize('encoding', (None, '', 'identity'))
+def test_read_body_identity(encoding):
+    """Reading a not compressed body should return it as is."""
+    assert payload.read_body(_request(BODY, encoding)) == BODY
+
+
+def test_read_body_gzip():
+    """Reading a gzip compressed body should return it decompressed."""
+    assert payload.read_body(_request(gzip.compress(BODY), 'gzip')) == BODY
+
+
+def test_read_body_gzip_invalid():
+    """Reading an invalid gzip compressed body should raise PayloadError."""
+    with pytest.raises(payload.PayloadError, match='Unable to decompress gzip payload') as exc_info:
+        payload.read_body(_request(b'invalid', 'gzip'))
+
+    assert exc_info.value.status == 400
+
+
+def test_read_body_too_big(settings):
+    """Reading a compressed body bigger than the limit once decompressed should raise PayloadError."""
+    settings.DEBMONITOR_MAX_PAYLOAD_SIZE = 1024
+    with pytest.raises(payload.PayloadError, match='exceeds the maximum size of 1024 bytes') as exc_info:
+        payload.read_body(_request(gzip.compress(b'0' * 1025), 'gzip'))
+
+    assert exc_info.value.status == 413
+
+
+@mock.patch('debmonitor.payload.zstandard', None)
+def test_read_body_unsupported():
+    """Reading a body with an unsupported Content-Encoding should raise PayloadError."""
+    with pytest.raises(payload.PayloadError, match="Unsupported Content-Encoding 'zstd'") as exc_info:
+        payload.read_body(_request(BODY, 'zstd'))
+
+    assert exc_info.value.status == 415
+    assert payload.supported_encodings() == ['gzip']
+
+
+UPDATE = ('{"hostname": "höst", "running_kernel": {"version": "1"}, "count": 12345, "installed": ['
+          '{"name": "pkg1", "version": "1.0", "source": "src1"}, '
+          '{"source": "src2", "version": "2.0", "name": "pkg2"}], '
+          '"uninstalled": [{"name": "pkg3"}], "upgradable": [{"name": "pkg1", "version_from": "1.0", '
+          '"version_to": "1.1", "source": "src1", "type": "security"}]}')
+
+
+@pytest.mark.parametrize('chunk_size', (1, 7, payload.CHUNK_SIZE))
+def test_parse_update(chunk_size):
+    """Parsing an update payload in chunks of any size should return the compact items."""
+    with mock.patch('debmonitor.payload.CHUNK_SIZE', chunk_size):
+        parsed = payload.parse_update(_request(UPDATE.encode('utf-8')))
+
+    assert parsed['hostname'] == 'höst'
+    assert parsed['running_kernel'] == {'version': '1'}
+    assert parsed['count'] == 12345
+    assert parsed['installed'] == [payload.InstalledItem('pkg1', '1.0', 'src1'),
+                                   payload.InstalledItem('pkg2', '2.0', 'src2')]
+    assert parsed['uninstalled'] == [payload.UninstalledItem('pkg3')]
+    assert parsed['upgradable'] == [payload.UpgradableItem('pkg1', '1.0', '1.1', 'src1', 'security')]
+    assert parsed == payload.compact_payload(json.loads(UPDATE))
+
+
+def test_parse_update_gzip():
+    """Parsing a gzip compressed update payload should return the compact items."""
+    parsed = payload.parse_update(_request(gzip.compress(UPDATE.encode('utf-8')), 'gzip'))
+    assert parsed['installed'][1].name == 'pkg2'
+
+
+@pytest.mark.parametrize('body, message', (
+    ('', 'Empty POST'),
+    ('invalid', "Expecting one of '{' at char 0"),
+    ('{"installed": {}}', "Expecting a list for 'installed'"),
+    ('{"installed": [{"name": "pkg1", "version": "1.0", "source": "src1"}, {"name": "pkg2", "version": "2.0"}]}',
+     "Invalid item 1 of 'installed': missing or invalid 'source'"),
+    ('{"upgradable": ["pkg1"]}', "Invalid item 0 of 'upgradable': expected an object"),
+    ('{"hostname": "host1"', "Expecting one of ',', '}' at char 20"),
+    ('{"hostname": "host1"} {}', 'Extra data at char 22'),
+    ('{"hostname": "host1}', 'Unterminated string'),
+    ('{hostname: "host1"}', 'Expecting property name enclosed in double quotes at char 1'),
+))
+def test_parse_update_invalid(body, message):
+    """Parsing an invalid update payload should raise PayloadError with the position or index of the error."""
+    with mock.patch('debmonitor.payload.CHUNK_SIZE', 4):
+        with pytest.raises(payload.PayloadError, match=message):
+            payload.parse_update(_request(body.encode('utf-8')))
+
+
+def test_parse_update_invalid_utf8():
+    """Parsing an update payload that is not valid UTF-8 should raise PayloadError."""
+    with pytest.raises(payload.PayloadError, match='Unable to decode UTF-8 payload'):
+        payload.parse_update(_request(b'{"hostname": "\xff"}'))
+
+
+def test_compact_item_list():
+    """Compacting an item already in its list form should fill the optional fields."""
+    assert payload.compact_item('upgradable', 0, ['pkg1', '1.0', '1.1', 'src1']) == payload.UpgradableItem(
+        'pkg1', '1.0', '1.1', 'src1', '')
+
+
+def test_compact_payload_invalid():
+    """Compacting a payload with a packages list that is not a list should raise PayloadError."""
+    with pytest.raises(payload.PayloadError, match="Invalid 'installed': expected a list"):
+        payload.compact_payload({'installed': None})
+
+
+UPDATE_V2 = ('{"api_version": "v2", "hostname": "host1", "strings": ["pkg1", "1.0", "src1", "1.1", "security"], '
+             '"installed": [[0, 1, 2]], "upgradable": [[0, 1, 3, 2, 4], [0, 1, 3, 2]]}')
+
+
+@pytest.mark.parametrize('chunk_size', (1, payload.CHUNK_SIZE))
+def test_parse_update_v2(chunk_size):
+    """Parsing a compact v2 update payload should expand the interned strings into the compact items."""
+    with mock.patch('debmonitor.payload.CHUNK_SIZE', chunk_size):
+        parsed = payload.parse_update(_request(UPDATE_V2.encode('utf-8')))
+
+    assert parsed == {
+        'api_version': 'v2',
+        'hostname': 'host1',
+        'installed': [payload.InstalledItem('pkg1', '1.0', 'src1')],
+        'upgradable': [payload.UpgradableItem('pkg1', '1.0', '1.1', 'src1', 'security'),
+                       payload.UpgradableItem('pkg1', '1.0', '1.1', 'src1', '')],
+    }
+
+
+@pytest.mark.parametrize('body, message', (
+    ('{"api_version": "v3"}', "Unsupported API version 'v3', supported values are: v1, v2"),
+    ('{"installed": [], "api_version": "v2"}', "The 'api_version' key must precede the packages lists"),
+    ('{"api_version": "v2", "installed": []}', "The 'strings' key must precede the packages lists"),
+    ('{"api_version": "v2", "strings": [1], "installed": []}', "Invalid 'strings': expected a list of strings"),
+    ('{"api_version": "v2", "strings": ["a"], "installed": [[0, 0, 1]]}',
+     "Invalid item 0 of 'installed': string index out of range"),
+    ('{"api_version": "v2", "strings": ["a"], "installed": [[0, 0, -1]]}',
+     "Invalid item 0 of 'installed': missing or invalid 'source'"),
+    ('{"api_version": "v2", "strings": ["a"], "installed": [{"name": "a"}]}',
+     "Invalid item 0 of 'installed': expected a list"),
+))
+def test_parse_update_v2_invalid(body, message):
+    """Parsing an invalid compact v2 update payload should raise PayloadError."""
+    with pytest.raises(payload.PayloadError, match=message):
+        payload.parse_update(_request(body.encode('utf-8')))
+
+
+def test_parse_batch_update():
+    """Parsing a batch update payload should return the parsed single payloads, ignoring the other keys."""
+    body = '{{"other": [1], "hosts": [{update}, {v2}]}}'.format(update=UPDATE, v2=UPDATE_V2)
+    with mock.patch('debmonitor.payload.CHUNK_SIZE', 7):
+        parsed = payload.parse_batch_update(_request(body.encode('utf-8')), 'hosts')
+
+    assert parsed == [payload.parse_update(_request(UPDATE.encode('utf-8'))),
+                      payload.parse_update(_request(UPDATE_V2.encode('utf-8')))]
+
+
+def test_parse_batch_update_invalid():
+    """Parsing a batch update payload with an invalid single payload should raise PayloadError with its index."""
+    body = '{{"hosts": [{update}, {{"installed": [{{"name": "pkg1"}}]}}]}}'.format(update=UPDATE)
+    with pytest.raises(payload.PayloadError, match="Invalid item 1 of 'hosts': Invalid item 0 of 'installed'"):
+        payload.parse_batch_update(_request(body.encode('utf-8')), 'hosts')
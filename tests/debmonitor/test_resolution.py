@@ -0,0 +1,125 @@
+import pytest
+
+from django.core.cache import cache as django_cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from bin_packages.models import PackageVersion
+from debmonitor import resolution
+from src_packages.models import OS
+
+
+@pytest.fixture()
+def shared_cache(settings):
+    """Enable the sharing of the resolution caches via the Django cache."""
+    settings.DEBMONITOR_RESOLUTION_CACHE = {'SHARED': True}
+    django_cache.clear()
+    yield
+    django_cache.clear()
+
+
+@pytest.mark.django_db
+def test_cache_set_on_commit(django_capture_on_commit_callbacks):
+    """The objects should be cached only once the transaction is committed and counted as hits and misses."""
+    cache = resolution.ResolutionCache('test')
+    with django_capture_on_commit_callbacks() as callbacks:
+        cache.set_many({'key1': 'value1', 'key2': 'value2'})
+        assert cache.get('key1') is None
+
+    for callback in callbacks:
+        callback()
+
+    assert cache.get_many(['key1', 'key2', 'key3']) == {'key1': 'value1', 'key2': 'value2'}
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'size': 2}
+
+
+@pytest.mark.django_db
+def test_cache_lru_eviction(settings, django_capture_on_commit_callbacks):
+    """The least recently used objects should be evicted when the cache is full."""
+    settings.DEBMONITOR_RESOLUTION_CACHE = {'SIZE': 2}
+    cache = resolution.ResolutionCache('test')
+    with django_capture_on_commit_callbacks(execute=True):
+        cache.set_many({'key1': 'value1', 'key2': 'value2'})
+
+    assert cache.get('key1') == 'value1'  # Make key2 the least recently used one
+    with django_capture_on_commit_callbacks(execute=True):
+        cache.set('key3', 'value3')
+
+    assert cache.get_many(['key1', 'key2', 'key3']) == {'key1': 'value1', 'key3': 'value3'}
+
+
+@pytest.mark.django_db
+def test_cache_disabled(settings, django_capture_on_commit_callbacks):
+    """Setting the cache size to zero should disable the cache."""
+    settings.DEBMONITOR_RESOLUTION_CACHE = {'SIZE': 0}
+    cache = resolution.ResolutionCache('test')
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        cache.set('key1', 'value1')
+
+    assert not callbacks
+    assert cache.get('key1') is None
+
+
+@pytest.mark.django_db
+def test_cache_shared(shared_cache, django_capture_on_commit_callbacks):
+    """The objects cached by a process should be found by the others until invalidated."""
+    with django_capture_on_commit_callbacks(execute=True):
+        resolution.ResolutionCache('test').set('key1', 'value1')
+
+    other = resolution.ResolutionCache('test')
+    assert other.get('key1') == 'value1'
+
+    resolution.invalidate()
+    assert other.get('key1') is None
+    assert resolution.ResolutionCache('test').get('key1') is None
+
+
+@pytest.mark.django_db
+def test_cache_invalidated_not_shared(django_capture_on_commit_callbacks):
+    """The objects cached by another process should not be found once invalidated, also without sharing them."""
+    other = resolution.ResolutionCache('test')  # Not registered, like the caches of another process
+    with django_capture_on_commit_callbacks(execute=True):
+        other.set('key1', 'value1')
+
+    assert other.get('key1') == 'value1'
+    resolution.invalidate()
+    assert other.get('key1') is None
+
+
+@pytest.mark.django_db
+def test_cache_invalidated_before_commit(django_capture_on_commit_callbacks):
+    """The objects resolved before an invalidation should not be cached when their transaction is committed."""
+    cache = resolution.ResolutionCache('test')
+    with django_capture_on_commit_callbacks(execute=True):
+        cache.set('key1', 'value1')
+        resolution.invalidate()
+
+    assert cache.get('key1') is None
+
+
+@pytest.mark.django_db
+def test_get_or_create_many_cached(django_capture_on_commit_callbacks):
+    """Resolving again the same package versions after the commit should not perform any query."""
+    os = OS.objects.get(name='Debian 11')
+    items = [('package1', 'package1', '1.0.0-1'), ('package-new', 'package-new', '1.0.0-1')]
+    with django_capture_on_commit_callbacks(execute=True):
+        resolved = PackageVersion.objects.get_or_create_many(os, items)
+
+    hits = resolution.stats()['package_versions']['hits']
+    with CaptureQueriesContext(connection) as context:
+        cached = PackageVersion.objects.get_or_create_many(os, items)
+
+    assert not context.captured_queries
+    assert {key: obj.pk for key, obj in cached.items()} == {key: obj.pk for key, obj in resolved.items()}
+    assert resolution.stats()['package_versions']['hits'] == hits + 2
+
+
+@pytest.mark.django_db
+def test_invalidate_clears_local_caches(django_capture_on_commit_callbacks):
+    """Invalidating the resolution caches should clear all the in-process ones."""
+    with django_capture_on_commit_callbacks(execute=True):
+        resolution.get_cache('test').set('key1', 'value1')
+
+    resolution.invalidate()
+    assert resolution.get_cache('test').get('key1') is None
+    assert resolution.stats()['test']['size'] == 0
@@ -0,0 +1,148 @@
+import json
+import uuid
+
+from unittest.mock import patch
+
+import pytest
+
+from bin_packages.models import DirtyPackage, Package, PackageRollup
+from debmonitor import rollups, search
+from debmonitor.models import SearchTerm
+from hosts.models import HostPackage
+from images.models import ImagePackage
+from src_packages.models import DirtySrcPackage, SrcPackage, SrcPackageRollup
+from tests.conftest import HOSTNAME
+
+
+def _expected_rollup(package):
+    """Return a tuple with the expected rollup values of the given binary package."""
+    versions = package.versions.all()
+    host_packages = HostPackage.objects.filter(package=package)
+    image_packages = ImagePackage.objects.filter(package=package)
+    return (
+        versions.count(), ', '.join(sorted({version.os.name for version in versions})),
+        host_packages.count(), host_packages.filter(upgradable_package__isnull=False).count(),
+        host_packages.filter(upgrade_type='security').count(),
+        image_packages.count(), image_packages.filter(upgradable_imagepackage__isnull=False).count(),
+        image_packages.filter(upgrade_type='security').count(),
+    )
+
+
+def _rollup(package):
+    """Return a tuple with the stored rollup values of the given binary package."""
+    rollup = PackageRollup.objects.get(package=package)
+    return (rollup.versions_count, rollup.os_list, rollup.hosts_count, rollup.hosts_upgrades_count,
+            rollup.hosts_security_count, rollup.images_count, rollup.images_upgrades_count,
+            rollup.images_security_count)
+
+
+@pytest.mark.django_db
+def test_rebuild():
+    """Rebuilding the rollups should compute them for all the packages and clear the dirty sets."""
+    DirtyPackage.objects.bulk_create([DirtyPackage(package=package) for package in Package.objects.all()])
+
+    assert rollups.rebuild(batch_size=2) == (Package.objects.count(), SrcPackage.objects.count())
+    assert not DirtyPackage.objects.exists()
+    assert not DirtySrcPackage.objects.exists()
+    for package in Package.objects.all():
+        assert _rollup(package) == _expected_rollup(package)
+
+    for src_package in SrcPackage.objects.all():
+        rollup = SrcPackageRollup.objects.get(src_package=src_package)
+        assert rollup.versions_count == src_package.versions.count()
+        assert rollup.os_list == ', '.join(sorted({version.os.name for version in src_package.versions.all()}))
+
+
+@pytest.mark.django_db
+def test_refresh_dirty_after_update(client, django_capture_on_commit_callbacks):
+    """The packages modified by an update should be marked as dirty and their rollups refreshed."""
+    rollups.rebuild()
+    rand = str(uuid.uuid4())
+    payload = {
+        'api_version': 'v1', 'hostname': HOSTNAME, 'running_kernel': {'release': '4.9.0-6', 'version': '1.0.0-1'},
+        'os': 'Debian 11', 'update_type': 'installed',
+        'installed': [{'name': 'package2', 'version': '2.0.0-3', 'source': 'package2'},
+                      {'name': 'pkg-' + rand, 'version': '1.0.0-1', 'source': 'pkg-' + rand}]}
+    with patch('debmonitor.rollups.refresh_on_commit'):  # Leave them dirty
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.generic('POST', '/hosts/{host}/update'.format(host=HOSTNAME), json.dumps(payload))
+
+    assert response.status_code == 201
+    new_package = Package.objects.get(name='pkg-' + rand)
+    assert set(DirtyPackage.objects.values_list('pk', flat=True)) == {Package.objects.get(name='package2').pk,
+                                                                      new_package.pk}
+    assert DirtySrcPackage.objects.count() == 2
+
+    assert rollups.refresh_dirty() == (2, 2)
+    assert not DirtyPackage.objects.exists()
+    for package in Package.objects.all():
+        assert _rollup(package) == _expected_rollup(package)
+
+    assert SrcPackageRollup.objects.get(src_package__name='pkg-' + rand).versions_count == 1
+
+
+@pytest.mark.django_db
+def test_refresh_on_commit_after_update(client, django_capture_on_commit_callbacks):
+    """A synchronous update should refresh the rollups and the search index of the packages it modifies."""
+    rollups.rebuild()
+    rand = str(uuid.uuid4())
+    payload = {
+        'api_version': 'v1', 'hostname': HOSTNAME, 'running_kernel': {'release': '4.9.0-6', 'version': '1.0.0-1'},
+        'os': 'Debian 11', 'update_type': 'installed',
+        'installed': [{'name': 'pkg-' + rand, 'version': '1.0.0-1', 'source': 'pkg-' + rand}]}
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.generic('POST', '/hosts/{host}/update'.format(host=HOSTNAME), json.dumps(payload))
+
+    assert response.status_code == 201
+    assert not DirtyPackage.objects.exists()
+    assert not DirtySrcPackage.objects.exists()
+    new_package = Package.objects.get(name='pkg-' + rand)
+    assert _rollup(new_package) == _expected_rollup(new_package) == (1, 'Debian 11', 1, 0, 0, 0, 0, 0)
+    assert [result['name'] for result in search.search(rand, 10)[SearchTerm.PACKAGE]] == ['pkg-' + rand]
+
+
+@pytest.mark.django_db
+def test_refresh_on_commit_bounded(django_capture_on_commit_callbacks):
+    """The refresh after the commit should refresh at most one batch of each dirty set."""
+    DirtyPackage.objects.bulk_create([DirtyPackage(package=package) for package in Package.objects.all()])
+    with django_capture_on_commit_callbacks(execute=True):
+        rollups.refresh_on_commit(batch_size=1)
+
+    assert DirtyPackage.objects.count() == Package.objects.count() - 1
+    assert rollups.refresh_dirty(batch_size=1, max_batches=2) == (2, 0)
+    assert DirtyPackage.objects.count() == Package.objects.count() - 3
+
+
+@pytest.mark.django_db
+@patch('debmonitor.rollups.refresh_packages', side_effect=RuntimeError('error'))
+def test_refresh_on_commit_failure(mocked_refresh_packages, caplog, django_capture_on_commit_callbacks):
+    """If the refresh after the commit fails it should be logged without failing the already committed request."""
+    DirtyPackage.objects.create(package_id=1)
+    with django_capture_on_commit_callbacks(execute=True):
+        rollups.refresh_on_commit()
+
+    assert 'Unable to refresh the rollups of the dirty packages' in caplog.text
+    mocked_refresh_packages.assert_called_once_with([1])
+
+
+@pytest.mark.django_db
+def test_refresh_packages_deleted():
+    """The packages deleted in the meanwhile should be skipped."""
+    package = Package.objects.create(name='deleted')
+    package_pk = package.pk
+    package.delete()
+
+    rollups.refresh_packages([package_pk, 1])
+    assert list(PackageRollup.objects.values_list('pk', flat=True)) == [1]
+
+
+@pytest.mark.django_db
+@patch('debmonitor.rollups.refresh_packages', side_effect=RuntimeError('error'))
+def test_refresh_dirty_failure(mocked_refresh_packages, django_capture_on_commit_callbacks):
+    """If the refresh fails the claimed packages should be marked again as dirty."""
+    DirtyPackage.objects.create(package_id=1)
+    with pytest.raises(RuntimeError, match='error'):
+        with django_capture_on_commit_callbacks(execute=True):
+            rollups.refresh_dirty()
+
+    assert list(DirtyPackage.objects.values_list('pk', flat=True)) == [1]
@@ -0,0 +1,111 @@
+import pytest
+
+from django.db import connection
+
+from bin_packages.models import Package, PackageVersion
+from debmonitor import rollups, search
+from debmonitor.models import SearchTerm, SearchTrigram
+from src_packages.models import OS
+
+
+def _names(results, category):
+    """Return the names of the results of the given category."""
+    return [result['name'] for result in results[category]]
+
+
+def test_trigrams():
+    """The trigrams should be lowercase and unique, none for the strings shorter than three characters."""
+    assert search.trigrams('AbcAbc') == {'abc', 'bca', 'cab'}
+    assert search.trigrams('ab') == set()
+
+
+@pytest.mark.django_db
+def test_rebuild_noop():
+    """Rebuilding the index with all the objects already indexed should not index any object."""
+    assert search.rebuild() == 0
+
+
+@pytest.mark.django_db
+def test_search_ranking():
+    """The exact matches should be ranked first, then the prefix matches and then the other substring matches."""
+    search.add([Package.objects.create(name='libpackage3')])
+    results = search.search('Package3', 10)
+
+    assert _names(results, SearchTerm.PACKAGE) == ['package3', 'package3-dev', 'libpackage3']
+    assert _names(results, SearchTerm.SRC_PACKAGE) == ['package3']
+    assert results[SearchTerm.HOST] == []
+
+
+@pytest.mark.django_db
+def test_search_no_false_positives():
+    """The terms that have all the trigrams of the query but not the query itself should not match."""
+    search.add([Package.objects.create(name='abc-bca-cab')])
+    assert search.search('abcab', 10)[SearchTerm.PACKAGE] == []
+    assert _names(search.search('bca-cab', 10), SearchTerm.PACKAGE) == ['abc-bca-cab']
+
+
+@pytest.mark.django_db
+def test_search_short_query():
+    """The queries shorter than a trigram should be searched without the trigrams."""
+    results = search.search('-d', 10)
+    assert _names(results, SearchTerm.PACKAGE) == ['package3-dev']
+
+
+@pytest.mark.django_db
+def test_search_versions_and_kernels():
+    """The versions should be searched by version and the kernels by name, with the fields to link them."""
+    results = search.search('1.2.3', 10)
+    assert {(result['name'], result['version'], result['os_name']) for result in results[SearchTerm.PACKAGE_VERSION]
+            } == {('nodejs', '1.2.3-4', 'Debian 11'), ('nodejs', '1.2.3-5', 'Debian 11')}
+
+    kernel = search.search('os1-100', 10)[SearchTerm.KERNEL][0]
+    assert (kernel['slug'], kernel['os_id']) == ('os1-100-1', 1)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('supports_over_clause', (True, False))
+def test_search_limit(monkeypatch, supports_over_clause):
+    """The results of each category should be capped to the limit plus one, with or without window functions."""
+    monkeypatch.setattr(connection.features, 'supports_over_clause', supports_over_clause)
+    results = search.search('package', 2)
+
+    assert _names(results, SearchTerm.PACKAGE) == ['package1', 'package2', 'package3']
+    assert _names(results, SearchTerm.SRC_PACKAGE) == ['package1', 'package2', 'package3']
+
+
+@pytest.mark.django_db
+def test_search_category_offset():
+    """Searching a single category should return only its results, skipping the given offset."""
+    results = search.search('package', 2, category=SearchTerm.PACKAGE, offset=2)
+
+    assert _names(results, SearchTerm.PACKAGE) == ['package3', 'package3-dev']
+    assert results[SearchTerm.SRC_PACKAGE] == []
+
+
+@pytest.mark.django_db
+def test_index_deleted():
+    """Deleting an indexed object should delete its term and trigrams."""
+    package = Package.objects.create(name='new-package')
+    search.add([package])
+    term = SearchTerm.objects.get(package=package)
+    assert SearchTrigram.objects.filter(term=term).count() == len(search.trigrams('new-package'))
+
+    package.delete()
+    assert not SearchTerm.objects.filter(pk=term.pk).exists()
+    assert not SearchTrigram.objects.filter(term_id=term.pk).exists()
+
+
+@pytest.mark.django_db
+def test_index_refresh_dirty(django_capture_on_commit_callbacks):
+    """The new packages and versions should be indexed along with the refresh of their rollups."""
+    os = OS.objects.get(name='Debian 11')
+    with django_capture_on_commit_callbacks(execute=True):
+        PackageVersion.objects.get_or_create_many(os, [('new-package', 'new-source', '7.7.7-1')])
+
+    assert search.search('new-package', 10)[SearchTerm.PACKAGE] == []
+
+    rollups.refresh_dirty()
+    results = search.search('new-', 10)
+    assert _names(results, SearchTerm.PACKAGE) == ['new-package']
+    assert _names(results, SearchTerm.SRC_PACKAGE) == ['new-source']
+    assert _names(search.search('7.7.7', 10), SearchTerm.PACKAGE_VERSION) == ['new-package']
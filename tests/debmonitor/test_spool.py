@@ -0,0 +1,71 @@
+import prometheus_client
+
+from debmonitor import spool
+
+
+def _entry(entry_id, name, update_type, kind='hosts'):
+    """Return a SpoolEntry object with a dummy payload."""
+    return spool.SpoolEntry(entry_id, kind, name, update_type, '{}', 0)
+
+
+def test_coalesce():
+    """Coalescing should keep only the newest full update and the following ones for each object."""
+    entries = [
+        _entry(1, 'host1', 'full'),
+        _entry(2, 'host2', 'upgradable'),
+        _entry(3, 'host1', 'partial'),
+        _entry(4, 'host1', 'full'),
+        _entry(5, 'host2', 'partial'),
+        _entry(6, 'host1', 'upgradable'),
+        _entry(7, 'host1', 'full', kind='images'),
+    ]
+    groups, superseded = spool.coalesce(entries)
+
+    assert superseded == [1, 3]
+    assert list(groups.keys()) == [('hosts', 'host1'), ('hosts', 'host2'), ('images', 'host1')]
+    assert [entry.id for entry in groups[('hosts', 'host1')]] == [4, 6]
+    assert [entry.id for entry in groups[('hosts', 'host2')]] == [2, 5]
+    assert [entry.id for entry in groups[('images', 'host1')]] == [7]
+
+
+def test_spool(tmp_path):
+    """The spool should store the submissions and return them coalesced, deleting the superseded ones."""
+    queue = spool.Spool(str(tmp_path / 'spool.sqlite'))
+    queue.push('hosts', 'host1', {'update_type': 'partial'})
+    queue.push('hosts', 'host1', {'update_type': 'full'})
+    queue.push('hosts', 'host2', {'update_type': 'full'})
+    assert len(queue) == 3
+
+    groups = queue.pop_batch(10, 3)
+    assert len(queue) == 2
+    assert [entry.id for entry in groups[('hosts', 'host1')]] == [2]
+    assert groups[('hosts', 'host2')][0].payload == '{"update_type": "full"}'
+
+    queue.delete([2])
+    assert len(queue) == 1
+
+
+def test_spool_failed(tmp_path, caplog):
+    """The spool should discard, log and count the submissions that failed too many times."""
+    def discarded():
+        return prometheus_client.REGISTRY.get_sample_value('debmonitor_spool_discarded_total', {'kind': 'hosts'}) or 0
+
+    before = discarded()
+    queue = spool.Spool(str(tmp_path / 'spool.sqlite'))
+    queue.push('hosts', 'host1', {'update_type': 'full'})
+    queue.failed(1)
+    assert queue.pop_batch(10, 2)[('hosts', 'host1')][0].attempts == 1
+
+    queue.failed(1)
+    assert not queue.pop_batch(10, 2)
+    assert len(queue) == 0
+    assert "Discarded spooled full submission 1 for hosts 'host1' after 2 failed attempts" in caplog.text
+    assert discarded() == before + 1
+
+
+def test_is_enabled(settings, tmp_path):
+    """The spool should be enabled only if its path is configured."""
+    settings.DEBMONITOR_SPOOL = {}
+    assert not spool.is_enabled()
+    settings.DEBMONITOR_SPOOL = {'PATH': str(tmp_path / 'spool.sqlite')}
+    assert spool.is_enabled()
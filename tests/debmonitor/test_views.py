@@ -1,8 +1,11 @@
 import pytest
 
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import resolve, reverse
 
-from debmonitor import views
+from debmonitor import generation, resolution, views
 from tests.conftest import setup_auth_settings, validate_status_code
 
 INDEX_URL = '/'
@@ -23,6 +26,33 @@ def test_index_status_code(client, settings, require_login, verify_clients):
     validate_status_code(response, require_login)
 
 
+@pytest.mark.django_db
+def test_index_cached(client, django_assert_num_queries, django_capture_on_commit_callbacks):
+    """Requesting the homepage again should serve the cached statistics until the inventory changes."""
+    response = client.get(INDEX_URL)
+    assert response.status_code == 200
+    with django_assert_num_queries(0):
+        cached = client.get(INDEX_URL)
+
+    assert cached.context['totals'] == response.context['totals']
+
+    with django_capture_on_commit_callbacks(execute=True):
+        generation.bump()
+
+    with CaptureQueriesContext(connection) as context:
+        client.get(INDEX_URL)
+
+    assert len(context.captured_queries) > 0
+
+
+@pytest.mark.django_db
+def test_index_cache_disabled(client, settings):
+    """With a zero MAX_AGE the homepage statistics should be computed at each request."""
+    settings.DEBMONITOR_STATISTICS_CACHE = {'MAX_AGE': 0}
+    client.get(INDEX_URL)
+    assert cache.get(views.STATISTICS_KEY) is None
+
+
 def test_index_view_function():
     """Resolving the URL for the homepage should return the correct view."""
     view = resolve(INDEX_URL)
@@ -69,6 +99,30 @@ def test_search_valid(client, settings, require_login, verify_clients):
         assert 'href="/packages/package1"' in response.content.decode('utf-8')
 
 
+@pytest.mark.django_db
+def test_search_paginated(client, settings):
+    """The results of each category should be capped to the page size with the links to the other pages."""
+    settings.DEBMONITOR_SEARCH_PAGE_SIZE = 2
+    content = client.get(SEARCH_URL, {'q': 'package'}).content.decode('utf-8')
+    assert 'href="/packages/package2"' in content
+    assert 'href="/packages/package3"' not in content
+    assert '?q=package&amp;category=3&amp;page=2' in content
+
+    content = client.get(SEARCH_URL, {'q': 'package', 'category': '3', 'page': '2'}).content.decode('utf-8')
+    assert 'href="/packages/package3"' in content
+    assert 'href="/packages/package1"' not in content
+    assert '?q=package&amp;category=3&amp;page=1' in content
+    assert 'href="/source-packages/package1"' not in content
+
+
+@pytest.mark.django_db
+def test_search_invalid_category(client):
+    """An invalid category should search all the categories."""
+    response = client.get(SEARCH_URL, {'q': 'package', 'category': 'invalid'})
+    assert response.status_code == 200
+    assert 'href="/source-packages/package1"' in response.content.decode('utf-8')
+
+
 def test_auth_check(client, settings, require_login, verify_clients):
     """Requesting the auth-check endpoint should return OK if authenticated."""
     setup_auth_settings(settings, require_login, verify_clients)
@@ -76,3 +130,51 @@ def test_auth_check(client, settings, require_login, verify_clients):
     validate_status_code(response, require_login, verify_clients=verify_clients)
     if not require_login and not verify_clients:
         assert response.content.decode().strip() == "OK"
+
+
+@pytest.mark.django_db
+def test_metrics(client, settings, require_login, verify_clients):
+    """Requesting the metrics endpoint should return the metrics of the previous requests if authenticated."""
+    setup_auth_settings(settings, require_login, verify_clients)
+    client.get(INDEX_URL)
+    response = client.get('/metrics')
+    validate_status_code(response, require_login, verify_clients=verify_clients)
+    if not require_login and not verify_clients:
+        content = response.content.decode()
+        assert 'debmonitor_request_duration_seconds_count{method="GET",status="200",view="index"}' in content
+        assert 'debmonitor_request_db_queries_count{view="index"}' in content
+
+
+@pytest.mark.django_db
+def test_metrics_unknown_method(client):
+    """The requests with a non-standard method should be labeled with the 'other' method."""
+    client.generic('FOOBAR', INDEX_URL)
+    content = client.get('/metrics').content.decode()
+    assert 'debmonitor_request_duration_seconds_count{method="other",status="405",view="index"}' in content
+    assert 'method="FOOBAR"' not in content
+
+
+@pytest.mark.django_db
+def test_metrics_resolution_caches(client, django_capture_on_commit_callbacks):
+    """The metrics endpoint should export the hits, misses and size of the resolution caches."""
+    cache = resolution.get_cache('test_metrics')
+    with django_capture_on_commit_callbacks(execute=True):
+        cache.set('key1', 'value1')
+
+    cache.get('key1')
+    cache.get('key2')
+    content = client.get('/metrics').content.decode()
+    stats = cache.stats()
+    for name in ('hits', 'misses', 'size'):
+        suffix = '' if name == 'size' else '_total'
+        assert 'debmonitor_resolution_cache_{name}{suffix}{{cache="test_metrics"}} {value}'.format(
+            name=name, suffix=suffix, value=float(stats[name])) in content
+
+
+@pytest.mark.django_db
+def test_metrics_not_available(client, monkeypatch):
+    """Requesting the metrics endpoint without the prometheus_client module installed should return a 404."""
+    monkeypatch.setattr('debmonitor.metrics.prometheus_client', None)
+    response = client.get('/metrics')
+    assert response.status_code == 404
+    assert 'prometheus_client module is not installed' in response.content.decode()
@@ -6,6 +6,14 @@ from django.db.migrations.executor import MigrationExecutor
 from hosts.models import Host
 
 
+@pytest.fixture(autouse=True)
+def migrate_to_latest():
+    """Migrate forward to the latest migrations after each test to not affect the other tests."""
+    yield
+    executor = MigrationExecutor(connection)
+    executor.migrate(executor.loader.graph.leaf_nodes())
+
+
 @pytest.mark.django_db(transaction=True)
 def test_migration_20180621_backward():
     """Migrating backward should have a Host object with the old properties."""
@@ -1,12 +1,20 @@
+import gzip
+import json
 import uuid
 
 from unittest.mock import patch
 
+import prometheus_client
 import pytest
 
+from django.db import connection, IntegrityError, OperationalError
+from django.test.utils import CaptureQueriesContext
 from django.urls import resolve, reverse
 
-from debmonitor import middleware
+from debmonitor import generation, middleware, spool
+from debmonitor.middleware import APPLICATION_JSON
+from debmonitor.models import SearchTerm
+from debmonitor.payload import compact_payload
 from hosts import views
 from hosts.models import Host, HostPackage
 from tests.conftest import HOSTNAME, setup_auth_settings, validate_status_code
@@ -15,6 +23,7 @@ from tests.conftest import HOSTNAME, setup_auth_settings, validate_status_code
 INDEX_URL = '/hosts/'
 EXISTING_HOST_URL = INDEX_URL + HOSTNAME
 EXISTING_HOST_UPDATE_URL = EXISTING_HOST_URL + '/update'
+BATCH_UPDATE_URL = INDEX_URL + 'update'
 MISSING_HOST_URL = INDEX_URL + 'non_existing_host.example.com'
 PAYLOAD_NEW_OK = """{
     "api_version": "v1",
@@ -132,6 +141,19 @@ def test_index_view_function():
     assert view.func is views.index
 
 
+@pytest.mark.django_db
+def test_index_datatables(client):
+    """Requesting the hosts index page with the DataTables parameters should return the JSON rows."""
+    response = client.get(INDEX_URL, {'draw': '2', 'length': '-1', 'order[0][column]': '0', 'order[0][dir]': 'asc'})
+    data = json.loads(response.content.decode())
+
+    assert response.status_code == 200
+    assert data['draw'] == 2
+    assert data['recordsTotal'] == Host.objects.count()
+    assert data['recordsFiltered'] == data['recordsTotal']
+    assert len(data['data']) == data['recordsTotal']
+
+
 def test_detail_reverse_url_existing():
     """Reversing an existing host detail page URL name should return the correct URL."""
     url = reverse('hosts:detail', kwargs={'name': HOSTNAME})
@@ -152,6 +174,58 @@ def test_detail_status_code_existing(client, settings, require_login, verify_cli
     validate_status_code(response, require_login)
 
 
+@pytest.mark.django_db
+def test_detail_api(client, settings, require_login, verify_clients):
+    """Requesting a host detail via the API should return its json, if authenticated."""
+    setup_auth_settings(settings, require_login, verify_clients)
+    response = client.get(EXISTING_HOST_URL, HTTP_ACCEPT=APPLICATION_JSON)
+    validate_status_code(response, require_login, verify_clients=verify_clients)
+    if not require_login and not verify_clients:
+        data = response.json()
+        assert data['name'] == HOSTNAME
+        assert data['os'] == 'Debian 11'
+        assert data['etag'] is None
+        assert 'ETag' not in response
+
+
+@pytest.mark.django_db
+def test_detail_not_modified(client):
+    """Requesting again a host detail page should return a 304 Not Modified until the host is modified."""
+    response = client.get(EXISTING_HOST_URL)
+    assert response.status_code == 200
+    assert response['Last-Modified']
+
+    not_modified = client.get(EXISTING_HOST_URL, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert not_modified.status_code == 304
+
+    Host.objects.get(name=HOSTNAME).save()
+    modified = client.get(EXISTING_HOST_URL, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert modified.status_code == 200
+    assert modified['ETag'] != response['ETag']
+
+
+@pytest.mark.django_db
+def test_index_verified_client(client, settings):
+    """Requesting the hosts index page as a host authenticated by its client certificate should return 200 OK."""
+    settings.DEBMONITOR_VERIFY_CLIENTS = True
+    response = client.get(INDEX_URL, HTTP_ACCEPT=APPLICATION_JSON, **{
+        middleware.SSL_CLIENT_VERIFY_HEADER: 'SUCCESS', middleware.SSL_CLIENT_SUBJECT_DN_HEADER: 'CN=' + HOSTNAME})
+    assert response.status_code == 200
+    assert response['ETag']
+
+
+@pytest.mark.django_db
+def test_index_not_modified(client, django_capture_on_commit_callbacks):
+    """Requesting again the hosts index page should return a 304 Not Modified until the inventory changes."""
+    response = client.get(INDEX_URL)
+    assert client.get(INDEX_URL, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+
+    with django_capture_on_commit_callbacks(execute=True):
+        client.post(EXISTING_HOST_UPDATE_URL, PAYLOAD_EXISTING_NO_UPDATE, content_type='application/json')
+
+    assert client.get(INDEX_URL, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 200
+
+
 @pytest.mark.django_db
 def test_detail_status_code_missing(client, settings, require_login, verify_clients):
     """Requesting a missing host detail page should return a 404 NOT FOUND, if authenticated."""
@@ -288,6 +362,411 @@ def test_update_status_code_new_host_ok(client):
     assert response.status_code == 201
 
 
+@pytest.mark.django_db
+def test_update_metrics(client):
+    """Updating a host should export the duration of the ingestion phases and the number of items."""
+    def sample(name, **labels):
+        return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
+    phases = ('parse', 'resolution', 'load', 'installed', 'uninstalled', 'upgradable', 'garbage_collection', 'save')
+    before = {phase: sample('debmonitor_ingestion_phase_duration_seconds_count', kind='hosts', phase=phase)
+              for phase in phases}
+    items = sample('debmonitor_ingestion_items_total', kind='hosts', update_type='full', items='installed')
+
+    rand = str(uuid.uuid4())
+    response = client.generic('POST', '/hosts/{uuid}/update'.format(uuid=rand), PAYLOAD_NEW_OK % {'uuid': rand})
+    assert response.status_code == 201
+
+    for phase in phases:
+        assert sample('debmonitor_ingestion_phase_duration_seconds_count', kind='hosts', phase=phase) == (
+            before[phase] + 1)
+
+    assert sample('debmonitor_ingestion_items_total', kind='hosts', update_type='full', items='installed') == items + 3
+    assert sample('debmonitor_request_db_queries_count', view='hosts:update') > 0
+
+
+@pytest.mark.django_db
+def test_update_idempotency_key(client, settings):
+    """Retrying an update with the same Idempotency-Key should replay the first response without reprocessing it."""
+    settings.DEBMONITOR_IDEMPOTENCY = {'TTL': 60}
+    rand = str(uuid.uuid4())
+    url = '/hosts/{uuid}/update'.format(uuid=rand)
+    first = client.generic('POST', url, PAYLOAD_NEW_OK % {'uuid': rand}, HTTP_IDEMPOTENCY_KEY=rand)
+    assert first.status_code == 201
+
+    with patch('hosts.views._update_v1') as mocked:
+        retried = client.generic('POST', url, PAYLOAD_NEW_OK % {'uuid': rand}, HTTP_IDEMPOTENCY_KEY=rand)
+
+    assert not mocked.called
+    assert retried.status_code == 201
+    assert retried['ETag'] == first['ETag']
+    assert retried['Idempotent-Replayed'] == 'true'
+
+
+@pytest.mark.django_db
+def test_update_derived_key_partial(client, settings):
+    """The same partial update submitted again after another one should be applied again, not replayed."""
+    settings.DEBMONITOR_IDEMPOTENCY = {'TTL': 60, 'DERIVE_KEY': True}
+    rand = str(uuid.uuid4())
+    package = {'name': 'pkg-{rand}'.format(rand=rand), 'version': '1.0.0-1', 'source': 'pkg-{rand}'.format(rand=rand)}
+    payload = {'api_version': 'v1', 'os': 'Debian 11', 'hostname': HOSTNAME,
+               'running_kernel': {'release': '100', 'version': 'os1-100-2'}}
+    install = dict(payload, update_type='partial', installed=[package])
+    remove = dict(payload, update_type='partial', uninstalled=[package])
+
+    for partial, installed in ((install, True), (remove, False), (install, True)):
+        response = client.generic('POST', EXISTING_HOST_UPDATE_URL, json.dumps(partial))
+        assert response.status_code == 201
+        assert 'Idempotent-Replayed' not in response
+        assert HostPackage.objects.filter(host__name=HOSTNAME, package__name=package['name']).exists() == installed
+
+
+@pytest.mark.django_db
+def test_update_idempotency_key_reused(client, settings):
+    """Reusing an Idempotency-Key with a different payload should return 422 Unprocessable Entity."""
+    settings.DEBMONITOR_IDEMPOTENCY = {'TTL': 60}
+    rand = str(uuid.uuid4())
+    url = '/hosts/{uuid}/update'.format(uuid=rand)
+    assert client.generic('POST', url, PAYLOAD_NEW_OK % {'uuid': rand}, HTTP_IDEMPOTENCY_KEY=rand).status_code == 201
+
+    payload = json.loads(PAYLOAD_NEW_OK % {'uuid': rand})
+    del payload['uninstalled']
+    with patch('hosts.views._update_v1') as mocked:
+        response = client.generic('POST', url, json.dumps(payload), HTTP_IDEMPOTENCY_KEY=rand)
+
+    assert not mocked.called
+    assert response.status_code == 422
+
+
+def _host_counts(name):
+    """Return a tuple with the stored and the actual packages counters of the given host."""
+    host = Host.objects.get(name=name)
+    host_packages = HostPackage.objects.filter(host=host)
+    actual = (host_packages.count(), host_packages.filter(upgradable_package__isnull=False).count(),
+              host_packages.filter(upgrade_type='security').count())
+    return (host.packages_count, host.upgrades_count, host.security_count), actual
+
+
+@pytest.mark.django_db
+def test_update_new_host_tracked_packages(client):
+    """Updating a non existing host should track the installed, uninstalled and upgradable packages."""
+    rand = str(uuid.uuid4())
+    response = client.generic('POST', '/hosts/{uuid}/update'.format(uuid=rand), PAYLOAD_NEW_OK % {'uuid': rand})
+    assert response.status_code == 201
+
+    host_packages = {host_pkg.package.name: host_pkg for host_pkg in HostPackage.objects.filter(host__name=rand)}
+    assert set(host_packages.keys()) == {'pkg1-' + rand, 'pkg2-' + rand}
+    assert host_packages['pkg1-' + rand].package_version.version == '1.0.0-1'
+    assert host_packages['pkg1-' + rand].upgradable_version.version == '1.0.0-2'
+    assert host_packages['pkg2-' + rand].upgradable_version is None
+    stored, actual = _host_counts(rand)
+    assert stored == actual
+    assert SearchTerm.objects.filter(host__name=rand).exists()
+
+
+@pytest.mark.django_db
+def test_update_new_host_constant_queries(client):
+    """Updating a non existing host should perform the same number of queries regardless of its packages."""
+    queries = []
+    for packages_count in (5, 50):
+        rand = str(uuid.uuid4())
+        payload = json.loads(PAYLOAD_NEW_OK % {'uuid': rand})
+        payload['os'] = 'Debian 11'  # Use an existing OS to not count its creation
+        payload['installed'] = [{'name': 'pkg{i}-{uuid}'.format(i=i, uuid=rand), 'version': '1.0.0-1',
+                                 'source': 'src-{uuid}'.format(uuid=rand)} for i in range(packages_count)]
+        with CaptureQueriesContext(connection) as context:
+            response = client.generic('POST', '/hosts/{uuid}/update'.format(uuid=rand), json.dumps(payload))
+
+        assert response.status_code == 201
+        assert HostPackage.objects.filter(host__name=rand).count() == packages_count - 1
+        queries.append(len(context.captured_queries))
+
+    assert queries[0] == queries[1]
+
+
+@pytest.mark.django_db
+def test_update_partial_constant_queries(client):
+    """A partial update of a single package should load only its HostPackage regardless of the host packages."""
+    queries = []
+    for packages_count in (5, 50):
+        rand = str(uuid.uuid4())
+        url = '/hosts/{uuid}/update'.format(uuid=rand)
+        payload = json.loads(PAYLOAD_NEW_OK % {'uuid': rand})
+        payload['installed'] = [{'name': 'pkg{i}-{uuid}'.format(i=i, uuid=rand), 'version': '1.0.0-1',
+                                 'source': 'src-{uuid}'.format(uuid=rand)} for i in range(packages_count)]
+        assert client.generic('POST', url, json.dumps(payload)).status_code == 201
+
+        payload['update_type'] = 'partial'
+        payload['installed'] = [{'name': 'pkg1-{uuid}'.format(uuid=rand), 'version': '1.0.0-3',
+                                 'source': 'src-{uuid}'.format(uuid=rand)}]
+        payload['uninstalled'] = [{'name': 'pkg2-{uuid}'.format(uuid=rand)}]
+        payload['upgradable'] = [{'name': 'pkg4-{uuid}'.format(uuid=rand), 'version_from': '1.0.0-1',
+                                  'version_to': '1.0.0-2', 'source': 'src-{uuid}'.format(uuid=rand)}]
+        with CaptureQueriesContext(connection) as context:
+            response = client.generic('POST', url, json.dumps(payload))
+
+        assert response.status_code == 201
+        host_packages = {host_pkg.package.name: host_pkg for host_pkg in HostPackage.objects.filter(host__name=rand)}
+        assert len(host_packages) == packages_count - 2
+        assert host_packages['pkg1-' + rand].package_version.version == '1.0.0-3'
+        assert host_packages['pkg1-' + rand].upgradable_version is None
+        assert host_packages['pkg4-' + rand].upgradable_version.version == '1.0.0-2'
+        queries.append(len(context.captured_queries))
+
+    assert queries[0] == queries[1]
+
+
+@pytest.mark.django_db
+def test_update_existing_host_tracked_packages(client):
+    """Updating an existing host should update, delete and create the related HostPackage objects."""
+    rand = str(uuid.uuid4())
+    response = client.generic('POST', EXISTING_HOST_UPDATE_URL, PAYLOAD_EXISTING_UPDATE % {'uuid': rand})
+    assert response.status_code == 201
+
+    host_packages = {host_pkg.package.name: host_pkg for host_pkg in HostPackage.objects.filter(host__name=HOSTNAME)}
+    assert set(host_packages.keys()) == {'package1', 'package2', 'pkg1-' + rand, 'pkg3-' + rand}
+    assert host_packages['package2'].package_version.version == '2.0.0-2'
+    assert host_packages['package2'].upgradable_version is None
+    assert host_packages['package1'].upgradable_version.version == '1.0.0-2'
+    assert host_packages['pkg3-' + rand].package_version.version == '1.0.0-1'
+    assert host_packages['pkg3-' + rand].upgradable_version.version == '1.0.0-2'
+    stored, actual = _host_counts(HOSTNAME)
+    assert stored == actual
+
+
+@pytest.mark.django_db
+def test_update_existing_host_garbage_collection(client):
+    """A full update of an existing host should delete the orphaned packages and clean the orphaned upgrades."""
+    with CaptureQueriesContext(connection) as context:
+        response = client.generic('POST', EXISTING_HOST_UPDATE_URL, PAYLOAD_EXISTING_NO_UPDATE)
+
+    assert response.status_code == 201
+    host_packages = {host_pkg.package.name: host_pkg for host_pkg in HostPackage.objects.filter(host__name=HOSTNAME)}
+    assert set(host_packages.keys()) == {'package1', 'package2'}
+    assert all(host_pkg.upgradable_version is None for host_pkg in host_packages.values())
+    assert all(host_pkg.upgrade_type is None for host_pkg in host_packages.values())
+    assert not [query for query in context.captured_queries if 'NOT' in query['sql']]
+    stored, actual = _host_counts(HOSTNAME)
+    assert stored == actual
+
+
+@pytest.mark.django_db
+def test_update_unchanged_manifest(client, django_capture_on_commit_callbacks):
+    """Updating a host with the same full payload of the last update should skip all the packages processing."""
+    rand = str(uuid.uuid4())
+    url = '/hosts/{uuid}/update'.format(uuid=rand)
+    before = generation.get()
+    with django_capture_on_commit_callbacks(execute=True):
+        assert client.generic('POST', url, PAYLOAD_NEW_OK % {'uuid': rand}).status_code == 201
+
+    host = Host.objects.get(name=rand)
+    assert host.manifest_digest is not None
+    current = generation.get()
+    assert current != before
+
+    with CaptureQueriesContext(connection) as context, django_capture_on_commit_callbacks(execute=True):
+        response = client.generic('POST', url, PAYLOAD_NEW_OK % {'uuid': rand})
+
+    assert response.status_code == 201
+    assert not [query for query in context.captured_queries if 'hosts_hostpackage' in query['sql']]
+    assert Host.objects.get(name=rand).modified > host.modified
+    assert generation.get() == current  # Nothing changed in the inventory
+
+    payload = json.loads(PAYLOAD_NEW_OK % {'uuid': rand})
+    payload['running_kernel']['version'] = 'new_kernel_{uuid}'.format(uuid=rand)
+    with django_capture_on_commit_callbacks(execute=True):
+        assert client.generic('POST', url, json.dumps(payload)).status_code == 201
+
+    assert generation.get() != current  # The running kernel changed
+
+
+@pytest.mark.django_db
+def test_update_migrate_os(client):
+    """Updating a host with a different OS should migrate all its packages to the new OS with bulk queries."""
+    before = {host_pkg.package.name: (host_pkg.package_version.version, host_pkg.upgradable_version)
+              for host_pkg in HostPackage.objects.filter(host__name=HOSTNAME)}
+    payload = json.loads(PAYLOAD_EXISTING_NO_UPDATE)
+    payload['update_type'] = 'partial'
+    payload['os'] = 'Ubuntu 24.04'
+    del payload['installed']
+
+    with CaptureQueriesContext(connection) as context:
+        response = client.generic('POST', EXISTING_HOST_UPDATE_URL, json.dumps(payload))
+
+    assert response.status_code == 201
+    updates = [query for query in context.captured_queries if query['sql'].startswith('UPDATE "hosts_hostpackage"')]
+    assert len(updates) == 1
+    host_packages = HostPackage.objects.filter(host__name=HOSTNAME)
+    assert len(host_packages) == len(before)
+    for host_pkg in host_packages:
+        version, upgradable_version = before[host_pkg.package.name]
+        assert host_pkg.package_version.version == version
+        assert host_pkg.package_version.os.name == 'Ubuntu 24.04'
+        if upgradable_version is None:
+            assert host_pkg.upgradable_version is None
+        else:
+            assert host_pkg.upgradable_version.version == upgradable_version.version
+            assert host_pkg.upgradable_version.os.name == 'Ubuntu 24.04'
+            assert host_pkg.upgradable_version.src_package_version.src_package == (
+                upgradable_version.src_package_version.src_package)
+
+
+@pytest.mark.django_db
+def test_update_etag(client):
+    """A full update should return the inventory ETag, exposed also by the host detail API."""
+    rand = str(uuid.uuid4())
+    response = client.generic('POST', '/hosts/{uuid}/update'.format(uuid=rand), PAYLOAD_NEW_OK % {'uuid': rand})
+    assert response.status_code == 201
+    assert response['ETag'] == '"{digest}"'.format(digest=Host.objects.get(name=rand).manifest_digest)
+
+    detail = client.get('/hosts/{uuid}'.format(uuid=rand), HTTP_ACCEPT=APPLICATION_JSON)
+    assert detail['ETag'] == response['ETag']
+    assert '"{etag}"'.format(etag=detail.json()['etag']) == response['ETag']
+
+
+@pytest.mark.django_db
+def test_update_if_match_unchanged(client):
+    """An update without packages and a matching If-Match should only update the host and keep its packages."""
+    rand = str(uuid.uuid4())
+    url = '/hosts/{uuid}/update'.format(uuid=rand)
+    etag = client.generic('POST', url, PAYLOAD_NEW_OK % {'uuid': rand})['ETag']
+    payload = json.loads(PAYLOAD_NEW_OK % {'uuid': rand})
+    for key in ('installed', 'uninstalled', 'upgradable'):
+        del payload[key]
+    payload['running_kernel']['version'] = 'kernel_new'
+
+    with CaptureQueriesContext(connection) as context:
+        response = client.generic('POST', url, json.dumps(payload), HTTP_IF_MATCH=etag)
+
+    assert response.status_code == 201
+    assert response['ETag'] == etag
+    assert not [query for query in context.captured_queries if 'hosts_hostpackage' in query['sql']]
+    host = Host.objects.get(name=rand)
+    assert host.kernel.name == 'kernel_new'
+    assert HostPackage.objects.filter(host=host).count() == 2
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('name, headers', (
+    (HOSTNAME, {'HTTP_IF_MATCH': '"invalid"'}),
+    (HOSTNAME, {'HTTP_IF_NONE_MATCH': '*'}),
+    ('{uuid}', {'HTTP_IF_MATCH': '*'}),
+))
+def test_update_precondition_failed(client, name, headers):
+    """An update with an If-Match or If-None-Match precondition not met should return 412 Precondition Failed."""
+    rand = str(uuid.uuid4())
+    payload = PAYLOAD_EXISTING_UPDATE if name == HOSTNAME else PAYLOAD_NEW_OK
+    response = client.generic('POST', '/hosts/{name}/update'.format(name=name.format(uuid=rand)),
+                              payload % {'uuid': rand}, **headers)
+
+    assert response.status_code == 412
+    assert not Host.objects.filter(name=rand).exists()
+    assert HostPackage.objects.filter(host__name=HOSTNAME).count() == 4
+
+
+@pytest.mark.django_db
+def test_update_if_none_match_new_host(client):
+    """An update of a new host with If-None-Match * should create it."""
+    rand = str(uuid.uuid4())
+    response = client.generic('POST', '/hosts/{uuid}/update'.format(uuid=rand), PAYLOAD_NEW_OK % {'uuid': rand},
+                              HTTP_IF_NONE_MATCH='*')
+    assert response.status_code == 201
+
+
+@pytest.mark.django_db
+def test_update_spooled_precondition_failed(client, settings, tmp_path):
+    """Updating a host with the spool enabled and a precondition not met should return 412 without spooling it."""
+    settings.DEBMONITOR_SPOOL = {'PATH': str(tmp_path / 'spool.sqlite')}
+    rand = str(uuid.uuid4())
+    response = client.generic('POST', EXISTING_HOST_UPDATE_URL, PAYLOAD_EXISTING_UPDATE % {'uuid': rand},
+                              HTTP_IF_MATCH='"invalid"')
+
+    assert response.status_code == 412
+    assert len(spool.Spool()) == 0
+
+
+@pytest.mark.django_db
+def test_update_partial_reset_manifest_digest(client):
+    """Updating a host with a non-full update should reset its manifest digest."""
+    rand = str(uuid.uuid4())
+    url = '/hosts/{uuid}/update'.format(uuid=rand)
+    assert client.generic('POST', url, PAYLOAD_NEW_OK % {'uuid': rand}).status_code == 201
+    payload = PAYLOAD_NEW_OK.replace('"update_type": "full"', '"update_type": "partial"')
+    assert client.generic('POST', url, payload % {'uuid': rand}).status_code == 201
+    assert Host.objects.get(name=rand).manifest_digest is None
+
+
+@pytest.mark.django_db
+def test_update_gzip(client):
+    """Updating a host with a gzip compressed payload should return 201 Created."""
+    rand = str(uuid.uuid4())
+    response = client.generic('POST', '/hosts/{uuid}/update'.format(uuid=rand),
+                              gzip.compress((PAYLOAD_NEW_OK % {'uuid': rand}).encode('utf-8')),
+                              HTTP_CONTENT_ENCODING='gzip')
+    assert response.status_code == 201
+    assert HostPackage.objects.filter(host__name=rand).count() == 2
+
+
+def _to_v2(payload):
+    """Convert a v1 update payload string into the equivalent compact v2 one."""
+    payload = json.loads(payload)
+    strings = []
+    converted = {'api_version': 'v2', 'strings': strings}
+    for key, value in payload.items():
+        if key not in ('api_version', 'installed', 'uninstalled', 'upgradable'):
+            converted[key] = value
+
+    for key, fields in (('installed', ('name', 'version', 'source')), ('uninstalled', ('name', 'version', 'source')),
+                        ('upgradable', ('name', 'version_from', 'version_to', 'source', 'type'))):
+        converted[key] = []
+        for item in payload.get(key, []):
+            indexes = []
+            for field in fields:
+                if item[field] not in strings:
+                    strings.append(item[field])
+                indexes.append(strings.index(item[field]))
+            converted[key].append(indexes)
+
+    return json.dumps(converted)
+
+
+@pytest.mark.django_db
+def test_update_v2(client):
+    """Updating a host with a compact v2 payload should track the same packages of the v1 one."""
+    rand = str(uuid.uuid4())
+    response = client.generic('POST', '/hosts/{uuid}/update'.format(uuid=rand), _to_v2(PAYLOAD_NEW_OK % {'uuid': rand}),
+                              HTTP_X_DEBMONITOR_CLIENT_VERSION='1.0.0')
+    assert response.status_code == 201
+    host = Host.objects.get(name=rand)
+    assert host.client_version == '1.0.0'
+    host_packages = {host_pkg.package.name: host_pkg for host_pkg in HostPackage.objects.filter(host=host)}
+    assert sorted(host_packages) == ['pkg1-{uuid}'.format(uuid=rand), 'pkg2-{uuid}'.format(uuid=rand)]
+    assert host_packages['pkg1-{uuid}'.format(uuid=rand)].upgradable_version.version == '1.0.0-2'
+
+    # A v1 client sending the same manifest doesn't need to process the packages again
+    response = client.generic('POST', '/hosts/{uuid}/update'.format(uuid=rand), PAYLOAD_NEW_OK % {'uuid': rand})
+    assert response.status_code == 201
+    host.refresh_from_db()
+    assert host.client_version is None
+    assert host.manifest_digest is not None
+
+
+def test_update_invalid_item(client):
+    """Updating a host with an invalid package item should return 400 Bad Request with the index of the item."""
+    payload = json.loads(PAYLOAD_EXISTING_NO_UPDATE)
+    del payload['installed'][1]['version']
+    response = client.generic('POST', EXISTING_HOST_UPDATE_URL, json.dumps(payload))
+    assert response.status_code == 400
+    assert response.content.decode('utf-8') == "Invalid item 1 of 'installed': missing or invalid 'version'"
+
+
+def test_update_unsupported_encoding(client):
+    """Updating a host with an unsupported Content-Encoding should return 415 Unsupported Media Type."""
+    response = client.generic('POST', EXISTING_HOST_UPDATE_URL, PAYLOAD_EXISTING_NO_UPDATE,
+                              HTTP_CONTENT_ENCODING='br')
+    assert response.status_code == 415
+
+
 @pytest.mark.django_db
 def test_update_status_code_new_host_ko(client):
     """Updating a non existing host with an incorrect payload should return 400 Bad Request."""
@@ -319,6 +798,29 @@ def test_update_status_code_upgradable(client):
     assert response.status_code == 201
 
 
+@pytest.mark.django_db
+def test_update_upgradable_only(client):
+    """An upgradable-only update should set the listed upgrades, create the missing packages and clear the others."""
+    rand = str(uuid.uuid4())
+    with CaptureQueriesContext(connection) as context:
+        response = client.generic('POST', EXISTING_HOST_UPDATE_URL, PAYLOAD_UPGRADABLE % {'uuid': rand})
+
+    assert response.status_code == 201
+    host_packages = {host_pkg.package.name: host_pkg for host_pkg in HostPackage.objects.filter(host__name=HOSTNAME)}
+    assert 'pkg3-' + rand in host_packages
+    assert host_packages['package1'].upgradable_version.version == '1.0.0-2'
+    assert host_packages['package2'].upgradable_version is None
+    assert host_packages['package2'].upgrade_type is None
+    assert host_packages['pkg3-' + rand].package_version.version == '1.0.0-1'
+    assert host_packages['pkg3-' + rand].upgradable_version.version == '1.0.0-2'
+    selects = [query['sql'] for query in context.captured_queries if query['sql'].startswith('SELECT') and
+               'FROM "hosts_hostpackage"' in query['sql'] and 'GROUP BY' not in query['sql']]  # Skip the counters
+    assert len(selects) == 2  # The listed packages and the ones with the upgrades to clean
+    assert all('bin_packages_packageversion' not in select for select in selects)
+    stored, actual = _host_counts(HOSTNAME)
+    assert stored == actual
+
+
 @pytest.mark.django_db
 def test_update_status_code_upgradable_os_change(client):
     """Updating an existing host with a correct payload with upgradable
@@ -348,6 +850,270 @@ def test_update_status_code_upgradable_client2(client):
     assert response.status_code == 201
 
 
+@pytest.mark.django_db
+@patch('hosts.views._update_v1')
+def test_update_spooled(mocked_update_v1, client, settings, tmp_path):
+    """Updating a host with the spool enabled should spool the payload and return 202 Accepted."""
+    settings.DEBMONITOR_SPOOL = {'PATH': str(tmp_path / 'spool.sqlite')}
+    rand = str(uuid.uuid4())
+    response = client.generic('POST', EXISTING_HOST_UPDATE_URL, PAYLOAD_EXISTING_UPDATE % {'uuid': rand},
+                              HTTP_X_DEBMONITOR_CLIENT_VERSION='1.0.0')
+
+    assert response.status_code == 202
+    assert not mocked_update_v1.called
+    groups = spool.Spool().pop_batch(10, 3)
+    expected = compact_payload(json.loads(PAYLOAD_EXISTING_UPDATE % {'uuid': rand}))
+    expected['client_version'] = '1.0.0'
+    assert compact_payload(json.loads(groups[('hosts', HOSTNAME)][0].payload)) == expected
+
+
+@pytest.mark.django_db
+def test_update_spooled_invalid(client, settings, tmp_path):
+    """Updating a host with the spool enabled and an invalid payload should return 400 Bad Request."""
+    settings.DEBMONITOR_SPOOL = {'PATH': str(tmp_path / 'spool.sqlite')}
+    rand = str(uuid.uuid4())
+    response = client.generic('POST', '/hosts/{uuid}/update'.format(uuid=rand), PAYLOAD_NEW_KO % {'uuid': rand})
+
+    assert response.status_code == 400
+    assert len(spool.Spool()) == 0
+
+
+def _new_host_payload(rand, suffix):
+    """Return a new host payload with the packages of PAYLOAD_NEW_OK, shared by all the hosts with the same rand."""
+    payload = json.loads(PAYLOAD_NEW_OK % {'uuid': rand})
+    payload['hostname'] = '{rand}-{suffix}'.format(rand=rand, suffix=suffix)
+    return payload
+
+
+def test_update_batch_view_function():
+    """Resolving the URL for the hosts batch update should return the correct view."""
+    view = resolve(BATCH_UPDATE_URL)
+    assert view.func is views.update_hosts
+
+
+@pytest.mark.django_db
+def test_update_batch_ok(client):
+    """Updating multiple hosts in a single batch should resolve their shared packages once and update all of them."""
+    rand = str(uuid.uuid4())
+    payloads = [_new_host_payload(rand, suffix) for suffix in ('a', 'b', 'c')]
+    payloads[0]['client_version'] = '2.0.0'  # Not allowed in the payload itself
+    with CaptureQueriesContext(connection) as context:
+        response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'hosts': payloads}),
+                                  HTTP_X_DEBMONITOR_CLIENT_VERSION='1.0.0')
+
+    assert response.status_code == 201
+    assert response.json()['success']
+    for payload in payloads:
+        host = Host.objects.get(name=payload['hostname'])
+        assert response.json()['hosts'][payload['hostname']] == {'success': True, 'etag': host.manifest_digest}
+        assert host.client_version is None  # The header is the one of the proxy host
+        assert HostPackage.objects.filter(host=host).count() == 2
+
+    inserts = [query for query in context.captured_queries
+               if query['sql'].startswith('INSERT') and 'INTO "bin_packages_packageversion"' in query['sql']]
+    assert len(inserts) == 1
+
+
+@pytest.mark.django_db
+def test_update_batch_errors(client):
+    """Updating multiple hosts in a single batch with some invalid host should return 202 Accepted."""
+    rand = str(uuid.uuid4())
+    valid = _new_host_payload(rand, 'a')
+    invalid = _new_host_payload(rand, 'b')
+    invalid['os'] = 'invalid_os'
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'hosts': [valid, invalid, {}]}))
+
+    assert response.status_code == 202
+    assert not response.json()['success']
+    assert response.json()['errors'] == 2
+    assert response.json()['hosts'][valid['hostname']]['success']
+    assert 'is not valid' in response.json()['hosts'][invalid['hostname']]['error']
+    assert response.json()['hosts']['']['error'] == 'Hostname not specified in POST payload'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('os', (None, 11, ''))
+def test_update_batch_invalid_os(client, os):
+    """Updating multiple hosts in a single batch with a missing or invalid OS should fail only those hosts."""
+    rand = str(uuid.uuid4())
+    valid = _new_host_payload(rand, 'a')
+    invalid = _new_host_payload(rand, 'b')
+    if os is None:
+        del invalid['os']
+    else:
+        invalid['os'] = os
+
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'hosts': [valid, invalid]}))
+
+    assert response.status_code == 202
+    assert response.json()['errors'] == 1
+    assert response.json()['hosts'][valid['hostname']]['success']
+    assert response.json()['hosts'][invalid['hostname']]['error'] == 'OS not specified in POST payload'
+
+
+@pytest.mark.django_db
+def test_update_batch_invalid_item(client):
+    """Updating multiple hosts in a single batch with an invalid package version should fail only that host."""
+    rand = str(uuid.uuid4())
+    valid = _new_host_payload(rand, 'a')
+    invalid = _new_host_payload(rand, 'b')
+    invalid['installed'].append({'name': 'pkg4-{rand}'.format(rand=rand), 'version': 'a' * 256, 'source': 'pkg4'})
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'hosts': [valid, invalid]}))
+
+    assert response.status_code == 202
+    assert response.json()['errors'] == 1
+    assert response.json()['hosts'][valid['hostname']]['success']
+    assert 'Invalid package version version' in response.json()['hosts'][invalid['hostname']]['error']
+    assert HostPackage.objects.filter(host__name=valid['hostname']).count() == 2
+    assert not Host.objects.filter(name=invalid['hostname']).exists()
+
+
+@pytest.mark.django_db
+def test_update_invalid_package_version(client):
+    """Updating a host with an invalid package version should return 400 Bad Request."""
+    payload = json.loads(PAYLOAD_EXISTING_UPDATE % {'uuid': str(uuid.uuid4())})
+    payload['installed'][-1]['version'] = 'a' * 256
+    response = client.generic('POST', EXISTING_HOST_UPDATE_URL, json.dumps(payload))
+
+    assert response.status_code == 400
+    assert 'Invalid package version version' in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_update_batch_keep_client_version(client):
+    """Updating an existing host in a batch should not change its client version to the one of the proxy host."""
+    Host.objects.filter(name=HOSTNAME).update(client_version='1.0.0')
+    payload = json.loads(PAYLOAD_EXISTING_UPDATE % {'uuid': str(uuid.uuid4())})
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'hosts': [payload]}),
+                              HTTP_X_DEBMONITOR_CLIENT_VERSION='2.0.0')
+
+    assert response.status_code == 201
+    assert Host.objects.get(name=HOSTNAME).client_version == '1.0.0'
+
+
+@pytest.mark.django_db
+def test_update_batch_integrity_error(client, settings):
+    """A persistent integrity error while updating a host of a batch should fail only that host, without retries."""
+    settings.DEBMONITOR_UPDATE_RETRIES = 2
+    rand = str(uuid.uuid4())
+    payloads = [_new_host_payload(rand, suffix) for suffix in ('a', 'b', 'c')]
+    original = views._update_v1
+    calls = []
+
+    def failing_update_v1(request, name, *args, **kwargs):
+        calls.append(name)
+        if name == payloads[1]['hostname']:
+            raise IntegrityError('NOT NULL constraint failed: hosts_host.os_id')
+
+        return original(request, name, *args, **kwargs)
+
+    with patch('hosts.views._update_v1', side_effect=failing_update_v1), \
+            patch('debmonitor.decorators.connection', in_atomic_block=False):
+        response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'hosts': payloads}))
+
+    assert response.status_code == 202
+    assert response.json()['errors'] == 1
+    assert 'NOT NULL constraint failed' in response.json()['hosts'][payloads[1]['hostname']]['error']
+    assert calls == [payload['hostname'] for payload in payloads]
+    for payload in (payloads[0], payloads[2]):
+        assert response.json()['hosts'][payload['hostname']]['success']
+        assert HostPackage.objects.filter(host__name=payload['hostname']).count() == 2
+
+
+@pytest.mark.django_db
+def test_update_batch_duplicate_host(client):
+    """A host of a batch created concurrently should be updated again within its own savepoint."""
+    rand = str(uuid.uuid4())
+    payloads = [_new_host_payload(rand, suffix) for suffix in ('a', 'b')]
+    original = views._update_v1
+    calls = []
+
+    def racing_update_v1(request, name, *args, **kwargs):
+        calls.append(name)
+        if calls.count(name) == 1 and name == payloads[1]['hostname']:
+            raise IntegrityError('UNIQUE constraint failed: hosts_host.name')
+
+        return original(request, name, *args, **kwargs)
+
+    with patch('hosts.views._update_v1', side_effect=racing_update_v1):
+        response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'hosts': payloads}))
+
+    assert response.status_code == 201
+    assert calls == [payloads[0]['hostname'], payloads[1]['hostname'], payloads[1]['hostname']]
+
+
+@pytest.mark.django_db
+def test_update_batch_retry(client, settings):
+    """A deadlock while updating a host of a batch should retry the whole batch, resolving the packages again."""
+    settings.DEBMONITOR_UPDATE_RETRIES = 2
+    rand = str(uuid.uuid4())
+    payloads = [_new_host_payload(rand, suffix) for suffix in ('a', 'b')]
+    original = views._update_v1
+    calls = []
+
+    def flaky_update_v1(*args, **kwargs):
+        calls.append(kwargs['resolved'])
+        if len(calls) == 2:
+            raise OperationalError(1213, 'Deadlock found when trying to get lock')
+
+        return original(*args, **kwargs)
+
+    # The test transaction is already open, pretend it's not to allow the retries
+    with patch('hosts.views._update_v1', side_effect=flaky_update_v1), patch('debmonitor.decorators.time.sleep'), \
+            patch('debmonitor.decorators.connection', in_atomic_block=False):
+        response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'hosts': payloads}))
+
+    assert response.status_code == 201
+    assert len(calls) == 4
+    assert calls[2] is not calls[0]  # Resolved again within the retried transaction
+    for payload in payloads:
+        assert HostPackage.objects.filter(host__name=payload['hostname']).count() == 2
+
+
+@pytest.mark.parametrize('payload', ({'hosts': {}}, {'hosts': [{'installed': [{'name': 'pkg1'}]}]}))
+def test_update_batch_invalid_payload(client, payload):
+    """Updating multiple hosts with an invalid payload should return 400 Bad Request."""
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps(payload))
+    assert response.status_code == 400
+
+
+def test_update_batch_not_proxy(client, settings):
+    """Updating multiple hosts from a host that is not a proxy should return 403 Forbidden."""
+    settings.DEBMONITOR_VERIFY_CLIENTS = True
+    settings.DEBMONITOR_PROXY_HOSTS = ['proxy.example.com']
+    extra = {middleware.SSL_CLIENT_VERIFY_HEADER: 'SUCCESS',
+             middleware.SSL_CLIENT_SUBJECT_DN_HEADER: 'CN=host1.example.com'}
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'hosts': []}), **extra)
+    assert response.status_code == 403
+    assert 'Unauthorized to modify hosts' in response.content.decode('utf-8')
+
+
+@pytest.mark.django_db
+def test_update_batch_proxy(client, settings):
+    """Updating multiple hosts from a proxy host should return 201 Created."""
+    settings.DEBMONITOR_VERIFY_CLIENTS = True
+    settings.DEBMONITOR_PROXY_HOSTS = ['proxy.example.com']
+    extra = {middleware.SSL_CLIENT_VERIFY_HEADER: 'SUCCESS',
+             middleware.SSL_CLIENT_SUBJECT_DN_HEADER: 'CN=proxy.example.com'}
+    payload = _new_host_payload(str(uuid.uuid4()), 'a')
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'hosts': [payload]}), **extra)
+    assert response.status_code == 201
+
+
+@pytest.mark.django_db
+def test_update_batch_spooled(client, settings, tmp_path):
+    """Updating multiple hosts with the spool enabled should spool all of them and return 202 Accepted."""
+    settings.DEBMONITOR_SPOOL = {'PATH': str(tmp_path / 'spool.sqlite')}
+    rand = str(uuid.uuid4())
+    payloads = [_new_host_payload(rand, suffix) for suffix in ('a', 'b')]
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'hosts': payloads}))
+
+    assert response.status_code == 202
+    assert response.json()['success']
+    assert len(spool.Spool()) == 2
+    assert not Host.objects.filter(name__startswith=rand).exists()
+
+
 @pytest.mark.django_db
 @patch('hosts.views._update_v1', side_effect=RuntimeError)
 def test_update_raise(mocked_update_v1, client):
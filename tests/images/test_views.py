@@ -1,11 +1,15 @@
+import json
 import uuid
 
 from unittest.mock import patch
 
 import pytest
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import resolve, reverse
 
+from debmonitor import generation, middleware, spool
 from debmonitor.middleware import APPLICATION_JSON
 from images import views
 from images.models import Image, ImagePackage
@@ -13,6 +17,7 @@ from tests.conftest import IMAGEBASENAME, IMAGENAME, setup_auth_settings, valida
 
 
 INDEX_URL = '/images/'
+BATCH_UPDATE_URL = INDEX_URL + 'update'
 EXISTING_IMAGE_URL = INDEX_URL + IMAGENAME
 EXISTING_IMAGE_UPDATE_URL = EXISTING_IMAGE_URL + '/update'
 MISSING_IMAGE_URL = INDEX_URL + 'non_existing_image_example'
@@ -85,6 +90,19 @@ def test_index_view_function():
     assert view.func is views.index
 
 
+@pytest.mark.django_db
+def test_index_datatables(client):
+    """Requesting the images index page with the DataTables parameters should return the JSON rows."""
+    response = client.get(INDEX_URL, {'draw': '2', 'length': '-1', 'order[0][column]': '0', 'order[0][dir]': 'asc'})
+    data = json.loads(response.content.decode())
+
+    assert response.status_code == 200
+    assert data['draw'] == 2
+    assert data['recordsTotal'] == Image.objects.count()
+    assert data['recordsFiltered'] == data['recordsTotal']
+    assert len(data['data']) == data['recordsTotal']
+
+
 def test_detail_reverse_url_existing():
     """Reversing an existing image detail page URL name should return the correct URL."""
     url = reverse('images:detail', kwargs={'name': IMAGENAME})
@@ -105,6 +123,23 @@ def test_detail_status_code_existing(client, settings, require_login, verify_cli
     validate_status_code(response, require_login)
 
 
+@pytest.mark.django_db
+def test_detail_not_modified(client):
+    """Requesting again an image detail page should return a 304 Not Modified until its namespaces change."""
+    image = Image.objects.get(pk=2)
+    url = reverse('images:detail', kwargs={'name': image.name})
+    response = client.get(url)
+    assert response.status_code == 200
+    assert 'Last-Modified' not in response  # The image has namespaces
+
+    assert client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+
+    image.namespaces.all().delete()
+    modified = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert modified.status_code == 200
+    assert modified['Last-Modified']
+
+
 @pytest.mark.django_db
 def test_detail_status_code_missing(client, settings, require_login, verify_clients):
     """Requesting a missing image detail page should return a 404 NOT FOUND, if authenticated."""
@@ -235,6 +270,20 @@ def test_update_status_code_existing_update(client):
     assert response.status_code == 201
 
 
+@pytest.mark.django_db
+@patch('images.views._update_v1')
+def test_update_spooled(mocked_update_v1, client, settings, tmp_path):
+    """Updating an image with the spool enabled should spool the payload and return 202 Accepted."""
+    settings.DEBMONITOR_SPOOL = {'PATH': str(tmp_path / 'spool.sqlite')}
+    rand = str(uuid.uuid4())
+    response = client.generic('POST', EXISTING_IMAGE_UPDATE_URL,
+                              PAYLOAD_EXISTING_UPDATE % {'uuid': rand, 'imagename': IMAGENAME})
+
+    assert response.status_code == 202
+    assert not mocked_update_v1.called
+    assert ('images', IMAGENAME) in spool.Spool().pop_batch(10, 3)
+
+
 @pytest.mark.django_db
 @patch('images.views._update_v1', side_effect=RuntimeError)
 def test_update_raise(mocked_update_v1, client):
@@ -246,3 +295,160 @@ def test_update_raise(mocked_update_v1, client):
     assert 'Unable to update image' in response.content.decode('utf-8')
     assert response['Content-Type'] == 'text/plain'
     assert mocked_update_v1.called
+
+
+def _new_image_payload(rand, tag):
+    """Return the payload for a new image with the given tag sharing the packages manifest of PAYLOAD_NEW_OK."""
+    payload = json.loads(PAYLOAD_NEW_OK % {'uuid': rand, 'imagebasename': IMAGEBASENAME})
+    payload['image_name'] = '{base}{uuid}-{tag}'.format(base=IMAGEBASENAME, uuid=rand, tag=tag)
+    return payload
+
+
+def _image_packages(name):
+    """Return the set of packages tracked for the given image."""
+    return set(ImagePackage.objects.filter(image__name=name).values_list(
+        'package', 'package_version', 'upgradable_imagepackage', 'upgradable_imageversion', 'upgrade_type'))
+
+
+@pytest.mark.django_db
+def test_update_same_manifest_copy(client):
+    """Updating an image with the same manifest of another image should copy its packages."""
+    rand = str(uuid.uuid4())
+    names = []
+    for tag in ('a', 'b'):
+        payload = _new_image_payload(rand, tag)
+        response = client.generic('POST', '/images/{name}/update'.format(name=payload['image_name']),
+                                  json.dumps(payload))
+        assert response.status_code == 201
+        names.append(payload['image_name'])
+
+    first, second = (Image.objects.get(name=name) for name in names)
+    assert first.manifest_digest is not None
+    assert first.manifest_digest == second.manifest_digest
+    assert len(_image_packages(names[0])) == 3
+    assert _image_packages(names[0]) == _image_packages(names[1])
+    for image in (first, second):
+        assert (image.packages_count, image.upgrades_count, image.security_count) == (3, 0, 0)
+
+
+@pytest.mark.django_db
+def test_update_unchanged_manifest(client, django_capture_on_commit_callbacks):
+    """Updating an image with the same full payload of the last update should skip all the packages processing."""
+    payload = _new_image_payload(str(uuid.uuid4()), 'a')
+    url = '/images/{name}/update'.format(name=payload['image_name'])
+    before = generation.get()
+    with django_capture_on_commit_callbacks(execute=True):
+        assert client.generic('POST', url, json.dumps(payload)).status_code == 201
+
+    image = Image.objects.get(name=payload['image_name'])
+    current = generation.get()
+    assert current != before
+
+    with CaptureQueriesContext(connection) as context, django_capture_on_commit_callbacks(execute=True):
+        response = client.generic('POST', url, json.dumps(payload))
+
+    assert response.status_code == 201
+    assert not [query for query in context.captured_queries if 'images_imagepackage' in query['sql']]
+    assert Image.objects.get(name=payload['image_name']).modified > image.modified
+    assert generation.get() == current  # Nothing changed in the inventory
+
+
+@pytest.mark.django_db
+def test_update_partial_reset_manifest_digest(client):
+    """Updating an image with a non-full update should reset its manifest digest."""
+    rand = str(uuid.uuid4())
+    payload = _new_image_payload(rand, 'a')
+    url = '/images/{name}/update'.format(name=payload['image_name'])
+    assert client.generic('POST', url, json.dumps(payload)).status_code == 201
+    assert Image.objects.get(name=payload['image_name']).manifest_digest is not None
+
+    payload['update_type'] = 'partial'
+    assert client.generic('POST', url, json.dumps(payload)).status_code == 201
+    assert Image.objects.get(name=payload['image_name']).manifest_digest is None
+
+
+def test_update_batch_view_function():
+    """Resolving the URL for the images batch update should return the correct view."""
+    view = resolve(BATCH_UPDATE_URL)
+    assert view.func is views.update_images
+
+
+@pytest.mark.django_db
+def test_update_batch_ok(client):
+    """Updating multiple images in a single batch should return 201 Created and update all of them."""
+    rand = str(uuid.uuid4())
+    payloads = [_new_image_payload(rand, tag) for tag in ('a', 'b', 'c')]
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'images': payloads}))
+
+    assert response.status_code == 201
+    assert response.json()['success']
+    for payload in payloads:
+        assert response.json()['images'][payload['image_name']] == {'success': True}
+        assert len(_image_packages(payload['image_name'])) == 3
+
+
+@pytest.mark.django_db
+def test_update_batch_errors(client):
+    """Updating multiple images in a single batch with some invalid image should return 202 Accepted."""
+    rand = str(uuid.uuid4())
+    valid = _new_image_payload(rand, 'a')
+    invalid = _new_image_payload(rand, 'b')
+    invalid['os'] = 'invalid_os'
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'images': [valid, invalid]}))
+
+    assert response.status_code == 202
+    assert not response.json()['success']
+    assert response.json()['errors'] == 1
+    assert response.json()['images'][valid['image_name']] == {'success': True}
+    assert 'is not valid' in response.json()['images'][invalid['image_name']]['error']
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('os', (None, 11, ''))
+def test_update_batch_invalid_os(client, os):
+    """Updating multiple images in a single batch with a missing or invalid OS should fail only those images."""
+    rand = str(uuid.uuid4())
+    valid = _new_image_payload(rand, 'a')
+    invalid = _new_image_payload(rand, 'b')
+    if os is None:
+        del invalid['os']
+    else:
+        invalid['os'] = os
+
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'images': [valid, invalid, []]}))
+
+    assert response.status_code == 202
+    assert response.json()['errors'] == 2
+    assert response.json()['images'][valid['image_name']] == {'success': True}
+    assert response.json()['images'][invalid['image_name']]['error'] == 'OS not specified in POST payload'
+    assert response.json()['images']['']['error'] == 'Invalid POST payload, expected a JSON object'
+
+
+@pytest.mark.parametrize('payload', ({'images': {}}, []))
+def test_update_batch_invalid_payload(client, payload):
+    """Updating multiple images with an invalid payload should return 400 Bad Request."""
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps(payload))
+    assert response.status_code == 400
+
+
+def test_update_batch_not_proxy(client, settings):
+    """Updating multiple images from a host that is not an image proxy should return 403 Forbidden."""
+    settings.DEBMONITOR_VERIFY_CLIENTS = True
+    settings.DEBMONITOR_PROXY_IMAGES = ['proxy.example.com']
+    extra = {middleware.SSL_CLIENT_VERIFY_HEADER: 'SUCCESS',
+             middleware.SSL_CLIENT_SUBJECT_DN_HEADER: 'CN=host1.example.com'}
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'images': []}), **extra)
+    assert response.status_code == 403
+    assert 'Unauthorized to modify images' in response.content.decode('utf-8')
+
+
+@pytest.mark.django_db
+def test_update_batch_proxy(client, settings):
+    """Updating multiple images from an image proxy host should return 201 Created."""
+    settings.DEBMONITOR_VERIFY_CLIENTS = True
+    settings.DEBMONITOR_PROXY_IMAGES = ['proxy.example.com']
+    extra = {middleware.SSL_CLIENT_VERIFY_HEADER: 'SUCCESS',
+             middleware.SSL_CLIENT_SUBJECT_DN_HEADER: 'CN=proxy.example.com'}
+    payload = _new_image_payload(str(uuid.uuid4()), 'a')
+    response = client.generic('POST', BATCH_UPDATE_URL, json.dumps({'images': [payload]}), **extra)
+    assert response.status_code == 201
@@ -1,11 +1,17 @@
+import json
+
 import pytest
 
 from unittest.mock import patch
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import resolve, reverse
 
+from debmonitor import generation
 from debmonitor.middleware import APPLICATION_JSON
 from kubernetes import views
+from kubernetes.models import KubernetesImage
 from tests.conftest import setup_auth_settings, validate_status_code
 
 
@@ -69,6 +75,19 @@ def test_index_view_function():
     assert view.func is views.index
 
 
+@pytest.mark.django_db
+def test_index_datatables(client):
+    """Requesting the kubernetes index page with the DataTables parameters should return the JSON rows."""
+    response = client.get(INDEX_URL, {'draw': '2', 'length': '-1', 'order[0][column]': '0', 'order[0][dir]': 'asc'})
+    data = json.loads(response.content.decode())
+
+    assert response.status_code == 200
+    assert data['draw'] == 2
+    assert data['recordsTotal'] == KubernetesImage.objects.count()
+    assert data['recordsFiltered'] == data['recordsTotal']
+    assert len(data['data']) == data['recordsTotal']
+
+
 def test_update_reverse_url_existing():
     """Reversing the update URL name should return the correct URL."""
     url = reverse('kubernetes:update')
@@ -119,6 +138,22 @@ def test_update_existing_ok(client):
     assert response_data['errors'] == []
 
 
+@pytest.mark.django_db
+def test_update_unchanged(client, django_capture_on_commit_callbacks):
+    """Updating the Kubernetes images with the same payload should bump the inventory generation only the first time."""
+    before = generation.get()
+    with django_capture_on_commit_callbacks(execute=True):
+        assert client.generic('POST', UPDATE_URL, PAYLOAD_UPDATE_EXISTING_OK).status_code == 201
+
+    current = generation.get()
+    assert current != before
+
+    with django_capture_on_commit_callbacks(execute=True):
+        assert client.generic('POST', UPDATE_URL, PAYLOAD_UPDATE_EXISTING_OK).status_code == 201
+
+    assert generation.get() == current
+
+
 @pytest.mark.django_db
 def test_update_new_ok(client):
     """Updating with a new Kubernetes image with a correct payload should return 201 Created."""
@@ -166,6 +201,44 @@ def test_update_missing_image(client):
     assert response_data['missing'] == ['registry.example.com/component/image-missing:1.2.3-1']
 
 
+@pytest.mark.django_db
+def test_update_reconcile(client):
+    """Updating a cluster should add, update and delete its Kubernetes images with a fixed number of queries."""
+    images = {
+        'registry.example.com/component/image-deployed:1.2.3-1': {'NamespaceB': 4},
+        'registry.example.com/component/image-name:1.2.3-1': {'NamespaceA': 1, 'NamespaceB': 2},
+    }
+    with CaptureQueriesContext(connection) as context:
+        response = client.generic('POST', UPDATE_URL, json.dumps({'cluster': 'ClusterA', 'images': images}))
+
+    assert response.status_code == 201
+    queries = len(context.captured_queries)
+    deployed = {(kub_image.namespace, kub_image.image.name): kub_image.containers
+                for kub_image in views.KubernetesImage.objects.filter(cluster='ClusterA')}
+    assert deployed == {(namespace, name): containers
+                        for name, data in images.items() for namespace, containers in data.items()}
+    assert not views.KubernetesImage.objects.filter(pk=1).exists()  # Not deployed anymore
+
+    images['registry.example.com/component/image-deployed:1.2.3-1'] = {'NamespaceA': 5, 'NamespaceB': 3}
+    images['registry.example.com/component/image-name:1.2.3-1'] = {'NamespaceC': 6}
+    with CaptureQueriesContext(connection) as context:
+        response = client.generic('POST', UPDATE_URL, json.dumps({'cluster': 'ClusterA', 'images': images}))
+
+    assert response.status_code == 201
+    assert len(context.captured_queries) == queries + 1  # All of inserts, updates and deletes
+    assert views.KubernetesImage.objects.filter(cluster='ClusterA').count() == 3
+
+
+@pytest.mark.django_db
+def test_update_negative_containers(client):
+    """Updating with a negative number of containers should skip that image and return the error."""
+    payload = PAYLOAD_UPDATE_EXISTING_OK.replace('"NamespaceA": 3', '"NamespaceA": -1')
+    response = client.generic('POST', UPDATE_URL, payload)
+    assert response.status_code == 202
+    assert response.json()['errors'][0]['error'] == "Field 'containers' expected a positive number but got -1."
+    assert not views.KubernetesImage.objects.filter(cluster='ClusterA').exists()
+
+
 @pytest.mark.django_db
 @patch('kubernetes.views._update_v1', side_effect=RuntimeError('error'))
 def test_update_raise(mocked_update_v1, client):
@@ -1,8 +1,11 @@
+import json
+
 import pytest
 
 from django.urls import resolve, reverse
 
 from src_packages import views
+from src_packages.models import SrcPackage
 from tests.conftest import setup_auth_settings, validate_status_code
 
 
@@ -31,6 +34,19 @@ def test_index_view_function():
     assert view.func is views.index
 
 
+@pytest.mark.django_db
+def test_index_datatables(client):
+    """Requesting the source packages index page with the DataTables parameters should return the JSON rows."""
+    response = client.get(INDEX_URL, {'draw': '2', 'length': '-1', 'order[0][column]': '0', 'order[0][dir]': 'asc'})
+    data = json.loads(response.content.decode())
+
+    assert response.status_code == 200
+    assert data['draw'] == 2
+    assert data['recordsTotal'] == SrcPackage.objects.count()
+    assert data['recordsFiltered'] == data['recordsTotal']
+    assert len(data['data']) == data['recordsTotal']
+
+
 def test_detail_reverse_url_existing():
     """Reversing an existing source package detail page URL name should return the correct URL."""
     url = reverse('src_packages:detail', kwargs={'name': 'package1'})